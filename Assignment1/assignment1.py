@@ -12,12 +12,19 @@ volgt aangeroepen te kunnen worden: python3 assignment1.py -n <aantal_cpus> [OPT
 
 """
 import argparse as ap
-import csv
-import itertools
 import sys
-from itertools import zip_longest
 from multiprocessing import Pool
-import numpy
+from pathlib import Path
+
+# make the shared fastq_stats package importable when started from this folder
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from fastq_stats import (SINGLE, FastqFollower, PhredAccumulator, RunReport, add_kernel_argument,
+                         add_layout_arguments, add_profile_arguments, add_sample_arguments,
+                         add_statistics_arguments, check_arguments, follow, get_array_task,
+                         get_cache, get_kernel, get_options, get_reports, make_jobs, process_jobs,
+                         process_jobs_threaded, replace_when_done, select_task_jobs, set_kernel,
+                         use_cprofile, use_kernel, write_partial, write_results)
 
 
 def argparser():
@@ -28,6 +35,39 @@ def argparser():
         - `-o` (optional): Specifies the output CSV file to store the results. If not
           provided, the output will be directed to the terminal (STDOUT).
         - `fastq_files` (required): One or more Fastq Format files to be processed.
+        - `--chunks` (optional): Number of byte ranges to split every file in, default 4 per
+          process.
+        - `--partial` (optional): Write a mergeable partial file instead of the CSV output. In a
+          SLURM job array every task only does its own part of the byte ranges.
+        - `--quantiles` (optional): Also output the first quartile, median, third quartile and
+          percentage of bases >= Q30 per position.
+        - `--by-tile` (optional): Also write the statistics per flowcell, lane and tile (taken
+          from the Illumina read names) to this CSV file.
+        - `--composition` (optional): Also write the number of A, C, G, T and N bases per
+          position (and the percentage of N) to this CSV file.
+        - `--gc-histogram` (optional): Also write the number of reads per GC percentage to this
+          CSV file.
+        - `--paired` (optional): The fastq files are R1/R2 pairs (R1 R2 [R1 R2 ...]); the mates
+          are read in lockstep and read 1 and read 2 get their own output.
+        - `--interleaved` (optional): Every fastq file holds both mates (R1, R2, R1, R2, ...);
+          read 1 and read 2 get their own output.
+        - `--sample` (optional): Only read this fraction of every file, in random blocks of
+          `--sample-block-size` bytes spread over the file (`--seed` for the same sample every
+          run). The output gets the standard error and the 95% confidence interval of the mean.
+        - `--follow` (optional): Keep following the fastq files while they are being written and
+          rewrite the `-o` output (and the extra outputs) every `--follow-interval` seconds.
+          Stops after `--follow-idle` seconds without new data, or with Ctrl-C.
+        - `--no-cache` (optional): Do not use the result cache. Without it the result of every
+          whole fastq file is cached (see fastq_stats.cache), so a rerun over an unchanged file
+          writes the output without decoding it again.
+        - `--kernel` (optional): Decode with the numba kernel or with NumPy (see
+          fastq_stats.kernels), default numba when it is installed.
+        - `--threads` (optional): Use `-n` threads in this process instead of `-n` processes
+          (see fastq_stats.threads).
+        - `--profile` (optional): Write the wall time, CPU time, bytes, records and peak memory
+          per stage (read, decode, transfer, reduce, write) and per worker to this JSON file
+          (see fastq_stats.profiling).
+        - `--cprofile` (optional): Write a cProfile dump per worker process to this folder.
 
         Returns:
             args: The parsed arguments as an object
@@ -48,6 +88,33 @@ def argparser():
                                  "terminal STDOUT")
     arg_parser.add_argument("fastq_files", action="store", type=ap.FileType('r'), nargs='+',
                             help="Minstens 1 Illumina Fastq Format file om te verwerken")
+    arg_parser.add_argument("--chunks", action="store", type=int, required=False,
+                            help="Aantal byte ranges per fastq file. Default is 4 per proces")
+    arg_parser.add_argument("--partial", action="store", type=str, required=False,
+                            help="Schrijf sums en counts naar dit .npz bestand in plaats van de "
+                                 "CSV output. {task} wordt vervangen door het SLURM array task "
+                                 "id. Samenvoegen met python3 -m fastq_stats.combine")
+    add_statistics_arguments(arg_parser)
+    add_layout_arguments(arg_parser)
+    add_sample_arguments(arg_parser)
+    add_kernel_argument(arg_parser)
+    add_profile_arguments(arg_parser)
+    arg_parser.add_argument("--threads", action="store_true",
+                            help="Gebruik -n threads in 1 proces in plaats van -n processen. De "
+                                 "threads lezen uit 1 gedeelde mmap per file, er wordt niets "
+                                 "gepickled. Het snelst met de numba kernel")
+    arg_parser.add_argument("--follow", action="store_true",
+                            help="Blijf de fastq files volgen terwijl de sequencer ze schrijft en "
+                                 "schrijf de output (-o is nodig) steeds opnieuw. Alleen nieuwe "
+                                 "records worden gelezen, in 1 proces")
+    arg_parser.add_argument("--follow-interval", action="store", type=float, default=30.0,
+                            dest="follow_interval",
+                            help="Minimaal aantal seconden tussen twee keer de output schrijven "
+                                 "met --follow (default 30)")
+    arg_parser.add_argument("--follow-idle", action="store", type=float, required=False,
+                            dest="follow_idle",
+                            help="Stop met --follow als er zoveel seconden geen nieuwe data is "
+                                 "(default: door gaan tot Ctrl-C)")
     args = arg_parser.parse_args()
 
     print("arguments received")
@@ -59,165 +126,69 @@ def argparser():
     return args
 
 
-encoded_quality_score_list = []
-
-
-def get_size_chunks(n_processes, file_line_count):
-    """
-    calculated the chunk size of fasta file based on total file count and amount of processes
-    Args:
-        n_processes int: amount of processes
-        file_line_count int: total amount of lines in a fastq file
-
-    Returns:
-        chunk_size * 4: amount of line for a singel process/chunk
-
-    """
-    # get amount of reads
-    read_amount = file_line_count // 4
-    # get the size of chunks
-    chunk_size = read_amount // n_processes + (read_amount % n_processes)
-    return chunk_size * 4
-
-
-def get_part_file(fastq_file, start, chunk_size):
-    """
-    Returns a chunk of lines from a FASTQ file.
-
-    Args:
-        fastq_file (str): The path to the FASTQ file.
-        start (int): The starting line number from which to begin.
-        chunk_size (int): size of the chunk.
-
-    Returns:
-        A single chunk of the fastq file, list of strings
+def process_wrapper(n_processes, jobs, fastq_paths, options=None, layout=SINGLE, threads=False,
+                    report=None):
     """
+    Run the jobs on a pool of n_processes workers, or in this process when n_processes is 1
 
-    with open(fastq_file, "r", encoding='UTF-8') as file:
-        file_chunk = []
-        for line in itertools.islice(file, start, (start + chunk_size)):
-            file_chunk.append(line)
-    return file_chunk
-
-
-def get_quality_score_lines(fastq_file):
-    """
-    gets only the q base call quality scores from a fasta file
     Args:
-        fastq_file:
+        n_processes int: amount of processes (or threads)
+        jobs: list of jobs made by make_jobs
+        fastq_paths: list of fastq file paths
+        options dict: options for the accumulators (histogram, group_by_tile, composition)
+        layout str: SINGLE, PAIRED or INTERLEAVED
+        threads bool: use n_processes threads in this process instead of processes
+        report RunReport: report to add the stages to (optional)
 
     Returns:
-        list contaning the encoded base call quality scores lines
-
-    """
-    count = 0
-    for count, line in enumerate(fastq_file):
-
-        # count + 1 to make the list start with 1 instead of 0
-        # get every 4th line in the FastQ file
-        if (count + 1) % 4 == 0:
-            # remove newline (\n)
-            line = line[:-2]
-            # add all lines to a list
-            encoded_quality_score_list.append(line)
-
-    return encoded_quality_score_list, count
-
-
-# change to only one line as input
-def decode_fastq_quality_score(encoded_quality_scores):
-    """
-    translates the base call quality score to a numeric value. Quality scores are Phred +33
-    encoded,using ASCII characters to represent the numerical quality scores.
-
-    Args:
-        encoded_quality_scores list: Phred +33 encoded base call quality score
-    Returns:
-        decoded score: numeric base call quality score
-    """
-
-    decoded_score = []
-    for ascii_chr in encoded_quality_scores:
-        numeric_score = ord(ascii_chr) - 33
-        decoded_score.append(numeric_score)
-
-    # return only 1 line of input
-    return decoded_score
-
-
-def process_wrapper(n_processes, encoded_score_list):
-    """
-    get the functions together for one job to go in the pool function
-    """
-    with Pool(n_processes) as job_pool:
-        print("start pools...")
-        # put single line
-        decoded_score_list = (job_pool.map(decode_fastq_quality_score, encoded_score_list))
+        list of PhredAccumulator, one for every fastq file (one per mate for paired data)
+    """
+    if n_processes == 1:
+        # serial backend, no pool to start and no results to pickle
+        accumulators = process_jobs(jobs, fastq_paths, options, layout, report=report)
+    elif threads:
+        print("start threads...")
+        accumulators = process_jobs_threaded(jobs, fastq_paths, n_processes, options, layout,
+                                             report)
+    else:
+        # the workers use the same decode kernel, also when they are not forked
+        with Pool(n_processes, initializer=set_kernel, initargs=(get_kernel(),)) as job_pool:
+            print("start pools...")
+            accumulators = process_jobs(jobs, fastq_paths, options, layout,
+                                        job_pool.imap_unordered, report)
     print("jobs done")
 
-    return decoded_score_list
+    return accumulators
 
 
-def get_mean_score(decoded_list):
+def follow_files(args, fastq_paths, options):
     """
-    Calculates the mean quality score for each position across multiple sequences.
-
-    This function takes a list of lists, where each inner list contains quality scores for a
-    sequence, and calculates the mean score at each position across all sequences. If sequences
-    are of different lengths, positions without scores are treated as containing `None` and are
-    ignored in the mean calculation.
-
-    Args:
-        decoded_list: (list of list with int): A list where
-        each element is a list of quality scores for a sequence.
-
-    Returns:
-        list of int: A list of mean quality scores for each position across all sequences.
-
-    """
-    print("get mean quality score...")
-    sum_list = [numpy.mean(x) for x in (zip_longest(*decoded_list))]
-
-    return sum_list
-
-
-def write_outfile(args, sum_list, fastqfile):
-    """
-    Writes the mean quality scores to an output destination.
-    Either a specified csv file or printed to the terminal if no file is given
+    Follow the fastq files while they are being written and rewrite the outputs with the results
+    so far. The accumulators stay in memory, only new records are decoded.
 
     Args:
         args: list of args from argparser
-        sum_list: list of int, A list of mean quality scores for each position across all sequences.
-        fastqfile: csv file
-
-    Returns:
-        0
-
+        fastq_paths: list of fastq file paths
+        options dict: options for the accumulators (histogram, group_by_tile, composition)
     """
-    print("write outfile...")
-    base_num = list(range(1, len(sum_list) + 1))
+    accumulators = [PhredAccumulator(**options) for _ in fastq_paths]
+    followers = [FastqFollower(fastq_path, accumulator)
+                 for fastq_path, accumulator in zip(fastq_paths, accumulators)]
+    reports = get_reports(args)
 
-    # add base number by value
-    final_list = list(zip(base_num, sum_list))
+    def write_outputs():
+        print(f"write outfile... ({sum(accumulator.n_reads for accumulator in accumulators)} "
+              f"reads)")
+        # every output is replaced in one go, so a reader never sees half a file
+        with replace_when_done(args.csvfile.name) as tmp_path:
+            with open(tmp_path, "w", newline="", encoding="utf-8") as csvfile:
+                write_results(csvfile, fastq_paths, accumulators)
+        for write_report, csv_path in reports:
+            with replace_when_done(csv_path) as tmp_path:
+                write_report(tmp_path, fastq_paths, accumulators)
 
-    if args.csvfile is None:
-        # stdout
-
-        for row in final_list:
-            sys.stdout.write(str(row) + "\n")
-
-    else:
-
-        # write into csv file
-
-        writer = csv.writer(args.csvfile)
-        # if only 1 file is given, don't writhe name in outfile
-        if len(args.fastq_files) != 1:
-            writer.writerow([fastqfile.name])
-        writer.writerows(final_list)
-
-    return 0
+    args.csvfile.close()
+    follow(followers, write_outputs, args.follow_interval, args.follow_idle)
 
 
 def main():
@@ -229,14 +200,50 @@ def main():
 
     """
     args = argparser()
-
-    for fastqfile in args.fastq_files:
-        quality_score_lines_list, file_length = get_quality_score_lines(fastqfile)
-        get_size_chunks(args.n, file_length)
-        print("decode score...")
-        decoded_score_list = process_wrapper(args.n, quality_score_lines_list)
-        sum_list = get_mean_score(decoded_score_list)
-        write_outfile(args, sum_list, fastqfile)
+    fastq_paths = [fastqfile.name for fastqfile in args.fastq_files]
+    try:
+        # paired data has an output for read 1 and read 2
+        output_names = check_arguments(args, fastq_paths)
+        use_kernel(args)
+        use_cprofile(args)
+    except ValueError as error:
+        sys.exit(str(error))
+
+    options = get_options(args)
+    if args.follow:
+        if (args.csvfile is None or args.partial or args.sample is not None
+                or args.layout != SINGLE):
+            sys.exit("--follow needs -o and single fastq files, without --partial or --sample")
+        follow_files(args, fastq_paths, options)
+        print("all done!")
+        return 0
+
+    # only results of complete, whole files go in the cache
+    cache = get_cache(args)
+    cached = cache.lookup(fastq_paths, options) if cache is not None else {}
+
+    # in a job array with partial output every task only does its own part of the files
+    task = get_array_task() if args.partial else (0, 1)
+    jobs = make_jobs(args, fastq_paths, args.chunks or args.n * 4)
+    jobs = [job for job in select_task_jobs(jobs, *task) if job[0] not in cached]
+
+    report = RunReport("threads" if args.threads else "pool" if args.n > 1 else "serial")
+    print("decode score...")
+    accumulators = process_wrapper(args.n, jobs, fastq_paths, options, args.layout,
+                                   args.threads, report)
+    if cache is not None:
+        for file_idx, accumulator in cached.items():
+            accumulators[file_idx] = accumulator
+        cache.store(accumulators)
+
+    with report.stage("write"):
+        if args.partial:
+            write_partial(args.partial.format(task=task[0]), output_names, accumulators, task)
+        else:
+            print("get mean quality score...")
+            write_results(args.csvfile, output_names, accumulators, get_reports(args))
+    if args.profile:
+        report.write(args.profile)
     print("all done!")
 
 
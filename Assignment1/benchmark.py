@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark van de process pool tegen de threads (--threads) van assignment1.py, op precies
+dezelfde byte ranges. Elke combinatie van engine en kernel wordt een paar keer gedraaid en de
+tijden komen in een CSV file (test,kernel,workers,time,repeat), net als Assignment5/benchmark.py.
+
+Example:
+    python3 benchmark.py -n 4 -r 3 rnaseq.fastq
+"""
+import argparse as ap
+import sys
+from pathlib import Path
+from timeit import timeit
+
+import numpy
+
+# make the shared fastq_stats package importable when started from this folder
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from fastq_stats import SINGLE, get_kernel, make_layout_jobs, set_kernel
+from fastq_stats.kernels import NUMBA, NUMPY, compiled_walk_quality_lines
+from assignment1 import process_wrapper
+
+
+def argparser():
+    """
+    Parses command line arguments for the benchmark.
+
+    Returns:
+        args: The parsed arguments as an object
+    """
+    arg_parser = ap.ArgumentParser(description="Benchmark process pool tegen threads")
+    arg_parser.add_argument("-n", action="store", dest="n", required=True, type=int,
+                            help="Aantal processen of threads.")
+    arg_parser.add_argument("-r", action="store", dest="repeats", type=int, default=3,
+                            help="Aantal keer dat elke test gedraaid wordt (default 3).")
+    arg_parser.add_argument("-o", action="store", dest="output_file",
+                            default="benchmark_threads.csv",
+                            help="CSV file voor de tijden (default benchmark_threads.csv).")
+    arg_parser.add_argument("fastq_files", action="store", nargs='+',
+                            help="Fastq files om te verwerken")
+    return arg_parser.parse_args()
+
+
+def log_benchmark(output_file, test, kernel, workers, time, repeats):
+    """
+    Add one result to the CSV file.
+    """
+    with open(output_file, "a", encoding="utf-8") as file:
+        file.write(f"{test},{kernel},{workers},{time},{repeats}\n")
+
+
+def main():
+    """
+    Time the pool and the threads with every available kernel.
+    """
+    args = argparser()
+    # the same jobs for every test
+    jobs = make_layout_jobs(args.fastq_files, args.n * 4, SINGLE)
+    kernels = [NUMPY] if compiled_walk_quality_lines is None else [NUMPY, NUMBA]
+
+    with open(args.output_file, "w", encoding="utf-8") as file:
+        file.write("test,kernel,workers,time,repeat\n")
+
+    for kernel in kernels:
+        set_kernel(kernel)
+        # warm up (compiles the numba kernel) and check that both give the same result
+        pool_result = process_wrapper(args.n, jobs, args.fastq_files)
+        thread_result = process_wrapper(args.n, jobs, args.fastq_files, threads=True)
+        for pool_acc, thread_acc in zip(pool_result, thread_result):
+            if not (numpy.array_equal(pool_acc.sums, thread_acc.sums)
+                    and numpy.array_equal(pool_acc.counts, thread_acc.counts)):
+                sys.exit(f"pool and threads give a different result with kernel {kernel}")
+
+        for test, threads in (("pool", False), ("threads", True)):
+            time = timeit(lambda threads=threads: process_wrapper(
+                args.n, jobs, args.fastq_files, threads=threads), number=args.repeats)
+            print(f"{test} with {get_kernel()} kernel and {args.n} workers: "
+                  f"{time / args.repeats:.3f} s per run")
+            log_benchmark(args.output_file, test, get_kernel(), args.n, time, args.repeats)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
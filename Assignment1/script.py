@@ -19,17 +19,15 @@ to work in parallel, using multiprocessing.
 
 NB3: Your script needs to accept _exactly_ the options above, _and require no others_
 """
-import itertools
-import os
-import sys
-from statistics import mean
-from typing import List
-from itertools import zip_longest
 import argparse
-import csv
+import sys
 from multiprocessing import Pool
+from pathlib import Path
 
-import numpy as numpy
+# make the shared fastq_stats package importable when started from this folder
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from fastq_stats import SINGLE, make_layout_jobs, process_jobs, write_results
 
 
 def argparser():
@@ -50,116 +48,28 @@ def argparser():
     return args
 
 
-encoded_quality_score_list = list()
-
-
-def get_file_length(fastq_file):
-    with open(fastq_file) as open_file:
-        for count, line in enumerate(open_file):
-            pass
-    # quick check if lines divede by 4
-    if (count + 1) % 4 != 0:
-        sys.exit("line count cant be diveded by 4 \n Faulty file?")
-    # remember python list starts at 0
-    open_file.close()
-    return count + 1
-
-
-def get_size_chunks(n_procceses, file_line_count):
-    # get amount of reads
-    read_amount = file_line_count // 4
-    # get the size of chunks
-    chunk_size = read_amount // n_procceses + (read_amount % n_procceses)
-    print(chunk_size * 4)
-    return chunk_size * 4
-
-
-def get_part_file(fastq_file, start, chunk_size):
-    with open(fastq_file, "r") as file:
-        file_chunk = []
-        for line in itertools.islice(file, start, (start + chunk_size)):
-            file_chunk.append(line)
-    return file_chunk
-
-
-def get_quality_score_lines(fastq_file):
-    with open(fastq_file) as open_file:
-        print("opening file...")
-        print("finding score lines...")
-        # read lines
-        for count, line in enumerate(open_file):
-            # count + 1 to make the list start with 1 instead of 0
-            # get every 4th line in the FastQ file
-            if (count + 1) % 4 == 0:
-                # remove newline (\n)
-                line = line[:-2]
-                # add all lines to a list
-                encoded_quality_score_list.append(line)
-    return encoded_quality_score_list
-
-
-# change to only one line as input
-def decode_fastq_quality_score(encoded_quality_score):
-    """
-    decode the quality sore from the fastQ file from ascii to numerical score
-    Q-score is the ascii code - 33
-    """
-
-    decoded_score = list()
-    for ascii_chr in encoded_quality_score:
-        score_number = ord(ascii_chr) - 33
-        decoded_score.append(score_number)
-
-    # return only 1 line of input
-    return decoded_score
-
-
-def procces_wrapper(n_processes, encoded_quality_score_list):
+def procces_wrapper(n_processes, fastq_paths):
     """
-    get the functions together for one job to go in the pool function
+    run the byte range jobs of the shared engine, in this process or in a pool
     """
-    job_pool = Pool(n_processes)
-    print("start pools...")
-    # put single line
-    decoded_score_list = (job_pool.map(decode_fastq_quality_score, encoded_quality_score_list))
-    job_pool.close()
+    jobs = make_layout_jobs(fastq_paths, n_processes * 4, SINGLE)
+    if n_processes == 1:
+        return process_jobs(jobs, fastq_paths)
+    with Pool(n_processes) as job_pool:
+        print("start pools...")
+        accumulators = process_jobs(jobs, fastq_paths, map_func=job_pool.imap_unordered)
     print("jobs done")
 
-    return decoded_score_list
-
-
-def get_mean_score(decoded_list):
-    print("get mean...")
-    sum_list = [numpy.mean(x) for x in (zip_longest(*decoded_list))]
-
-    return sum_list
-
-
-def write_outfile(args, sum_list):
-    print("write outfile...")
-    base_num = list(range(1, len(sum_list) + 1))
-
-    # add base number by value
-    final_list = list(zip(base_num, sum_list))
-
-    # write into csv file
-    with open(args.outputfile, "w", newline="\n") as file:
-        writer = csv.writer(file)
-        writer.writerows(final_list)
-
-    return 0
+    return accumulators
 
 
 def main():
     args = argparser()
 
-    file_length = get_file_length(args.fastqfile)
-    get_size_chunks(args.number_of_processes, file_length)
-    quality_score_lines_list = get_quality_score_lines(args.fastqfile)
     print("decode score...")
-    decoded_score_list = procces_wrapper(args.number_of_processes, quality_score_lines_list)
-    sum_list = get_mean_score(decoded_score_list)
-    write_outfile(args, sum_list)
+    accumulators = procces_wrapper(args.number_of_processes, [args.fastqfile])
+    with open(args.outputfile, "w", newline="", encoding="utf-8") as file:
+        write_results(file, [args.fastqfile], accumulators)
     print("all done!")
 
 
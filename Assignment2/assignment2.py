@@ -40,15 +40,21 @@ voor server>
 """
 
 import argparse as ap
-import csv
-import itertools
 import multiprocessing as mp
+import os
 import queue
 import sys
 import time
-from itertools import zip_longest
 from multiprocessing.managers import BaseManager
-import numpy
+from pathlib import Path
+
+# make the shared fastq_stats package importable when started from this folder
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from fastq_stats import (SINGLE, Checkpoint, RunReport, add_kernel_argument, add_profile_arguments,
+                         add_statistics_arguments, get_array_task, get_cache, get_options,
+                         get_reports, make_jobs, run_job, select_task_jobs, use_cprofile,
+                         use_kernel, write_partial, write_results)
 
 POISONPILL = "MEMENTOMORI"
 ERROR = "DOH"
@@ -65,6 +71,29 @@ def argparser():
         - `-o` (optional): Specifies the output CSV file to store the results. If not
           provided, the output will be directed to the terminal (STDOUT).
         - `fastq_files` (required): One or more Fastq Format files to be processed.
+        - `--checkpoint` (optional): File to periodically save the progress of the server to.
+        - `--checkpoint-interval` (optional): Seconds between two checkpoint saves.
+        - `--resume` (optional): Continue from the file given with `--checkpoint`.
+        - `--partial` (optional): Write a mergeable partial file instead of the CSV output. In a
+          SLURM job array every task only does its own part of the byte ranges.
+        - `--quantiles` (optional): Also output the first quartile, median, third quartile and
+          percentage of bases >= Q30 per position.
+        - `--by-tile` (optional): Also write the statistics per flowcell, lane and tile (taken
+          from the Illumina read names) to this CSV file.
+        - `--composition` (optional): Also write the number of A, C, G, T and N bases per
+          position (and the percentage of N) to this CSV file.
+        - `--gc-histogram` (optional): Also write the number of reads per GC percentage to this
+          CSV file.
+        - `--no-cache` (optional): Do not use the result cache. Without it the result of every
+          whole fastq file is cached (see fastq_stats.cache), so a rerun over an unchanged file
+          writes the output without decoding it again.
+        - `--kernel` (optional, client): Decode with the numba kernel or with NumPy (see
+          fastq_stats.kernels), default numba when it is installed.
+        - `--profile` (optional, server): Write the wall time, CPU time, bytes, records and peak
+          memory per stage (read, decode, transfer, reduce, write) and per client process to this
+          JSON file (see fastq_stats.profiling).
+        - `--cprofile` (optional, client): Write a cProfile dump per worker process to this
+          folder.
 
         Returns:
             args: The parsed arguments as an object
@@ -97,6 +126,19 @@ def argparser():
                              help="Minstens 1 Illumina Fastq Format file om te verwerken")
     server_args.add_argument("--chunks", action="store", type=int,
                              help="Aantal chunks of de fastq file(s) in op te splitsen.")
+    server_args.add_argument("--checkpoint", action="store", type=str,
+                             help="File om de voortgang periodiek in op te slaan.")
+    server_args.add_argument("--checkpoint-interval", action="store", type=float, default=60.0,
+                             dest="checkpoint_interval",
+                             help="Minimaal aantal seconden tussen twee checkpoints (default 60).")
+    server_args.add_argument("--resume", action="store_true",
+                             help="Ga verder waar de run in --checkpoint gebleven was.")
+    server_args.add_argument("--partial", action="store", type=str,
+                             help="Schrijf sums en counts naar dit .npz bestand in plaats van de "
+                                  "CSV output. {task} wordt vervangen door het SLURM array task "
+                                  "id, ook in --checkpoint. Samenvoegen met "
+                                  "python3 -m fastq_stats.combine")
+    add_statistics_arguments(server_args)
 
     client_args = arg_parser.add_argument_group(title="Arguments when run in client mode")
     client_args.add_argument("-n", action="store",
@@ -106,9 +148,16 @@ def argparser():
                              help="The hostname where the Server is listening")
     client_args.add_argument("--port", action="store", type=int,
                              help="The port on which the Server is listening")
+    add_kernel_argument(client_args)
+
+    # --profile is used by the server, --cprofile by the clients
+    add_profile_arguments(arg_parser)
 
     args = arg_parser.parse_args()
 
+    if args.resume and args.checkpoint is None:
+        arg_parser.error("--resume needs --checkpoint")
+
     return args
 
 
@@ -146,45 +195,59 @@ def make_server_manager(port, authkey):
     return manager
 
 
-def runserver(func, data, outfile, fastqfiles):
+def distribute_jobs(func, checkpoint, fastqfiles, report):
     """
-    Execute tasks on the server and manage the output to CSV files.
+    Send the byte ranges that are not done yet to the clients and merge the results into the
+    checkpoint.
 
     Args:
-        func: The function to be applied to each chunk of data.
-        data: The data to be processed, divided into chunks.
-        outfile: The CSV file to write the output to.
+        func: The function to be applied to each byte range of a fastq file.
+        checkpoint: Checkpoint with the planned byte ranges and the results so far.
         fastqfiles: A list of fastq files.
+        report: RunReport to add the stages of the server and the clients to.
 
+    Returns:
+        int: number of byte ranges that failed
     """
     # Start a shared manager server and access its queues
     manager = make_server_manager(PORTNUM, b'whathasitgotinitspocketsesss?')
     shared_job_q = manager.get_job_q()
     shared_result_q = manager.get_result_q()
 
-    if not data:
-        print("Gimme something to do here!")
-        return
-
+    # only send the byte ranges that are not in the checkpoint yet
+    todo = checkpoint.todo()
     print("Sending data!")
-    for idx, chunk_list in enumerate(data):
-        for chunk in chunk_list:
-            shared_job_q.put({'func': func, 'arg': chunk, 'file_idx': idx})
+    # clients read the ranges themselves, so send the absolute paths
+    fastq_paths = [os.path.abspath(fastqfile.name) for fastqfile in fastqfiles]
+    for job in todo:
+        shared_job_q.put({'func': func, 'arg': (job, fastq_paths, SINGLE, checkpoint.options),
+                          'job': job})
 
     time.sleep(2)
-    results = []
-    while True:
-        try:
-            result = shared_result_q.get_nowait()
-            results.append(result)
-            print("Got result!")
-            if len(results) == sum(len(chunks) for chunks in data):
-                print("Got all results!")
-                break
-
-        except queue.Empty:
-            time.sleep(1)
+    n_results = 0
+    n_failed = 0
+    while n_results < len(todo):
+        # waiting for the clients is part of the transfer stage
+        with report.stage("transfer"):
+            try:
+                result = shared_result_q.get_nowait()
+            except queue.Empty:
+                result = None
+                time.sleep(1)
+        if result is None:
             continue
+        n_results += 1
+        print("Got result!")
+        if result['result'] == ERROR:
+            print(f"Range {result['job']} failed, it will be missing from the output")
+            n_failed += 1
+            continue
+        _, accumulators, job_profile = result['result']
+        report.add_job(job_profile)
+        # merge the result and save a checkpoint once in a while
+        with report.stage("reduce"):
+            checkpoint.add_result(result['job'], accumulators)
+    print("Got all results!")
     # Tell the client process no more data will be forthcoming
     print("Time to kill some peons!")
     shared_job_q.put(POISONPILL)
@@ -194,23 +257,57 @@ def runserver(func, data, outfile, fastqfiles):
     time.sleep(5)
     print("Aaaaaand we're done for the server!")
     manager.shutdown()
+    return n_failed
 
-    # get mean
-    all_decoded_scores = [[] for _ in range(len(fastqfiles))]
-    for job in results:
-        # job is a dict
-        decoded_score = job["result"]
-        file_idx = job["file_idx"]
-        all_decoded_scores[file_idx].extend(decoded_score)
 
-    # check if one fastqfile and set flag
-    multi_file_flag = len(fastqfiles) != 1
+def runserver(func, checkpoint, outfile, fastqfiles, partial=None, task=(0, 1), reports=(),
+              cache=None, profile=None):
+    """
+    Execute tasks on the server and manage the output to CSV files.
 
-    # Calculate mean scores and write out results for each fastqfile
-    for file_idx, decoded_scores in enumerate(all_decoded_scores):
-        mean_score_list = get_mean_score(decoded_scores)
-        fastqfile_name = fastqfiles[file_idx].name
-        write_outfile(outfile, mean_score_list, fastqfile_name, multi_file_flag)
+    Args:
+        func: The function to be applied to each byte range of a fastq file.
+        checkpoint: Checkpoint with the planned byte ranges and the results so far.
+        outfile: The CSV file to write the output to.
+        fastqfiles: A list of fastq files.
+        partial: Partial file to write instead of the CSV output (optional).
+        task: (task_idx, n_tasks) of the SLURM array task, stored in the partial file.
+        reports: (write function, CSV file) tuples for the extra outputs, like the per tile
+            statistics (optional).
+        cache: ResultCache after the lookup of the fastq files, the results of the other files
+            are stored in it (optional).
+        profile: JSON file to write the profile of the run to (optional).
+
+    """
+    if not checkpoint.jobs and not (cache is not None and cache.hits):
+        print("Gimme something to do here!")
+        return
+
+    report = RunReport("manager")
+    # when every file came from the cache there is nothing to send to the clients
+    n_failed = distribute_jobs(func, checkpoint, fastqfiles, report) if checkpoint.todo() else 0
+
+    if partial is not None:
+        with report.stage("write"):
+            write_partial(partial, [fastqfile.name for fastqfile in fastqfiles],
+                          checkpoint.accumulators, task)
+        checkpoint.remove()
+    else:
+        # Calculate mean scores and write out results for each fastqfile
+        fastq_names = [fastqfile.name for fastqfile in fastqfiles]
+        with report.stage("write"):
+            if outfile is None:
+                write_results(None, fastq_names, checkpoint.accumulators, reports)
+            else:
+                # this runs in a child process, so open the output again by name
+                with open(outfile.name, 'a', newline='', encoding='utf-8') as csvfile:
+                    write_results(csvfile, fastq_names, checkpoint.accumulators, reports)
+        # results with missing ranges are not cached
+        if cache is not None and n_failed == 0:
+            cache.store(checkpoint.accumulators)
+        checkpoint.remove()
+    if profile:
+        report.write(profile)
 
 
 def make_client_manager(ip_address, port, authkey):
@@ -305,158 +402,16 @@ def peon(job_q, result_q):
             try:
                 result = job['func'](job['arg'])
                 print(f"Peon {my_name} Workwork on {job['arg']}!")
-                result_q.put({'file_idx': job['file_idx'], 'result': result})
+                result_q.put({'job': job['job'], 'result': result})
             except NameError:
                 print("Can't find yer fun Bob!")
-                result_q.put({'file_idx': job['file_idx'], 'result': ERROR})
+                result_q.put({'job': job['job'], 'result': ERROR})
 
         except queue.Empty:
             print("sleepytime for", my_name)
             time.sleep(1)
 
 
-def get_size_chunks(n_procceses, file_line_count):
-    """
-    calculated the chunk size of fasta file based on total file count and amount of processes
-    Args:
-        n_processes int: amount of processes
-        file_line_count int: total amount of lines in a fastq file
-
-    Returns:
-        chunk_size * 4: amount of line for a singel process/chunk
-
-    """
-    # get amount of reads
-    read_amount = file_line_count // 4
-    # get the size of chunks
-    chunk_size = read_amount // n_procceses + (read_amount % n_procceses)
-    return chunk_size * 4
-
-
-def get_part_file(fastq_file, start, chunk_size):
-    """
-    Returns a chunk of lines from a FASTQ file.
-
-    Args:
-        fastq_file (str): The path to the FASTQ file.
-        start (int): The starting line number from which to begin.
-        chunk_size (int): size of the chunk.
-
-    Returns:
-        A single chunk of the fastq file, list of strings
-    """
-    with open(fastq_file, "r", encoding='utf-8') as file:
-        file_chunk = []
-        for line in itertools.islice(file, start, (start + chunk_size)):
-            file_chunk.append(line)
-    return file_chunk
-
-
-def get_quality_score_lines(fastq_file):
-    """
-    gets only the q base call quality scores from a fasta file
-    Args:
-        fastq_file:
-
-    Returns:
-        list contaning the encoded base call quality scores lines
-
-    """
-    encoded_quality_score_list = []
-    for count, line in enumerate(fastq_file):
-
-        # count + 1 to make the list start with 1 instead of 0
-        # get every 4th line in the FastQ file
-        if (count + 1) % 4 == 0:
-            # remove newline (\n)
-            line = line.rstrip('\n')
-            # add all lines to a list
-            encoded_quality_score_list.append(line)
-
-    return encoded_quality_score_list, count
-
-
-def decode_fastq_quality_score(encoded_quality_score):
-    """
-    decode the quality sore from the fastQ file from ascii to numerical score
-    Q-score is the ascii code - 33
-
-    Args:
-        chunk of fastq quality score line from a fastq file
-    """
-    decoded_scores = []
-    for line in encoded_quality_score:
-        decoded_score = [ord(ascii_chr) - 33 for ascii_chr in line]
-        decoded_scores.append(decoded_score)
-    return decoded_scores
-
-
-def process_wrapper(chunk):
-    """
-    decode a chunk (list) of fastq result lines and return a chunk (list) of results
-    """
-    return decode_fastq_quality_score(chunk)
-
-
-def get_mean_score(decoded_list):
-    """
-    Get mean score of lists based on index
-    Args:
-        decoded_list: list of decoded pred scores from a fastq file
-
-    Returns:
-        mean_score_list: list with mean pred scores
-
-    """
-    print("get mean...")
-    mean_score_list = [numpy.mean(x) for x in zip_longest(*decoded_list, fillvalue=0)]
-    return mean_score_list
-
-
-def write_outfile(csvfile, mean_score_list, fastqfile_name, multi_file):
-    """
-    Write the output to a csv file or print to terminal if no file is given.
-    
-    Args:
-        csvfile: the file name of output file
-        mean_score_list: list of mean pred scores
-        fastqfile_name: name of fastqfile to keep track of mutiple files
-
-    Returns:
-
-    """
-    print("write outfile...")
-    base_num = list(range(1, len(mean_score_list) + 1))
-    # add base number by value
-    final_list = list(zip(base_num, mean_score_list))
-    if csvfile is None:
-        # stdout
-        writer = csv.writer(sys.stdout)
-        writer.writerows(final_list)
-    else:
-        # write into csv file
-        with open(csvfile.name, 'a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            # Add fastqfile name to the CSV if more then one file
-            if multi_file:
-                writer.writerow([fastqfile_name])  # Add fastqfile name to the CSV
-            writer.writerows(final_list)
-    return 0
-
-
-def divide_chunks(lst, n_chunks):
-    """
-    divides list into equal chunks
-    
-    Args:
-        lst: list
-        n_chunks: number of chunks wanted
-    """
-    chunk_size = int(numpy.floor(len(lst) // n_chunks))
-    chunk_list = [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)]
-    return chunk_list
-
-
 def main():
     """
     The main function, called if script is called by name
@@ -465,24 +420,51 @@ def main():
     args = argparser()
     if args.s:
         print("start server mode")
-        data = []
         outfile = args.csvfile
         fastqfiles = args.fastq_files
-
-        for fastqfile in fastqfiles:
-            # Process each file and append the results to data
-            quality_score_lines_list, file_length = get_quality_score_lines(fastqfile)
-            if args.chunks is None:
-                args.chunks = mp.cpu_count()
-            job_data = divide_chunks(quality_score_lines_list, args.chunks)
-            data.append(job_data)
-
-        server = mp.Process(target=runserver, args=(process_wrapper, data, outfile, fastqfiles))
+        if args.chunks is None:
+            args.chunks = mp.cpu_count()
+
+        # in a job array with partial output every task only does its own part of the files
+        task = get_array_task() if args.partial else (0, 1)
+        partial = args.partial.format(task=task[0]) if args.partial else None
+        checkpoint_path = args.checkpoint.format(task=task[0]) if args.checkpoint else None
+
+        # the checkpoint also holds the merged results, it is only written if a file is given
+        checkpoint = Checkpoint(checkpoint_path, [fastqfile.name for fastqfile in fastqfiles],
+                                args.checkpoint_interval, get_options(args))
+        # only results of complete, whole files go in the cache
+        cache = get_cache(args)
+        if cache is not None:
+            cached = cache.lookup([fastqfile.name for fastqfile in fastqfiles],
+                                  checkpoint.options)
+        # without a checkpoint file (first run of a requeued job) start from scratch
+        if not (args.resume and checkpoint.load()):
+            jobs = make_jobs(args, [fastqfile.name for fastqfile in fastqfiles], args.chunks)
+            if cache is not None:
+                # files that are in the cache are not decoded again
+                jobs = [job for job in jobs if job[0] not in cached]
+                for file_idx, accumulator in cached.items():
+                    checkpoint.accumulators[file_idx] = accumulator
+            checkpoint.set_jobs(select_task_jobs(jobs, *task))
+
+        # extra CSV outputs, written next to the normal output
+        reports = get_reports(args)
+
+        server = mp.Process(target=runserver,
+                            args=(run_job, checkpoint, outfile, fastqfiles, partial,
+                                  task, reports, cache, args.profile))
         server.start()
         time.sleep(1)
         server.join()
     elif args.c:
         print("start client mode")
+        try:
+            # the client and its workers are forked, so they use this kernel as well
+            use_kernel(args)
+            use_cprofile(args)
+        except ValueError as error:
+            sys.exit(str(error))
         client = mp.Process(target=runclient, args=(args.n or 1,))
         client.start()
         client.join()
@@ -6,28 +6,57 @@ Script for assignment 3 of big data computing
 Script decoding for the pred score form fastq files and calculating the mean.
 This script was made to work with assignment3.sh
 
-this scrit has two modes
+The stages pass per position sums and counts to each other as binary numpy (.npy) arrays of
+shape (2, positions): row 0 holds the sums and row 1 the counts. With `--quantiles` the arrays
+are PHRED histograms of shape (94, positions) instead, and the mean stage also prints the first
+quartile, median, third quartile and percentage >= Q30. Any number of these arrays can be
+concatenated, so the output of many decode processes can simply be piped into the mean stage.
+
+this scrit has three modes
 Decode Quality Scores:
    Use the `-d` or `--decode` option to decode quality scores from Fastq files.
-   It reads Fastq data from stdin, extracts the fourth line (quality scores),
-   decodes these scores, and prints them.
+   It reads quality lines (the fourth line of every record) from stdin in blocks of
+   `--block-size` bytes and writes the sums and counts of every block as .npy to stdout.
 
    Example usage:
-    python3 assignment3.py -d < fastq_file.fastq
+    awk 'NR % 4 == 0' fastq_file.fastq | python3 assignment3.py -d > decoded_scores.npy
+
+Worker:
+   Use the `-w` or `--worker` option to start a long-lived worker. It works like the decode
+   mode, but keeps adding up until the input ends and only writes one array at the end.
+   Started with `parallel --pipe --round-robin` every core gets one worker, so python and numpy
+   are only started once per core instead of once per 1000 reads.
+
+   Example usage:
+    awk 'NR % 4 == 0' fastq_file.fastq | parallel --pipe --round-robin -j 20 \\
+        python3 assignment3.py -w > decoded_scores.npy
 
 Compute Mean Scores:
    Use the `-m` or `--mean` option to compute mean scores across all decoded quality scores.
-   It reads decoded quality scores from stdin, calculates the mean, and prints the result.
+   It reads the arrays of the decode or worker mode from stdin, adds them up and prints the
+   mean score per position.
 
    Example usage:
-    python3 assignment3.py -m < decoded_scores.txt
+    python3 assignment3.py -m < decoded_scores.npy
+
+   With `--partial` the sums and counts are written to a mergeable partial file instead, see
+   `python3 -m fastq_stats.combine`.
+
+   Example usage:
+    python3 assignment3.py -m --partial subset.npz --name subset.fastq < decoded_scores.npy
 """
 
+import io
 import sys
-from itertools import zip_longest
+from pathlib import Path
 import argparse as ap
 import numpy
 
+# make the shared fastq_stats package importable when started from this folder
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from fastq_stats import KERNELS, PhredAccumulator, set_kernel, write_partial
+
 
 def argparser():
     """
@@ -36,51 +65,109 @@ def argparser():
     parser = ap.ArgumentParser(description="Process quality scores and compute mean scores.")
 
     parser.add_argument("-d", "--decode", action="store_true",
-                      help="Decode quality scores.")
+                      help="Decode quality scores, write sums and counts per block.")
+    parser.add_argument("-w", "--worker", action="store_true",
+                        help="Decode quality scores until stdin ends, write the sums and counts "
+                             "once.")
     parser.add_argument("-m", "--mean", action="store_true",
                       help="Compute mean scores across all quality scores.")
+    parser.add_argument("--quantiles", action="store_true",
+                        help="In decode and worker mode, write PHRED histograms instead of sums "
+                             "and counts, so the mean mode can also print quartiles and "
+                             "%% >= Q30.")
+    parser.add_argument("--block-size", action="store", type=int, default=16 * 1024 * 1024,
+                        dest="block_size",
+                        help="Number of bytes to read from stdin at once.")
+    parser.add_argument("--partial", action="store", type=str,
+                        help="In mean mode, write sums and counts to this .npz partial file "
+                             "instead of printing the means.")
+    parser.add_argument("--name", action="store", type=str, default="stdin",
+                        help="Name of the fastq file, stored in the partial file.")
+    parser.add_argument("--kernel", action="store", choices=KERNELS, default=None,
+                        help="In decode and worker mode, decode with the numba kernel or with "
+                             "NumPy (see fastq_stats.kernels). Default is $FASTQ_STATS_KERNEL "
+                             "or auto: numba when it is installed.")
 
     args = parser.parse_args()
 
     return args
 
 
-def decode_fastq_quality_score(encoded_quality_scores):
+def read_blocks(in_stream, block_size):
     """
-    Translates the base call quality score to a numeric value. Quality scores are Phred +33
-    encoded, using ASCII characters to represent the numerical quality scores.
+    Read a stream in blocks that only contain complete lines.
 
     Args:
-        encoded_quality_scores (str): Phred +33 encoded base call quality score
-    Returns:
-        list: Numeric base call quality score
-    """
-    decoded_score = [ord(ascii_chr) - 33 for ascii_chr in encoded_quality_scores.strip()]
-    return decoded_score
+        in_stream: binary stream with one quality line per line
+        block_size (int): number of bytes to read at once
 
-
-def get_mean_score(decoded_list):
+    Yields:
+        bytes: block of complete lines
+    """
+    rest = b""
+    while True:
+        block = in_stream.read(block_size)
+        if not block:
+            break
+        # only return complete lines, keep the last part for the next block
+        block = rest + block
+        last_newline = block.rfind(b"\n") + 1
+        rest = block[last_newline:]
+        if last_newline:
+            yield block[:last_newline]
+
+    if rest.strip():
+        yield rest
+
+
+def write_array(accumulator, out_stream):
     """
-    Get mean score of lists based on index
+    Write the sums and counts of an accumulator as one .npy array of shape (2, positions), or the
+    histogram as an array of shape (94, positions) if the accumulator has one.
+
     Args:
-        decoded_list: list of decoded pred scores from a fastq file
+        accumulator (PhredAccumulator): sums and counts to write
+        out_stream: binary stream to write to
+    """
+    if accumulator.histogram is not None:
+        array = numpy.ascontiguousarray(accumulator.histogram.T)
+    else:
+        array = numpy.stack([accumulator.sums, accumulator.counts])
+    # numpy writes the data of real files past the python buffer, so build the array in memory
+    buffer = io.BytesIO()
+    numpy.save(buffer, array)
+    out_stream.write(buffer.getvalue())
 
-    Returns:
-        mean_score_list: list with mean pred scores
 
+def read_arrays(in_stream):
     """
-    mean_score_list = [numpy.mean(x) for x in zip_longest(*decoded_list, fillvalue=0)]
-    return mean_score_list
+    Read concatenated .npy arrays from a stream (numpy.load can not read a pipe).
 
-def line_to_list(line):
-    """
-    takes line fom the commandline and make them into a python list
+    Args:
+        in_stream: binary stream with arrays written by write_array
+
+    Yields:
+        PhredAccumulator: sums and counts (or histogram) of every array
     """
-    line = line.strip()
-    line = line.strip("[]")
-    decoded_list = list(map(int, line.split(',')))
+    while True:
+        magic = in_stream.read(numpy.lib.format.MAGIC_LEN)
+        if not magic:
+            return
+        version = numpy.lib.format.read_magic(io.BytesIO(magic))
+        if version == (1, 0):
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(in_stream)
+        else:
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(in_stream)
+
+        data = in_stream.read(int(numpy.prod(shape)) * dtype.itemsize)
+        array = numpy.frombuffer(data, dtype=dtype).reshape(shape,
+                                                            order="F" if fortran_order else "C")
+        if shape[0] == 2:
+            yield PhredAccumulator(array[0], array[1])
+        else:
+            # histogram of PHRED values, sums and counts follow from it
+            yield PhredAccumulator.from_histogram(array.T)
 
-    return decoded_list
 
 def main():
     """
@@ -88,31 +175,47 @@ def main():
     """
     # Get args
     args = argparser()
+    if args.kernel is not None:
+        try:
+            set_kernel(args.kernel)
+        except ValueError as error:
+            sys.exit(str(error))
 
     # check if in decode mode
     if args.decode:
-        # read input directly form stdin
-        for line in sys.stdin:
-            # Decode quality scores
-            decoded_scores = decode_fastq_quality_score(line)
-            # print scores (for use in bash script)
-            print(decoded_scores)
+        # read raw bytes directly form stdin, decoding to str is not needed for the scores
+        for block in read_blocks(sys.stdin.buffer, args.block_size):
+            accumulator = PhredAccumulator(histogram=args.quantiles)
+            accumulator.add_quality_lines(block)
+            # write sums and counts (for use in bash script)
+            write_array(accumulator, sys.stdout.buffer)
+
+    # check if in worker mode
+    elif args.worker:
+        accumulator = PhredAccumulator(histogram=args.quantiles)
+        for block in read_blocks(sys.stdin.buffer, args.block_size):
+            accumulator.add_quality_lines(block)
+        write_array(accumulator, sys.stdout.buffer)
 
     # check if in mean mode
     elif args.mean:
-        # create list for collecting decoded score lists
-        decoded_lists = []
-        # Read decoded quality scores from stdin
-        for line in sys.stdin:
-            # make line into list
-            decoded_list = line_to_list(line)
-            decoded_lists.append(decoded_list)
+        # add up the sums and counts of every block
+        accumulator = None
+        for block_accumulator in read_arrays(sys.stdin.buffer):
+            if accumulator is None:
+                accumulator = block_accumulator.empty_copy()
+            accumulator.merge(block_accumulator)
+        if accumulator is None:
+            accumulator = PhredAccumulator()
+
+        if args.partial:
+            write_partial(args.partial, [args.name], [accumulator])
+            return
 
         # Compute mean scores
-        mean_scores = get_mean_score(decoded_lists)
-        for i, score in enumerate(mean_scores):
+        for i, scores in enumerate(accumulator.summary()):
             # print scores (for use in bash script)
-            print(i, score)
+            print(i, *scores)
 
 
 if __name__ == "__main__":
@@ -7,6 +7,8 @@ input_files=(
 )
 # set output file
 output_file="output.csv"
+# number of long-lived workers
+n_workers=20
 
 # Clear the output file if it exists
 > "$output_file"
@@ -18,24 +20,17 @@ else
     multiple_files=false
 fi
 
-# Create a temporary directory
-temp_dir=$(mktemp -d)
-
 for input_file in "${input_files[@]}"; do
     file_name=$(basename "$input_file")
 
-    # Extract every 4th line and split the file into smaller chunks
-    # (parallel got stuck if piped directly into assignment3.py)
-    awk 'NR % 4 == 0' "$input_file" | split -l 1000 - "$temp_dir/split_${file_name}_"
-
-    # find and process each split file in parallel
-    find "$temp_dir" -type f -name "split_${file_name}_*" | parallel -j 20 "cat {} | python3 assignment3.py -d > {}.out"
-
-    # Combine decoded results
-    cat "$temp_dir/split_${file_name}_"*.out > "$temp_dir/decoded_${file_name}"
-
-    # Calculate mean scores
-    mean_scores=$(python3 assignment3.py -m < "$temp_dir/decoded_${file_name}")
+    # Extract every 4th line and stream it to one worker per core.
+    # --round-robin keeps the workers running and hands each of them many blocks of lines,
+    # so python is started n_workers times instead of once per 1000 reads.
+    # Every worker writes its sums and counts per position as a small binary numpy array when
+    # its input ends, the mean mode adds them up and calculates the mean scores.
+    mean_scores=$(awk 'NR % 4 == 0' "$input_file" \
+        | parallel --pipe --round-robin --block 10M -j "$n_workers" "python3 assignment3.py -w" \
+        | python3 assignment3.py -m)
 
     # if more then one file
     if $multiple_files; then
@@ -47,6 +42,3 @@ for input_file in "${input_files[@]}"; do
     echo "$mean_scores" >> "$output_file"
 
 done
-
-# Clean up temporary directory
-rm -rf "$temp_dir"
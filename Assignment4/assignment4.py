@@ -11,14 +11,19 @@ Student: Antsje van der Leij
 student number: 343279
 """
 
-import csv
-import itertools
 import sys
-from itertools import zip_longest
-from itertools import chain
 import argparse as ap
+from pathlib import Path
 from mpi4py import MPI
-import numpy
+
+# make the shared fastq_stats package importable when started from this folder
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from fastq_stats import (SINGLE, Checkpoint, RunReport, add_kernel_argument, add_layout_arguments,
+                         add_profile_arguments, add_sample_arguments, add_statistics_arguments,
+                         check_arguments, get_array_task, get_cache, get_options, get_reports,
+                         make_jobs, process_layout_job, profile_job, select_task_jobs,
+                         use_cprofile, use_kernel, write_partial, write_results)
 
 def argparser():
     """
@@ -27,12 +32,42 @@ def argparser():
         - `-o` (optional): Specifies the output CSV file to store the results. If not
           provided, the output will be directed to the terminal (STDOUT).
         - `fastq_files` (required): One or more Fastq Format files to be processed.
+        - `--chunks` (optional): Number of byte ranges to split every file in.
+        - `--checkpoint` (optional): File to periodically save progress to.
+        - `--checkpoint-interval` (optional): Seconds between two checkpoint saves.
+        - `--resume` (optional): Continue from the file given with `--checkpoint`.
+        - `--partial` (optional): Write a mergeable partial file instead of the CSV output. In a
+          SLURM job array every task only does its own part of the byte ranges.
+        - `--quantiles` (optional): Also output the first quartile, median, third quartile and
+          percentage of bases >= Q30 per position.
+        - `--by-tile` (optional): Also write the statistics per flowcell, lane and tile (taken
+          from the Illumina read names) to this CSV file.
+        - `--composition` (optional): Also write the number of A, C, G, T and N bases per
+          position (and the percentage of N) to this CSV file.
+        - `--gc-histogram` (optional): Also write the number of reads per GC percentage to this
+          CSV file.
+        - `--paired` (optional): The fastq files are R1/R2 pairs (R1 R2 [R1 R2 ...]); the mates
+          are read in lockstep and read 1 and read 2 get their own output.
+        - `--interleaved` (optional): Every fastq file holds both mates (R1, R2, R1, R2, ...);
+          read 1 and read 2 get their own output.
+        - `--sample` (optional): Only read this fraction of every file, in random blocks of
+          `--sample-block-size` bytes spread over the file (`--seed` for the same sample every
+          run). The output gets the standard error and the 95% confidence interval of the mean.
+        - `--no-cache` (optional): Do not use the result cache. Without it the result of every
+          whole fastq file is cached (see fastq_stats.cache), so a rerun over an unchanged file
+          writes the output without decoding it again.
+        - `--kernel` (optional): Decode with the numba kernel or with NumPy (see
+          fastq_stats.kernels), default numba when it is installed.
+        - `--profile` (optional): Write the wall time, CPU time, bytes, records and peak memory
+          per stage (read, decode, transfer, reduce, write) and per MPI rank to this JSON file
+          (see fastq_stats.profiling).
+        - `--cprofile` (optional): Write a cProfile dump per MPI rank to this folder.
 
         Returns:
             args: The parsed arguments as an object
 
         Example:
-
+            mpirun python assignment4.py subset.fastq -o test.csv --checkpoint run.ckpt --resume
     """
     arg_parser = ap.ArgumentParser(description="Script voor Opdracht 4 van Big Data Computing")
     arg_parser.add_argument("-o", action="store", dest="csvfile",
@@ -42,151 +77,51 @@ def argparser():
                                  "terminal STDOUT")
     arg_parser.add_argument("fastq_files", action="store", type=ap.FileType('r'), nargs='+',
                             help="Minstens 1 Illumina Fastq Format file om te verwerken")
+    arg_parser.add_argument("--chunks", action="store", type=int, required=False,
+                            help="Aantal byte ranges per fastq file. Default is 4 per MPI rank")
+    arg_parser.add_argument("--checkpoint", action="store", type=str, required=False,
+                            help="File om de voortgang periodiek in op te slaan")
+    arg_parser.add_argument("--checkpoint-interval", action="store", type=float, default=60.0,
+                            dest="checkpoint_interval",
+                            help="Minimaal aantal seconden tussen twee checkpoints (default 60)")
+    arg_parser.add_argument("--resume", action="store_true",
+                            help="Ga verder waar de run in --checkpoint gebleven was")
+    arg_parser.add_argument("--partial", action="store", type=str, required=False,
+                            help="Schrijf sums en counts naar dit .npz bestand in plaats van de "
+                                 "CSV output. {task} wordt vervangen door het SLURM array task "
+                                 "id, ook in --checkpoint. Samenvoegen met "
+                                 "python3 -m fastq_stats.combine")
+    add_statistics_arguments(arg_parser)
+    add_layout_arguments(arg_parser)
+    add_sample_arguments(arg_parser)
+    add_kernel_argument(arg_parser)
+    add_profile_arguments(arg_parser)
     args = arg_parser.parse_args()
 
-    return args
-
-
-def get_size_chunks(n_procceses, file_line_count):
-    """
-    calculated the chunk size of fasta file based on total file count and amount of processes
-    Args:
-        n_processes int: amount of processes
-        file_line_count int: total amount of lines in a fastq file
-
-    Returns:
-        chunk_size * 4: amount of line for a single process/chunk
-
-    """
-    # get amount of reads
-    read_amount = file_line_count // 4
-    # get the size of chunks
-    chunk_size = read_amount // n_procceses + (read_amount % n_procceses)
-    return chunk_size * 4
-
-
-def get_part_file(fastq_file, start, chunk_size):
-    """
-    Returns a chunk of lines from a FASTQ file.
-
-    Args:
-        fastq_file (str): The path to the FASTQ file.
-        start (int): The starting line number from which to begin.
-        chunk_size (int): size of the chunk.
-
-    Returns:
-        A single chunk of the fastq file, list of strings
-    """
-    with open(fastq_file, "r", encoding='utf-8') as file:
-        file_chunk = []
-        for line in itertools.islice(file, start, (start + chunk_size)):
-            file_chunk.append(line)
-    return file_chunk
-
-
-def get_quality_score_lines(fastq_file):
-    """
-    gets only the q base call quality scores from a fasta file
-    Args:
-        fastq_file:
-
-    Returns:
-        list contaning the encoded base call quality scores lines
-
-    """
-    encoded_quality_score_list = []
-    for count, line in enumerate(fastq_file):
-
-        # count + 1 to make the list start with 1 instead of 0
-        # get every 4th line in the FastQ file
-        if (count + 1) % 4 == 0:
-            # remove newline (\n)
-            line = line.rstrip('\n')
-            # add all lines to a list
-            encoded_quality_score_list.append(line)
-
-    return encoded_quality_score_list, count
-
+    if args.resume and args.checkpoint is None:
+        arg_parser.error("--resume needs --checkpoint")
 
-def decode_fastq_quality_score(encoded_quality_score):
-    """
-    decode the quality sore from the fastQ file from ascii to numerical score
-    Q-score is the ascii code - 33
-
-    Args:
-        chunk of fastq quality score line from a fastq file
-    """
-    decoded_scores = []
-    for line in encoded_quality_score:
-        decoded_score = [ord(ascii_chr) - 33 for ascii_chr in line]
-        decoded_scores.extend(decoded_score)
-    return decoded_scores
-
-
-def process_wrapper(chunk):
-    """
-    decode a chunk (list) of fastq result lines and return a chunk (list) of results
-    """
-    return decode_fastq_quality_score(chunk)
-
-
-def get_mean_score(decoded_list):
-    """
-    Get mean score of lists based on index
-    Args:
-        decoded_list: list of decoded pred scores from a fastq file
-
-    Returns:
-        mean_score_list: list with mean pred scores
-
-    """
-    print("get mean...")
-    mean_score_list = [numpy.mean(x) for x in zip_longest(*decoded_list, fillvalue=0)]
-    return mean_score_list
+    return args
 
 
-def write_outfile(csvfile, mean_score_list, fastqfile_name, multi_file):
+def process_job(job, fastq_paths, options, layout=SINGLE):
     """
-    Write the output to a csv file or print to terminal if no file is given.
+    Decode the quality scores of one byte range (both mates of a pair for paired data).
 
     Args:
-        csvfile: the file name of output file
-        mean_score_list: list of mean pred scores
-        fastqfile_name: name of fastqfile to keep track of mutiple files
+        job: job made by make_layout_jobs, or None if there is no work for this rank
+        fastq_paths: list of fastq file paths
+        options: options for the accumulator (histogram, group_by_tile, composition)
+        layout: SINGLE, PAIRED or INTERLEAVED
 
     Returns:
-
-    """
-    print("write outfile...")
-    base_num = list(range(1, len(mean_score_list) + 1))
-    # add base number by value
-    final_list = list(zip(base_num, mean_score_list))
-    if csvfile is None:
-        # stdout
-        writer = csv.writer(sys.stdout)
-        writer.writerows(final_list)
-    else:
-        # write into csv file
-        with open(csvfile.name, 'a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            # Add fastqfile name to the CSV if more then one file
-            if multi_file:
-                writer.writerow([fastqfile_name])  # Add fastqfile name to the CSV
-            writer.writerows(final_list)
-    return 0
-
-
-def divide_chunks(lst, n_chunks):
-    """
-    divides list into equal chunks
-
-    Args:
-        lst: list
-        n_chunks: number of chunks wanted
+        (job, list of accumulators, job profile) tuple or None
     """
-    chunk_size = int(numpy.floor(len(lst) // n_chunks))
-    chunk_list = [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)]
-    return chunk_list
+    if job is None:
+        return None
+    with profile_job() as job_profile:
+        results = process_layout_job(job, fastq_paths, layout, **options)
+    return job, results, job_profile
 
 
 def main():
@@ -200,37 +135,80 @@ def main():
     print(f"Hello! this is rank {my_rank} on {MPI.Get_processor_name()}.")
     outfile = args.csvfile
     fastqfiles = args.fastq_files
-    for file_idx, fastqfile in enumerate(fastqfiles):
-
-        if my_rank == 0:  # we zijn een controller
-            # Process each file and append the quality lines to a list
-            quality_score_lines_list, _ = get_quality_score_lines(fastqfile)
-            # divide the data into chunks for every worker
-            job_data = divide_chunks(quality_score_lines_list, comm_size)
-            # scater job data over every worker
-            data = comm.scatter(job_data, root=0)
-
-
-        else:  # we zijn een werker
-            data = comm.scatter(None, root=0)
-
-        # decode qquality lines for every process
-        decoded_lines = [decode_fastq_quality_score(line) for line in data]
-
-        # Gather the processed data back to the controller
-        all_decoded_scores = comm.gather(decoded_lines, root=0)
-
-
+    fastq_paths = [fastqfile.name for fastqfile in fastqfiles]
+    try:
+        # paired data has an output for read 1 and read 2
+        output_names = check_arguments(args, fastq_paths)
+        use_kernel(args)
+        use_cprofile(args)
+    except ValueError as error:
+        sys.exit(str(error))
+
+    # in a job array with partial output every task only does its own part of the files
+    task = get_array_task() if args.partial else (0, 1)
+    checkpoint_path = args.checkpoint.format(task=task[0]) if args.checkpoint else None
+    options = get_options(args)
+
+    # only the report of rank 0 is written, the other ranks send their job profiles
+    report = RunReport("mpi")
+    todo = None
+    if my_rank == 0:  # we zijn een controller
+        # the checkpoint also holds the merged results, it is only written if a file is given
+        checkpoint = Checkpoint(checkpoint_path, fastq_paths, args.checkpoint_interval, options,
+                                args.layout)
+        # only results of complete, whole files go in the cache
+        cache = get_cache(args)
+        if cache is not None:
+            cached = cache.lookup(fastq_paths, options)
+        # without a checkpoint file (first run of a requeued job) start from scratch
+        if not (args.resume and checkpoint.load()):
+            jobs = make_jobs(args, fastq_paths, args.chunks or comm_size * 4)
+            if cache is not None:
+                # files that are in the cache are not decoded again
+                jobs = [job for job in jobs if job[0] not in cached]
+                for file_idx, accumulator in cached.items():
+                    checkpoint.accumulators[file_idx] = accumulator
+            checkpoint.set_jobs(select_task_jobs(jobs, *task))
+        todo = checkpoint.todo()
+
+    # let every rank know how many rounds of work there are
+    todo = comm.bcast(todo, root=0)
+    for round_start in range(0, len(todo), comm_size):
+        # every rank gets 1 byte range per round, ranks without a range get None
+        round_jobs = todo[round_start:round_start + comm_size]
+        round_jobs += [None] * (comm_size - len(round_jobs))
+        with report.stage("transfer"):
+            job = comm.scatter(round_jobs if my_rank == 0 else None, root=0)
+
+        # decode quality lines for every process
+        result = process_job(job, fastq_paths, options, args.layout)
+
+        # Gather the processed data back to the controller, this waits for the slowest rank
+        with report.stage("transfer"):
+            results = comm.gather(result, root=0)
 
         if my_rank == 0:
-            # check if one fastqfile and set flag
-            multi_file_flag = len(fastqfiles) != 1
-            # make one list of all output
-            all_decoded_scores = chain.from_iterable(all_decoded_scores)
-            # Calculate mean scores and write out results for each fastqfile
-            mean_score_list = get_mean_score(all_decoded_scores)
-            fastqfile_name = fastqfiles[file_idx - 1].name
-            write_outfile(outfile, mean_score_list, fastqfile_name, multi_file_flag)
+            for result in results:
+                if result is not None:
+                    job, accumulators, job_profile = result
+                    report.add_job(job_profile)
+                    with report.stage("reduce"):
+                        checkpoint.add_result(job, accumulators)
+
+    if my_rank == 0 and args.partial:
+        with report.stage("write"):
+            write_partial(args.partial.format(task=task[0]), output_names,
+                          checkpoint.accumulators, task)
+        checkpoint.remove()
+    elif my_rank == 0:
+        # Calculate mean scores and write out results for each fastqfile (and mate)
+        with report.stage("write"):
+            write_results(outfile, output_names, checkpoint.accumulators, get_reports(args))
+        if cache is not None:
+            cache.store(checkpoint.accumulators)
+        checkpoint.remove()
+    if my_rank == 0 and args.profile:
+        report.write(args.profile)
 
 
 if __name__ == "__main__":
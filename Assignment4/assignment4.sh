@@ -10,4 +10,6 @@
 # load conda env
 source /commons/conda/conda_load.sh
 
-mpirun python assignment4.py "/homes/aavanderleij/BDC_2024/testFiles/subset.fastq" -o "test.csv"
\ No newline at end of file
+# save progress every 5 minutes; resubmitting this script continues where the last job stopped
+mpirun python assignment4.py "/homes/aavanderleij/BDC_2024/testFiles/subset.fastq" -o "test.csv" \
+    --checkpoint "assignment4.ckpt" --checkpoint-interval 300 --resume
\ No newline at end of file
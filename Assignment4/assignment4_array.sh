@@ -0,0 +1,19 @@
+#!/bin/bash
+#SBATCH --job-name=assingment4_array   # name of job
+#SBATCH --array=0-9                    # 10 tasks, each does 1/10 of the byte ranges
+#SBATCH --nodes=1                      # node count per task
+#SBATCH --ntasks=5                     # total number of tasks per array task
+#SBATCH --cpus-per-task=1              # cpu-cores per task
+#SBATCH --mem-per-cpu=1G               # memory per cpu-core
+#SBATCH --time=01:00:00                # total run time limit (HH:MM:SS)
+
+# load conda env
+source /commons/conda/conda_load.sh
+
+# every array task writes its own partial file, {task} is replaced by the array task id
+mpirun python assignment4.py "/homes/aavanderleij/BDC_2024/testFiles/subset.fastq" \
+    --partial "partials/part_{task}.npz" --checkpoint "partials/part_{task}.ckpt" --resume
+
+# merge the partial files afterwards, for example with:
+# sbatch --dependency=afterok:<array job id> --wrap \
+#     "cd .. && python3 -m fastq_stats.combine -o Assignment4/test.csv Assignment4/partials/*.npz"
@@ -12,14 +12,20 @@ author: Antsje van der Leij (https://github.com/aavanderleij)
 import os
 import sys
 import configparser
+import sqlite3
+from contextlib import closing
 from pathlib import Path
-import math
 import timeit
 import warnings
 from datetime import datetime, timezone
-import numpy as np
 import polars as pl
 
+from localization_cache import LocalizationCache
+from sqlite_to_parquet import scan_localizations
+
+# index that makes the tag and time range queries (and every partition of them) fast
+INDEX_STATEMENT = "CREATE INDEX IF NOT EXISTS idx_localizations_tag_time ON LOCALIZATIONS (TAG, TIME)"
+
 
 class WatlasDataframe:
     """
@@ -91,11 +97,65 @@ class WatlasDataframe:
         print(db_uri)
         return db_uri
 
+    def check_index(self, db_uri, create_index=False):
+        """
+        Check if the LOCALIZATIONS table has an index that starts with TAG and TIME, and create it if asked.
+        Only a SQLite file can be changed, for MySQL the statement to run is shown.
+
+        Args:
+            db_uri (str): database URI from get_db_uri
+            create_index (bool): create the index if it is missing (SQLite only)
+
+        Returns:
+            has_index (bool): True if there is a (TAG, TIME) index
+        """
+        if db_uri.startswith("sqlite"):
+            sqlite_file_path = Path(self.config['database settings']['sqlite_file_path']).absolute()
+            with closing(sqlite3.connect(sqlite_file_path)) as connection:
+                # get the first two columns of every index on the table
+                index_names = [row[1] for row in connection.execute("PRAGMA index_list(LOCALIZATIONS)")]
+                index_columns = [[row[2].upper() for row in connection.execute(f"PRAGMA index_info('{name}')")][:2]
+                                 for name in index_names]
+                has_index = ["TAG", "TIME"] in index_columns
+
+                if not has_index and create_index:
+                    # this only has to be done once per file
+                    print("creating (TAG, TIME) index on LOCALIZATIONS, this can take a while")
+                    connection.execute(INDEX_STATEMENT)
+                    connection.commit()
+                    has_index = True
+        else:
+            index_df = pl.read_database_uri(
+                "SELECT INDEX_NAME, COLUMN_NAME, SEQ_IN_INDEX FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'LOCALIZATIONS'", db_uri)
+            index_columns = (index_df.sort("SEQ_IN_INDEX").group_by("INDEX_NAME")
+                             .agg(pl.col("COLUMN_NAME").str.to_uppercase().head(2))["COLUMN_NAME"].to_list())
+            has_index = ["TAG", "TIME"] in index_columns
+
+            if not has_index and create_index:
+                # the connection used for reading can not change the database
+                warnings.warn(f"Can not create an index on a remote database, ask the database admin to run: "
+                              f"{INDEX_STATEMENT}")
+
+        if not has_index:
+            warnings.warn("LOCALIZATIONS has no (TAG, TIME) index, reading (partitioned) data will be slow. "
+                          "Set 'create index = true' in the database settings of the config file to create it.")
+
+        return has_index
+
     def get_watlas_data(self, tags):
         """
         Get watlas data from a local SQLite database file and return it as a polars dataframe.
         Results will be of the specified tags and filtered to fit between start time and end time.
 
+        The time range is split in 'partitions' parts (database settings in the config file, default the number of
+        polars threads) that are read in parallel. With 'create index = true' a missing (TAG, TIME) index is created
+        in the SQLite file first. Days and tags that were read before come from the local cache (see
+        get_localization_cache), only the missing ones are queried.
+
+        With 'parquet_dataset_path' in the database settings the data is read from a Parquet dataset made with
+        sqlite_to_parquet.py instead, with the tag and time filters pushed down to the scan.
+
         Dataframe legend:
         TAG 	=	11 digit WATLAS tag ID
         TIME	=	UNIX time (milliseconds)
@@ -115,11 +175,8 @@ class WatlasDataframe:
 
         """
 
-        # get uri
-        db_uri = self.get_db_uri()
-
         # format tag to server tag numbers
-        server_tags = ', '.join(f'3100100{str(t)}' for t in tags)
+        server_tags = [int(f'3100100{str(t)}') for t in tags]
 
         # convert sting to datetime object in utc time zone
         tracking_time_start = datetime.strptime(self.start_time, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
@@ -129,18 +186,28 @@ class WatlasDataframe:
         tracking_time_start = int(tracking_time_start.timestamp() * 1000)
         tracking_time_end = int(tracking_time_end.timestamp() * 1000)
 
-        # set query for sqlite database
-        query = f"""
-        SELECT TAG, TIME, X, Y, NBS, VARX, VARY, COVXY
-        FROM LOCALIZATIONS
-        WHERE TAG IN ({server_tags})
-          AND TIME > {tracking_time_start}
-          AND TIME < {tracking_time_end}
-        ORDER BY TIME ASC;
-        """
+        parquet_dataset_path = self.config.get("database settings", "parquet_dataset_path", fallback=None)
+        if parquet_dataset_path:
+            # the dataset is already local and columnar, only the folders of these tags and dates are read
+            print("using parquet dataset")
+            self.watlas_df = scan_localizations(parquet_dataset_path, server_tags, tracking_time_start,
+                                                tracking_time_end).sort(by="TIME").collect()
+        else:
+            # get uri
+            db_uri = self.get_db_uri()
+
+            # without a (TAG, TIME) index every partition reads the whole table
+            self.check_index(db_uri, self.config.getboolean("database settings", "create index", fallback=False))
+
+            def fetch(fetch_tags, time_start, time_end):
+                return self.read_localizations(db_uri, fetch_tags, time_start, time_end)
 
-        # run query on sqlite file and get polars dataframe
-        self.watlas_df = pl.read_database_uri(query, db_uri)
+            # only query the days and tags that are not in the local cache yet
+            cache = self.get_localization_cache()
+            if cache is None:
+                self.watlas_df = fetch(server_tags, tracking_time_start, tracking_time_end)
+            else:
+                self.watlas_df = cache.read(server_tags, tracking_time_start, tracking_time_end, fetch)
 
         # check if dataframe is empty
         if self.watlas_df.shape[0] == 0:
@@ -162,6 +229,69 @@ class WatlasDataframe:
 
         return self.watlas_df
 
+    def read_localizations(self, db_uri, server_tags, time_start, time_end):
+        """
+        Query the localizations of tags between time_start and time_end (both not included) from the database.
+
+        The time range is split in 'partitions' parts (database settings in the config file, default the number of
+        polars threads) that are read in parallel.
+
+        Args:
+            db_uri (str): database URI from get_db_uri
+            server_tags (list): 11 digit WATLAS tag IDs
+            time_start (int): UNIX time in milliseconds
+            time_end (int): UNIX time in milliseconds
+
+        Returns:
+            watlas_df (pl.DataFrame): localizations sorted on TIME
+        """
+        # split the time range, every part is read at the same time over its own connection
+        n_partitions = self.config.getint("database settings", "partitions", fallback=pl.thread_pool_size())
+
+        # set query for sqlite database, one per time partition
+        queries = [f"""
+        SELECT TAG, TIME, X, Y, NBS, VARX, VARY, COVXY
+        FROM LOCALIZATIONS
+        WHERE TAG IN ({', '.join(str(tag) for tag in server_tags)})
+          AND {time_condition}
+        ORDER BY TIME ASC;
+        """ for time_condition in get_time_partitions(time_start, time_end, n_partitions)]
+
+        # run query on sqlite file and get polars dataframe, a list of queries is run in parallel by connectorx
+        watlas_df = pl.read_database_uri(queries if len(queries) > 1 else queries[0], db_uri)
+        if len(queries) > 1:
+            # the partitions can come back in any order
+            watlas_df = watlas_df.sort(by="TIME")
+        return watlas_df
+
+    def get_localization_cache(self):
+        """
+        Get the local Parquet cache of database extracts, set in the cache section of the config file:
+        'use cache' (default true), 'cache directory' (default ~/.cache/watlas), 'max size gb' (default 10) and
+        'settle hours' (default 24, newer days are always read from the database).
+
+        Returns:
+            cache (LocalizationCache): the cache, None if 'use cache' is false
+        """
+        if not self.config.getboolean("cache", "use cache", fallback=True):
+            return None
+
+        # the cache is only valid for the same database, a changed SQLite file gets a new cache
+        if self.config.getboolean("database settings", "sqlite"):
+            sqlite_file_path = Path(self.config['database settings']['sqlite_file_path']).absolute()
+            file_stat = sqlite_file_path.stat()
+            source = {"sqlite": sqlite_file_path.as_posix(), "size": file_stat.st_size,
+                      "mtime_ns": file_stat.st_mtime_ns}
+        else:
+            source = {"host": self.config["database settings"]["host"],
+                      "database": self.config["database settings"]["database"]}
+
+        max_size_gb = self.config.getfloat("cache", "max size gb", fallback=None)
+        return LocalizationCache(
+            source, cache_dir=self.config.get("cache", "cache directory", fallback=None),
+            max_bytes=None if max_size_gb is None else int(max_size_gb * 1024 ** 3),
+            settle_hours=self.config.getfloat("cache", "settle hours", fallback=None))
+
     def get_watlas_dataframe(self):
         """
         Return watlas dataframe.
@@ -174,14 +304,24 @@ class WatlasDataframe:
         pl.Config(set_fmt_float="full")
         return self.watlas_df
 
+    def is_lazy(self):
+        """
+        Check if watlas_df is a lazy query plan (pl.LazyFrame) instead of a dataframe.
+
+        Returns:
+            bool: True in lazy mode
+        """
+        return isinstance(self.watlas_df, pl.LazyFrame)
+
     def get_datetime(self):
         """
         Adds column to dataframe that contains a human-readable date and time.
         """
 
         self.watlas_df = self.watlas_df.with_columns(
-            # convert unix time from TIME column to human-readable time
-            pl.from_epoch(pl.col("TIME"), time_unit="ms").alias("time")
+            # convert unix time from TIME column to human-readable time, in ms like the tide data (newer polars
+            # versions give microseconds)
+            pl.from_epoch(pl.col("TIME"), time_unit="ms").cast(pl.Datetime(time_unit="ms")).alias("time")
         )
 
     def aggregate_dataframe(self, interval="15s"):
@@ -220,12 +360,8 @@ class WatlasDataframe:
             min_num_localisations (int): minimum number of localisations
 
         """
-        # count times tag is in df
-        tag_count = self.watlas_df.group_by("tag").len()
-        # get tags that are less than min_num_localisations
-        tags_to_remove = tag_count.filter(pl.col("len") < min_num_localisations).select("tag")
-        # filter tags if tag is not in tags_to_remove
-        self.watlas_df = self.watlas_df.filter(~pl.col("tag").is_in(tags_to_remove))
+        # count times tag is in df and keep the tags with at least min_num_localisations
+        self.watlas_df = self.watlas_df.filter(pl.len().over("tag") >= min_num_localisations)
 
     def get_tag_data(self):
         """
@@ -272,7 +408,11 @@ class WatlasDataframe:
         else:
             # match tag id's to get species
 
-            self.watlas_df = self.watlas_df.join(self.tags_df.select(["tag", "species"]), on="tag", how="left")
+            tags_df = self.tags_df.select(["tag", "species"])
+            # a lazy plan can only be joined with another lazy frame
+            if self.is_lazy():
+                tags_df = tags_df.lazy()
+            self.watlas_df = self.watlas_df.join(tags_df, on="tag", how="left")
 
     def add_tide_data(self):
         """
@@ -284,116 +424,124 @@ class WatlasDataframe:
 
         path_tide_data = Path(self.config["necessary files"]["tidal_data_file_path"])
         # load in tidal data csv
-        tide_df = pl.read_csv(path_tide_data, dtypes={"waterlevel": pl.Float64,
+        tide_df = pl.read_csv(path_tide_data, schema_overrides={"waterlevel": pl.Float64,
                                                       "dateTime": pl.Datetime(time_unit="ms")})
         # drop unnecessary columns
         tide_df = tide_df.drop(["time", "date"])
         # rename column to be the same as watlas_df
         tide_df = tide_df.rename({"dateTime": "time"})
 
-        # check if sorted
-        if not self.watlas_df["time"].is_sorted():
+        # check if sorted, a lazy plan can not be checked so it is always sorted
+        if self.is_lazy():
+            self.watlas_df = self.watlas_df.sort(by="time")
+        elif not self.watlas_df["time"].is_sorted():
             # if not sorted, sort
             self.watlas_df = self.watlas_df.sort(by="time")
         # check if sorted
         if not tide_df["time"].is_sorted():
             # if not sorted, sort
             tide_df = tide_df.sort(by="time")
+        if self.is_lazy():
+            tide_df = tide_df.lazy()
 
         # join tidal dataframe with watlas_df on time, this adds the closest measured water level to watlas_df
         self.watlas_df = self.watlas_df.join_asof(tide_df, on="time", strategy="nearest")
 
     def process_per_tag(self):
         """
-        Group by tag and apply median smooth, caluclate distace, speed and turn angle
-        Returns:
+        Apply median smooth, caluclate distace, speed and turn angle per tag
 
-        """
+        The dataframe is sorted once on tag and time, then every calculation is a window expression over the tag. This
+        runs as one query on all threads instead of a loop over the tags.
 
-        # empty dataframe list
-        df_list = []
+        Returns:
 
+        """
         # smooth and calculate per tag (these calculations have to be done per individual bird)
-        for _, wat_df in self.watlas_df.group_by("tag"):
-            # order by time
-            wat_df = wat_df.sort(by="TIME")
+        watlas_df = (
+            self.watlas_df.lazy()
+            # order by tag and time
+            .sort(by=["tag", "TIME"])
             # apply median smooth
-            wat_df = smooth_data(wat_df)
+            .pipe(smooth_data, by="tag")
             # calculate distance and speed per tag
-            wat_df = get_speed(wat_df)
+            .pipe(get_speed, by="tag")
             # calculate turn angle per tag
-            wat_df = get_turn_angle(wat_df)
-
-            df_list.append(wat_df)
-
-        # concat dataframes to single dataframe
-        self.watlas_df = pl.concat(df_list)
+            .pipe(get_turn_angle, by="tag")
+        )
+        # in lazy mode this is added to the plan, otherwise it is run now
+        self.watlas_df = watlas_df if self.is_lazy() else watlas_df.collect()
 
     def process_per_timestamp(self):
         """
         Group by timestamp ("time") and get metrics of all instances in per timestamp
 
+        All timestamps are done at once: the pairs are joined on time and grid cell, so polars can spread the work
+        over all threads instead of going through the timestamps one by one.
+
         Returns:
 
         """
-        # empty dataframe list
-        df_list = []
-
-        # group data frame by time stamp
-        for _, wat_df in self.watlas_df.group_by("time"):
-            # get distance
-            wat_df = get_group_metrics(wat_df, 500, self.species_list)
+        # get group metrics of every timestamp
+        self.watlas_df = get_group_metrics(self.watlas_df, 500, self.species_list, by=["time"])
 
-            # cast columns to floats
-            wat_df = wat_df.with_columns([
-                pl.col("mean_dist_group").cast(pl.Float64),
-                pl.col("median_dist_group").cast(pl.Float64),
-                pl.col("std_dist_group").cast(pl.Float64)
-            ])
+        # cast columns to floats
+        self.watlas_df = self.watlas_df.with_columns([
+            pl.col("mean_dist_group").cast(pl.Float64),
+            pl.col("median_dist_group").cast(pl.Float64),
+            pl.col("std_dist_group").cast(pl.Float64)
+        ])
 
-            df_list.append(wat_df)
+    def shift_rows_for_time_window(self, column_names=None, window=4, as_array=False):
+        """
+        shift rows to get context of previous localisations
 
-        # concat dataframes into single dataframe
-        self.watlas_df = pl.concat(df_list)
+        All shifts are done in one pass, as window expressions over the tag on the data sorted by tag and time.
 
-    def shift_rows_for_time_window(self):
-        """
-        shift rows to get context of previous 4 localisations
+        Args:
+            column_names (list): columns to shift (default speed, distance, turn angle and group columns)
+            window (int): number of localisations in the window (default 4)
+            as_array (bool): add one column "<column>_window" per column with a fixed size array of the window values,
+                instead of a column "<column>_<n>" for every value. Arrays can not be written to csv. (default False)
         Returns:
 
         """
         # columns to shift
-        column_names = ["speed_in", "speed_out", "distance", "turn_angle", "group_size", "mean_turn_angle_group",
-                        "mean_dist_group", "mean_speed_group"]
-
-        df_list = []
-
-        for _, wat_df in self.watlas_df.group_by("tag"):
-            # sort on time
-            wat_df = wat_df.sort(by="TIME")
-
-            # shift rows to get a window of values from the last 4 localizations
-            wat_df = wat_df.with_columns(
-                [pl.col(col_name).shift(-1).alias(f"{col_name}_1") for col_name in column_names] +
-                [pl.col(col_name).shift(-2).alias(f"{col_name}_2") for col_name in column_names] +
-                [pl.col(col_name).shift(-3).alias(f"{col_name}_3") for col_name in column_names] +
-                [pl.col(col_name).shift(-4).alias(f"{col_name}_4") for col_name in column_names]
+        if column_names is None:
+            column_names = ["speed_in", "speed_out", "distance", "turn_angle", "group_size", "mean_turn_angle_group",
+                            "mean_dist_group", "mean_speed_group"]
+
+        # sort on tag and time, so the shifts stay within the rows of a tag
+        watlas_df = self.watlas_df.lazy().sort(by=["tag", "TIME"])
+
+        # shift rows to get a window of values from the last localizations
+        if as_array:
+            watlas_df = watlas_df.with_columns(
+                [pl.concat_arr([pl.col(col_name).shift(-shift).over("tag") for shift in range(1, window + 1)])
+                 .alias(f"{col_name}_window") for col_name in column_names]
+            )
+        else:
+            watlas_df = watlas_df.with_columns(
+                [pl.col(col_name).shift(-shift).over("tag").alias(f"{col_name}_{shift}")
+                 for shift in range(1, window + 1) for col_name in column_names]
             )
 
-            # add tag df to list
-            df_list.append(wat_df)
-
-        # concat dataframes to single dataframe
-        self.watlas_df = pl.concat(df_list)
+        # in lazy mode this is added to the plan, otherwise it is run now
+        self.watlas_df = watlas_df if self.is_lazy() else watlas_df.collect()
 
-    def process_for_prediction(self):
+    def process_for_prediction(self, lazy=False, streaming=False, explain=False, window=4):
         """
         get WATLAS data and process it for prediction.
 
+        In lazy mode every step after reading the database is added to one polars query plan, which is run once when
+        the csv is written. Polars can then optimize the whole plan (only read the columns that are used, do common
+        parts once) instead of making a full copy of the dataframe after every step.
+
         Args:
-            start_time (str): start time for data fetching
-            end_time (str): end time for data fetching
-            tag_file (str): tag csv file path:
+            lazy (bool): build one lazy query plan and run it when writing the csv (default False)
+            streaming (bool): run the lazy plan with the streaming engine, in batches (default False)
+            explain (bool): print the optimized query plan before running it, only in lazy mode (default False)
+            window (int): number of localisations in the time window of every row (default 4)
         """
         print("Processing data for prediction")
 
@@ -403,6 +551,10 @@ class WatlasDataframe:
         # get data from sqlite file
         self.get_watlas_data(self.get_all_tags())
 
+        # the rest of the steps only add to the query plan
+        if lazy or streaming:
+            self.watlas_df = self.watlas_df.lazy()
+
         # filter minimum localisations
         self.filter_num_localisations()
 
@@ -421,7 +573,7 @@ class WatlasDataframe:
         # process dataframe per timestamp to get group metrics
         self.process_per_timestamp()
 
-        self.shift_rows_for_time_window()
+        self.shift_rows_for_time_window(window=window)
 
         # # sort by time
         self.watlas_df = self.watlas_df.sort(by="time")
@@ -432,126 +584,160 @@ class WatlasDataframe:
 
         # write to csv
         prediction_data_save_path = Path(self.output_dir) / "watlas_preprediction.csv"
+        if self.is_lazy():
+            engine = "streaming" if streaming else "auto"
+            if explain:
+                print(self.watlas_df.explain(engine=engine))
+            # the whole plan runs here
+            self.watlas_df = self.watlas_df.collect(engine=engine)
         self.watlas_df.write_csv(prediction_data_save_path)
         print("processed data for prediction!")
         print("results saved in:")
         print(os.path.abspath(prediction_data_save_path))
 
+def get_time_partitions(time_start, time_end, n_partitions):
+    """
+    Split the time range between time_start and time_end (both not included) in parts of the same length.
+
+    Args:
+        time_start (int): UNIX time in milliseconds
+        time_end (int): UNIX time in milliseconds
+        n_partitions (int): number of parts
+
+    Returns:
+        time_conditions (list): SQL condition on TIME for every part, together they cover the whole time range once
+    """
+    n_partitions = max(n_partitions, 1)
+    bounds = [time_start + (time_end - time_start) * part // n_partitions for part in range(n_partitions + 1)]
+
+    time_conditions = []
+    for part in range(n_partitions):
+        # every part includes its upper bound, except the last because time_end is not included
+        upper = "<" if part == n_partitions - 1 else "<="
+        time_conditions.append(f"TIME > {bounds[part]} AND TIME {upper} {bounds[part + 1]}")
+
+    return time_conditions
+
+
+def over_group(expression, by=None):
+    """
+    Calculate an expression per group (like per tag) when by is given.
+
+    Args:
+        expression (pl.Expr): the expression
+        by (str or list): column(s) to group by, the rows of a group have to be sorted on time (optional)
+
+    Returns:
+        expression (pl.Expr): the expression as a window expression over by, or unchanged without by
+    """
+    if by is None:
+        return expression
+    return expression.over(by)
 
-def smooth_data(watlas_df, moving_window=5):
+
+def smooth_data(watlas_df, moving_window=5, by=None):
     """
     Applies a median smooth defined by a rolling window to the X and Y
 
     Args:
-        watlas_df (pl.Datafame):
+        watlas_df (pl.Datafame): dataframe (or lazyframe) sorted on time
         moving_window (int): the window size:
+        by (str): smooth every group (like "tag") on its own, the frame has to be sorted on by and time (optional)
     """
     watlas_df = watlas_df.with_columns(
         pl.col("X").alias("X_raw"),  # Keep original values
         pl.col("Y").alias("Y_raw"),  # Keep original values
         # Apply the forward and reverse rolling median on X
-        pl.col("X")
-        .reverse()
-        .rolling_median(window_size=moving_window, min_periods=1)
-        .reverse()
-        .rolling_median(window_size=moving_window, min_periods=1)
+        over_group(pl.col("X")
+                   .reverse()
+                   .rolling_median(window_size=moving_window, min_samples=1)
+                   .reverse()
+                   .rolling_median(window_size=moving_window, min_samples=1), by)
         .alias("X"),
         # Apply the forward and reverse rolling median on Y
-        pl.col("Y")
-        .reverse()
-        .rolling_median(window_size=moving_window, min_periods=1)
-        .reverse()
-        .rolling_median(window_size=moving_window, min_periods=1)
+        over_group(pl.col("Y")
+                   .reverse()
+                   .rolling_median(window_size=moving_window, min_samples=1)
+                   .reverse()
+                   .rolling_median(window_size=moving_window, min_samples=1), by)
+        .alias("Y")
     )
     return watlas_df
 
 
-def get_simple_travel_distance(watlas_df):
+def get_simple_travel_distance(watlas_df, by=None):
     """
     Gets the Euclidean distance in meters between consecutive localization in a coordinate.
     Add claculated distance to each as column "distance"
-    """
 
-    dist_series = (
-            (
-                # get the difference between the current coordinate and the next coordinate in the X and Y columns
-                # multiply by the power of 2
-                    (watlas_df["X"] - watlas_df["X"].shift(1)) ** 2 +
-                    (watlas_df["Y"] - watlas_df["Y"].shift(1)) ** 2
-            ) ** 0.5  # multiply by power of 0.5 to get square root, to get euclidian distance
-    )
+    Args:
+        watlas_df (pl.Datafame): dataframe (or lazyframe) sorted on time
+        by (str): calculate per group (like "tag"), the frame has to be sorted on by and time (optional)
+    """
+    # get the difference between the current coordinate and the next coordinate in the X and Y columns
+    # multiply by the power of 2, the square root gives the euclidian distance
+    distance = ((pl.col("X") - pl.col("X").shift(1)) ** 2 + (pl.col("Y") - pl.col("Y").shift(1)) ** 2).sqrt()
 
     # add dist to dataframe
-    watlas_df = watlas_df.with_columns(dist_series.alias("distance"))
+    watlas_df = watlas_df.with_columns(over_group(distance, by).alias("distance"))
 
     return watlas_df
 
 
-def get_speed(watlas_df):
+def get_speed(watlas_df, by=None):
     """
     Calculate speed in meters per second for a watlas dataframe.
     Add claculated speed as column "speed"
+
+    Args:
+        watlas_df (pl.Datafame): dataframe (or lazyframe) sorted on time
+        by (str): calculate per group (like "tag"), the frame has to be sorted on by and time (optional)
     """
     # check if distance is already calculated
-    if "distance" not in watlas_df.columns:
-        watlas_df = get_simple_travel_distance(watlas_df)
+    if "distance" not in watlas_df.collect_schema().names():
+        watlas_df = get_simple_travel_distance(watlas_df, by)
 
-    # get distance
-    distance = watlas_df["distance"]
     # get the time interval in seconds between rows in the "TIME" column
-    time = (watlas_df["TIME"] - watlas_df["TIME"].shift(1)) / 1000
+    time = (pl.col("TIME") - pl.col("TIME").shift(1)) / 1000
     # calculate speed
-    speed = distance / time
+    speed = pl.col("distance") / time
 
     # add speed_in and speed_out to dataframe
     watlas_df = watlas_df.with_columns([
-        speed.alias("speed_in"),
-        speed.shift(-1).alias("speed_out")])
+        over_group(speed, by).alias("speed_in"),
+        over_group(speed.shift(-1), by).alias("speed_out")])
 
     return watlas_df
 
 
-def get_turn_angle(watlas_df):
+def get_turn_angle(watlas_df, by=None):
     """
     Calculate turn angle in degrees for a watlas dataframe.
-    Using the law of cosines this function returns the turning angle in degrees based on the x an y coordinates.
-    Negative  degrees indicate left turns (counter-clockwise)
+    The turn angle is the change in heading between the step into a localisation and the step out of it, calculated
+    with atan2 of the two displacement vectors, between -180 and 180 degrees.
+    Negative  degrees indicate left turns (counter-clockwise), positive degrees right turns (clockwise)
 
     Add claculated turn angle as column "turn_angle"
-    """
-    # Create lagged versions of X
-    x1 = watlas_df["X"][:-2]
-    x2 = watlas_df["X"][1:-1]
-    x3 = watlas_df["X"][2:]
 
-    # Create lagged version of Y
-    y1 = watlas_df["Y"][:-2]
-    y2 = watlas_df["Y"][1:-1]
-    y3 = watlas_df["Y"][2:]
-
-    dist_x1_x2 = np.sqrt(((x2 - x1) ** 2) + ((y2 - y1) ** 2))
-    dist_x2_x3 = np.sqrt(((x3 - x2) ** 2) + ((y3 - y2) ** 2))
-    dist_x3_x1 = np.sqrt(((x3 - x1) ** 2) + ((y3 - y1) ** 2))
-
-    angle = np.acos((
-                            (dist_x1_x2 ** 2) +
-                            (dist_x2_x3 ** 2) -
-                            (dist_x3_x1 ** 2)
-                    ) /
-                    (2 * dist_x1_x2 * dist_x2_x3)
-                    )
-
-    # convert to degrees
-    angle = angle * 180 / math.pi
+    Args:
+        watlas_df (pl.Datafame): dataframe (or lazyframe) sorted on time
+        by (str): calculate per group (like "tag"), the frame has to be sorted on by and time (optional)
+    """
+    # displacement vector of the step into and the step out of every localisation
+    dx_in, dy_in = pl.col("X") - pl.col("X").shift(1), pl.col("Y") - pl.col("Y").shift(1)
+    dx_out, dy_out = pl.col("X").shift(-1) - pl.col("X"), pl.col("Y").shift(-1) - pl.col("Y")
 
-    # subtract from 180 to get the external angle
-    angle = 180 - angle
+    # atan2 of the cross and dot product is the signed angle between the steps, counter-clockwise is positive so
+    # the cross product is turned around to make left turns negative
+    cross = dx_in * dy_out - dy_in * dx_out
+    dot = dx_in * dx_out + dy_in * dy_out
+    angle = pl.arctan2(-cross, dot).degrees()
 
-    # insert np at the end and beginning to keep length of array the same as the dataframe
-    angle = np.insert(angle, 0, np.nan)
-    angle = np.append(angle, np.nan)
+    # without moving there is no heading, so no turn angle (NaN like at the first and last localisation)
+    no_step = ((dx_in == 0) & (dy_in == 0)) | ((dx_out == 0) & (dy_out == 0))
+    angle = pl.when(no_step).then(float("nan")).otherwise(angle)
 
-    watlas_df = watlas_df.with_columns(pl.Series(angle).alias("turn_angle"))
+    watlas_df = watlas_df.with_columns(over_group(angle, by).fill_null(float("nan")).alias("turn_angle"))
 
     return watlas_df
 
@@ -579,134 +765,104 @@ def count_species(watlas_df, species_list):
     return species_count_dict
 
 
-def get_group_metrics(watlas_df, group_area, species_list):
+def get_neighbour_pairs(watlas_df, group_area, by=None):
     """
-    Collect data between individuals in the same dataframe.
+    Find all pairs of individuals within group_area of each other, using a uniform grid as spatial index.
 
-    Return the mean, median, std deviation of all individuals within
-    group_area
+    The X/Y plane is cut in square cells of group_area meters, so the neighbours of an individual can only be in its
+    own cell or in the 8 cells around it. Only those candidates are compared, instead of every other row.
 
     Args:
-        watlas_df (pl.dataframe): training dataframe of individuals that are in the same timeframe
+        watlas_df (pl.dataframe): dataframe (or lazyframe) with a "row" index column and X and Y columns
         group_area (int): Maximum distance between individuals to be considered part of same group in meters
+        by (list): columns that also have to be the same for both individuals, like "time" (optional)
 
     Returns:
-        watlas_df (pl.dataframe): training dataframe with new columns "mean_dist", "median_dist", "std_dist"
+        pairs (pl.LazyFrame): columns "row", "other_row" and "distance", every pair is in there in both directions
 
     """
-    # set empty list
-    mean_distances = []
-    median_distances = []
-    std_distances = []
-    group_size = []
-    n_species = []
-    mean_turn_angles = []
-    median_turn_angles = []
-    std_turn_angles = []
-    mean_speeds = []
-    median_speeds = []
-    std_speeds = []
-
-    # set empty dict
-    species_dict = {}
-
-    # get x and y columns from dataframe
-    x_coords = watlas_df["X"]
-    y_coords = watlas_df["Y"]
-
-    for animal in species_list:
-        species_dict[f"{animal}_in_group"] = []
-
-    # per row in watlas_df
-    for i in range(watlas_df.shape[0]):
-        # get current row coords
-        x1, y1 = watlas_df[i, "X"], watlas_df[i, "Y"]
-
-        # get distances of current row
-        distances = ((x_coords - x1) ** 2 + (y_coords - y1) ** 2).sqrt()
-
-        # get boolian mask for when distance is not 0 (self) or distance is smaller than group_area
-        mask = (distances != 0) & (distances <= group_area)
-
-        # filter distances
-        distances = distances.filter(mask)
-
-        # filter self and member out of group
-        group = watlas_df.filter(mask)
-
-        # get group size and species
-        group_size.append(group.height)
-        group_species = group["species"].to_list()
-        n_species.append(len(set(group_species)))
-
-        for animal in species_list:
-            animal = animal.replace(" ", "_")
-            if animal in group_species:
-                species_dict[f"{animal}_in_group"].append(1)
-            else:
-                species_dict[f"{animal}_in_group"].append(0)
+    by = by or []
+    # a cell size of 0 would divide by zero, and there can be no groups anyway
+    cell_size = group_area if group_area > 0 else 1
 
-        # if there are more one member of group
-        if distances.shape[0] != 0:
+    # rows without coordinates can never be part of a group
+    cells = watlas_df.lazy().select(["row", "X", "Y"] + by).filter(pl.col("X").is_finite() & pl.col("Y").is_finite())
+    cells = cells.with_columns(
+        (pl.col("X") / cell_size).floor().cast(pl.Int64).alias("cell_x"),
+        (pl.col("Y") / cell_size).floor().cast(pl.Int64).alias("cell_y"))
 
-            # get distance mean, median and standard deviation
-            mean = distances.mean()
-            median_dist = distances.median()
-            std_dist = distances.std()
+    # the cell itself and the 8 cells around it
+    offsets = pl.LazyFrame({"offset_x": [-1, -1, -1, 0, 0, 0, 1, 1, 1], "offset_y": [-1, 0, 1] * 3})
+    candidates = cells.join(offsets, how="cross").with_columns(
+        (pl.col("cell_x") + pl.col("offset_x")).alias("cell_x"),
+        (pl.col("cell_y") + pl.col("offset_y")).alias("cell_y"))
 
-            # get turn_angle mean, median and standard deviation
-            turn_mean = group["turn_angle"].mean()
-            turn_median = group["turn_angle"].median()
-            turn_std = group["turn_angle"].std()
+    # pair every row with the rows in the cells around it
+    pairs = candidates.join(cells, on=["cell_x", "cell_y"] + by, suffix="_other")
+    pairs = pairs.with_columns(
+        ((pl.col("X_other") - pl.col("X")) ** 2 + (pl.col("Y_other") - pl.col("Y")) ** 2).sqrt().alias("distance"))
 
-            speed_mean = group["speed_in"].mean()
-            speed_median = group["speed_in"].median()
-            speed_std = group["speed_in"].std()
+    # distance 0 is the individual itself (or one at the exact same spot), just like before
+    pairs = pairs.filter((pl.col("distance") != 0) & (pl.col("distance") <= group_area))
 
-        else:
-            # if there are no members of group, set all to 0
-            mean = 0.0
-            median_dist = 0.0
-            std_dist = 0.0
-            turn_mean = 0.0
-            turn_median = 0.0
-            turn_std = 0.0
-            speed_mean = 0.0
-            speed_median = 0.0
-            speed_std = 0.0
-
-        mean_distances.append(mean)
-        median_distances.append(median_dist)
-        std_distances.append(std_dist)
-
-        mean_turn_angles.append(turn_mean)
-        median_turn_angles.append(turn_median)
-        std_turn_angles.append(turn_std)
-
-        mean_speeds.append(speed_mean)
-        median_speeds.append(speed_median)
-        std_speeds.append(speed_std)
+    return pairs.select("row", pl.col("row_other").alias("other_row"), "distance")
 
-    watlas_df = watlas_df.with_columns(
-        pl.Series("mean_dist_group", mean_distances),
-        pl.Series("median_dist_group", median_distances),
-        pl.Series("std_dist_group", std_distances),
-        pl.Series("group_size", group_size),
-        pl.Series("n_species_group", n_species),
-        pl.Series('mean_turn_angle_group', mean_turn_angles),
-        pl.Series("median_turn_angle_group", median_turn_angles),
-        pl.Series("std_turn_angle_group", median_turn_angles),
-        pl.Series("mean_speed_group", mean_speeds),
-        pl.Series("speed_median_group", median_speeds),
-        pl.Series("speed_std_group", std_speeds))
-
-    # Convert each list in species_dict into a column
-    for species_name, in_group_list in species_dict.items():
-        watlas_df = watlas_df.with_columns(
-            pl.Series(species_name, in_group_list)
-        )
 
-    return watlas_df
+def get_group_metrics(watlas_df, group_area, species_list, by=None):
+    """
+    Collect data between individuals in the same dataframe.
+
+    Return the mean, median, std deviation of all individuals within
+    group_area. The neighbours are found with a grid (see get_neighbour_pairs) and all metrics are calculated in one
+    group_by over the pairs, so no rows are compared one by one. A lazyframe gets the metrics added to its plan.
+
+    Args:
+        watlas_df (pl.dataframe): training dataframe of individuals that are in the same timeframe
+        group_area (int): Maximum distance between individuals to be considered part of same group in meters
+        species_list (list): all expected species, every species gets a "<species>_in_group" column
+        by (list): only individuals with the same value in these columns can be in the same group, like ["time"] for
+            the whole dataset at once (default: the whole dataframe is one timeframe)
+
+    Returns:
+        watlas_df (pl.dataframe): training dataframe with new columns "mean_dist", "median_dist", "std_dist"
+
+    """
+    # number the rows, so the metrics can be put back in the same order
+    rows = watlas_df.lazy().with_row_index("row")
+
+    # get the turn angle, speed and species of the other member of every pair
+    pairs = get_neighbour_pairs(rows, group_area, by)
+    pairs = pairs.join(rows.select(pl.col("row").alias("other_row"), "turn_angle", "speed_in", "species"),
+                       on="other_row", how="left")
+
+    species_names = [animal.replace(" ", "_") for animal in species_list]
+
+    # get distance, turn_angle and speed mean, median and standard deviation of every group
+    group_metrics = pairs.group_by("row").agg(
+        pl.col("distance").mean().alias("mean_dist_group"),
+        pl.col("distance").median().alias("median_dist_group"),
+        pl.col("distance").std().alias("std_dist_group"),
+        pl.len().cast(pl.Int64).alias("group_size"),
+        # None counts as a species too, like it did in the set of species
+        pl.col("species").n_unique().cast(pl.Int64).alias("n_species_group"),
+        pl.col("turn_angle").mean().alias("mean_turn_angle_group"),
+        pl.col("turn_angle").median().alias("median_turn_angle_group"),
+        # this column has always held the median turn angle, kept for the trained model
+        pl.col("turn_angle").median().alias("std_turn_angle_group"),
+        pl.col("speed_in").mean().alias("mean_speed_group"),
+        pl.col("speed_in").median().alias("speed_median_group"),
+        pl.col("speed_in").std().alias("speed_std_group"),
+        *[(pl.col("species") == animal).any().cast(pl.Int64).alias(f"{animal}_in_group")
+          for animal in species_names])
+
+    # rows without group members get 0 for everything
+    metric_names = [name for name in group_metrics.collect_schema().names() if name != "row"]
+    no_group = pl.col("group_size").is_null()
+    result = rows.join(group_metrics, on="row", how="left").sort("row").with_columns(
+        [pl.when(no_group).then(0).otherwise(pl.col(name)).alias(name) for name in metric_names]).drop("row")
+
+    # in lazy mode the metrics are only added to the plan
+    return result if isinstance(watlas_df, pl.LazyFrame) else result.collect()
 
 
 def speed_test():
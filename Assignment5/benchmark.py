@@ -13,8 +13,12 @@ from datetime import datetime, timezone
 from pathlib import Path
 from timeit import timeit
 
+from sqlite_to_parquet import scan_localizations
+
 # constands
 sqlite_file = "data/watlas-2023.sqlite"
+# made with: python sqlite_to_parquet.py data/watlas-2023.sqlite data/watlas-2023-parquet
+parquet_dataset = "data/watlas-2023-parquet"
 tag_file = 'data/tags_watlas_all.xlsx'
 # output file
 output_file = f"benchmark_results_{pl.thread_pool_size()}.csv"
@@ -55,7 +59,23 @@ def get_subset_query():
     return query
 
 
-def get_sql_data(sqlite_file_path=sqlite_file):
+def get_time_partitions(time_start, time_end, n_partitions):
+    """
+    Split the time range between time_start and time_end (both not included) in parts of the same length, as SQL
+    conditions on TIME.
+    """
+    bounds = [time_start + (time_end - time_start) * part // n_partitions for part in range(n_partitions + 1)]
+
+    time_conditions = []
+    for part in range(n_partitions):
+        # every part includes its upper bound, except the last because time_end is not included
+        upper = "<" if part == n_partitions - 1 else "<="
+        time_conditions.append(f"TIME > {bounds[part]} AND TIME {upper} {bounds[part + 1]}")
+
+    return time_conditions
+
+
+def get_sql_data(sqlite_file_path=sqlite_file, partitions=1):
     # get uri
     sqlite_file_path = Path(sqlite_file_path).absolute()
 
@@ -65,14 +85,28 @@ def get_sql_data(sqlite_file_path=sqlite_file):
     #
     # print(f"polars thread pool size {pl.thread_pool_size()}")
 
-    # query with all data form sqlite
-    query = f"""
-            SELECT TAG, TIME, X, Y, NBS, VARX, VARY, COVXY
-            FROM LOCALIZATIONS
-            ORDER BY TIME ASC;
-            """
+    if partitions > 1:
+        # split the whole time range of the table, connectorx reads the parts in parallel
+        time_range = pl.read_database_uri("SELECT MIN(TIME) AS first, MAX(TIME) AS last FROM LOCALIZATIONS", db_uri)
+        time_conditions = get_time_partitions(time_range["first"][0] - 1, time_range["last"][0] + 1, partitions)
+        query = [f"""
+                SELECT TAG, TIME, X, Y, NBS, VARX, VARY, COVXY
+                FROM LOCALIZATIONS
+                WHERE {time_condition}
+                ORDER BY TIME ASC;
+                """ for time_condition in time_conditions]
+    else:
+        # query with all data form sqlite
+        query = f"""
+                SELECT TAG, TIME, X, Y, NBS, VARX, VARY, COVXY
+                FROM LOCALIZATIONS
+                ORDER BY TIME ASC;
+                """
     # run query
     watlas_df = pl.read_database_uri(query, db_uri)
+    if partitions > 1:
+        # the partitions can come back in any order
+        watlas_df = watlas_df.sort(by="TIME")
 
     # add short tag number column
     watlas_df = watlas_df.with_columns([
@@ -82,6 +116,17 @@ def get_sql_data(sqlite_file_path=sqlite_file):
     return watlas_df
 
 
+def get_parquet_data(dataset_path=parquet_dataset):
+    """
+    Read all data from the Parquet dataset made by sqlite_to_parquet.py, like get_sql_data
+    """
+    watlas_df = scan_localizations(dataset_path).sort(by="TIME").with_columns(
+        # add short tag number column
+        pl.col("TAG").cast(pl.String).str.slice(-4).cast(pl.Int64).alias("tag")).collect()
+
+    return watlas_df
+
+
 def read_tag_file(tag_csv_path=tag_file):
     """
     Read a xlsx file and return a polars dataframe
@@ -112,42 +157,49 @@ def join_tags(watlas_df, tags_df=read_tag_file()):
     return watlas_df
 
 
-def get_simple_travel_distance(watlas_df):
+def over_group(expression, by=None):
+    """
+    Calculate an expression per group (like per tag) when by is given, the rows of a group have to be sorted on time.
+    """
+    if by is None:
+        return expression
+    return expression.over(by)
+
+
+def get_simple_travel_distance(watlas_df, by=None):
     """
     Gets the Euclidean distance in meters between consecutive localization in a coordinate.
     Add claculated distance to each as column "distance"
     """
 
     watlas_df = watlas_df.with_columns(
-        (
+        over_group(
             ((pl.col("X") - pl.col("X").shift(1)) ** 2
-             + (pl.col("Y") - pl.col("Y").shift(1)) ** 2).sqrt()
+             + (pl.col("Y") - pl.col("Y").shift(1)) ** 2).sqrt(), by
         ).alias("distance")
     )
 
     return watlas_df
 
 
-def get_speed(watlas_df):
+def get_speed(watlas_df, by=None):
     """
     Calculate speed in meters per second for a watlas dataframe.
     Add claculated speed as column "speed"
     """
     # check if distance is already calculated
-    if "distance" not in watlas_df.columns:
-        watlas_df = get_simple_travel_distance(watlas_df)
+    if "distance" not in watlas_df.collect_schema().names():
+        watlas_df = get_simple_travel_distance(watlas_df, by)
 
-    # get distance
-    distance = watlas_df["distance"]
     # get the time interval in seconds between rows in the "TIME" column
-    time = (watlas_df["TIME"] - watlas_df["TIME"].shift(1)) / 1000
+    time = (pl.col("TIME") - pl.col("TIME").shift(1)) / 1000
     # calculate speed
-    speed = distance / time
+    speed = pl.col("distance") / time
 
     # add speed_in and speed_out to dataframe
     watlas_df = watlas_df.with_columns([
-        speed.alias("speed_in"),
-        speed.shift(-1).alias("speed_out")])
+        over_group(speed, by).alias("speed_in"),
+        over_group(speed.shift(-1), by).alias("speed_out")])
 
     return watlas_df
 
@@ -188,86 +240,74 @@ def aggregate_dataframe(watlas_df, interval="15s"):
     return watlas_df
 
 
-def smooth_data(watlas_df, moving_window=5):
+def smooth_data(watlas_df, moving_window=5, by=None):
     """
     Applies a median smooth defined by a rolling window to the X and Y
 
     Args:
         watlas_df (pl.Datafame):
         moving_window (int): the window size:
+        by (str): smooth every group (like "tag") on its own (optional)
     """
     watlas_df = watlas_df.with_columns(
         pl.col("X").alias("X_raw"),  # Keep original values
         pl.col("Y").alias("Y_raw"),  # Keep original values
         # Apply the forward and reverse rolling median on X
-        pl.col("X")
-        .reverse()
-        .rolling_median(window_size=moving_window, min_samples=1)
-        .reverse()
-        .rolling_median(window_size=moving_window, min_samples=1)
+        over_group(pl.col("X")
+                   .reverse()
+                   .rolling_median(window_size=moving_window, min_samples=1)
+                   .reverse()
+                   .rolling_median(window_size=moving_window, min_samples=1), by)
         .alias("X"),
         # Apply the forward and reverse rolling median on Y
-        pl.col("Y")
-        .reverse()
-        .rolling_median(window_size=moving_window, min_samples=1)
-        .reverse()
-        .rolling_median(window_size=moving_window, min_samples=1)
+        over_group(pl.col("Y")
+                   .reverse()
+                   .rolling_median(window_size=moving_window, min_samples=1)
+                   .reverse()
+                   .rolling_median(window_size=moving_window, min_samples=1), by)
+        .alias("Y")
     )
     return watlas_df
 
 
 def group_by_tag(watlas_df):
     """
-    Group by tag and apply median smooth, caluclate distace, speed and turn angle
+    Apply median smooth, caluclate distace and speed per tag, as window expressions over the tag
     Returns:
 
     """
-
-    # empty dataframe list
-    df_list = []
-
     # smooth and calculate per tag (these calculations have to be done per individual bird)
-    for _, wat_df in watlas_df.group_by("tag"):
-        # order by time
-        wat_df = wat_df.sort(by="TIME")
+    watlas_df = (
+        watlas_df.lazy()
+        # order by tag and time once
+        .sort(by=["tag", "TIME"])
         # apply median smooth
-        wat_df = smooth_data(wat_df)
+        .pipe(smooth_data, by="tag")
         # calculate distance and speed per tag
-        wat_df = get_speed(wat_df)
-        # calculate turn angle per tag
-
-        df_list.append(wat_df)
-
-    # concat dataframes to single dataframe
-    watlas_df = pl.concat(df_list)
+        .pipe(get_speed, by="tag")
+        .collect()
+    )
 
     return watlas_df
 
 
 def speed_and_smooth_by_tag(watlas_df):
     """
-    Group by tag and apply median smooth, caluclate distace, speed and turn angle
+    Apply median smooth, caluclate distace and speed per tag, as window expressions over the tag
     Returns:
 
     """
-
-    # empty dataframe list
-    df_list = []
-
     # smooth and calculate per tag (these calculations have to be done per individual bird)
-    for _, wat_df in watlas_df.group_by("tag"):
-        # order by time
-        wat_df = wat_df.sort(by="TIME")
+    watlas_df = (
+        watlas_df.lazy()
+        # order by tag and time once
+        .sort(by=["tag", "TIME"])
         # apply median smooth
-        wat_df = smooth_data(wat_df)
+        .pipe(smooth_data, by="tag")
         # calculate distance and speed per tag
-        wat_df = get_speed(wat_df)
-        # calculate turn angle per tag
-
-        df_list.append(wat_df)
-
-    # concat dataframes to single dataframe
-    watlas_df = pl.concat(df_list)
+        .pipe(get_speed, by="tag")
+        .collect()
+    )
 
     return watlas_df
 
@@ -288,6 +328,17 @@ def main():
     print(f"Time getting data from file: {time_get_data}")
     log_benchmark("read_sql", time_get_data, repeats)
 
+    # benchmark reading SQLite in a partition per thread
+    time_get_data = timeit(lambda: get_sql_data(partitions=pl.thread_pool_size()), number=repeats)
+    print(f"Time getting data from file in {pl.thread_pool_size()} partitions: {time_get_data}")
+    log_benchmark("read_sql_partitioned", time_get_data, repeats)
+
+    # benchmark reading the Parquet dataset, if it is made
+    if Path(parquet_dataset).exists():
+        time_get_data = timeit(lambda: get_parquet_data(), number=repeats)
+        print(f"Time getting data from parquet dataset: {time_get_data}")
+        log_benchmark("read_parquet", time_get_data, repeats)
+
     # print size
     print(f"shape of polars df: {watlas_df.shape}")
     print(f'size of df: {watlas_df.estimated_size("mb")} mb')
@@ -0,0 +1,180 @@
+"""
+Local Parquet cache of LOCALIZATIONS extracts, so a rerun over (partly) the same time window does not query the
+database again.
+
+The cache holds one Parquet file per day (UTC) and tag, in a hive style folder per database:
+<cache directory>/<database key>/day=2023-09-01/tag=31001001234.parquet. A request reads the days and tags that are
+in the cache and only queries the database for the missing ones, as whole days, so moving end_time forward by a day
+only fetches that day.
+
+Invalidation:
+- the database key contains the path, size and modification time of a SQLite file, so a changed file gets a new
+  (empty) cache; for MySQL the key is the host and database
+- only days that ended at least 'settle hours' ago are stored, newer data can still change (late downloads)
+- a new CACHE_VERSION starts a new cache
+
+Every hit touches its file, so the modification times give the least recently used order. When the cache grows past
+its maximum size the least recently used files are removed.
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import polars as pl
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = Path("~", ".cache", "watlas")
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+DEFAULT_SETTLE_HOURS = 24
+# one day in milliseconds, like TIME
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class LocalizationCache:
+    """
+    Least recently used cache of localizations, one Parquet file per day and tag.
+    """
+
+    def __init__(self, source, cache_dir=None, max_bytes=None, settle_hours=None):
+        """
+        Args:
+            source (dict): identifies the database, like the fingerprint of the SQLite file
+            cache_dir (str): folder of the cache (default ~/.cache/watlas)
+            max_bytes (int): maximum total size of the cache (default 10 GiB)
+            settle_hours (float): only days that ended this many hours ago are stored (default 24)
+        """
+        self.cache_dir = Path(cache_dir or DEFAULT_CACHE_DIR).expanduser()
+        self.max_bytes = DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+        self.settle_ms = (DEFAULT_SETTLE_HOURS if settle_hours is None else settle_hours) * 60 * 60 * 1000
+
+        # every database gets its own folder
+        key = json.dumps({"version": CACHE_VERSION, "source": source}, sort_keys=True)
+        self.source_dir = self.cache_dir / hashlib.sha256(key.encode()).hexdigest()[:16]
+
+    def get_entry_path(self, day, tag):
+        """
+        Get the file of a day (days since 1970-01-01 UTC) and tag (server tag number).
+        """
+        day_name = datetime.fromtimestamp(day * DAY_MS / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+        return self.source_dir / f"day={day_name}" / f"tag={tag}.parquet"
+
+    def read(self, tags, time_start, time_end, fetch):
+        """
+        Get the localizations of tags between time_start and time_end (both not included), from the cache where
+        possible and from the database for the rest.
+
+        Args:
+            tags (list): server tag numbers
+            time_start (int): UNIX time in milliseconds
+            time_end (int): UNIX time in milliseconds
+            fetch: function(tags, time_start, time_end) that queries the database, with the same time bounds
+
+        Returns:
+            watlas_df (pl.DataFrame): the localizations, sorted on TIME
+        """
+        # all days with a part of the time range
+        days = range(time_start // DAY_MS, (time_end - 1) // DAY_MS + 1)
+
+        # find the days and tags that are not in the cache yet
+        hit_paths = []
+        missing = {}
+        for day in days:
+            for tag in tags:
+                entry_path = self.get_entry_path(day, tag)
+                if entry_path.exists():
+                    hit_paths.append(entry_path)
+                else:
+                    missing.setdefault(day, []).append(tag)
+
+        # query the database for runs of days that miss the same tags, as whole days
+        frames = []
+        for first_day, last_day, missing_tags in get_day_runs(missing):
+            fetched_df = fetch(missing_tags, first_day * DAY_MS - 1, (last_day + 1) * DAY_MS)
+            self.store(fetched_df, range(first_day, last_day + 1), missing_tags)
+            frames.append(fetched_df.lazy())
+        if missing:
+            print(f"localizations of {sum(len(missing_tags) for missing_tags in missing.values())} days and tags "
+                  f"read from the database, {len(hit_paths)} from the cache")
+
+        if hit_paths:
+            # mark the entries as recently used
+            for entry_path in hit_paths:
+                os.utime(entry_path)
+            frames.append(pl.scan_parquet(hit_paths))
+
+        # the fetched data has whole days, only keep the asked time range
+        if not frames:
+            return fetch(tags, time_start, time_end)
+        watlas_df = pl.concat(frames, how="vertical_relaxed").filter(
+            (pl.col("TIME") > time_start) & (pl.col("TIME") < time_end)).sort(by="TIME").collect()
+
+        self.evict()
+        return watlas_df
+
+    def store(self, watlas_df, days, tags):
+        """
+        Store the localizations of whole days, one file per day and tag. Tags without localizations on a day get an
+        empty file, so they are not queried again. Days that have not settled yet are not stored.
+
+        Args:
+            watlas_df (pl.DataFrame): localizations of the tags on these days
+            days (range): days since 1970-01-01 UTC
+            tags (list): server tag numbers
+        """
+        settled_before = int(time.time() * 1000) - self.settle_ms
+        watlas_df = watlas_df.with_columns((pl.col("TIME") // DAY_MS).alias("day"))
+        for day in days:
+            if (day + 1) * DAY_MS > settled_before:
+                # data of this day can still come in
+                continue
+            day_df = watlas_df.filter(pl.col("day") == day).drop("day")
+            for tag in tags:
+                entry_path = self.get_entry_path(day, tag)
+                entry_path.parent.mkdir(parents=True, exist_ok=True)
+                # write to a temporary file first, a half written file is never read
+                tmp_path = entry_path.with_name(f"{entry_path.name}.{os.getpid()}.tmp")
+                day_df.filter(pl.col("TAG") == tag).write_parquet(tmp_path)
+                os.replace(tmp_path, entry_path)
+
+    def evict(self):
+        """
+        Remove the least recently used files until the cache fits in max_bytes.
+        """
+        entries = []
+        for entry_path in self.cache_dir.glob("*/day=*/*.parquet"):
+            stat = entry_path.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry_path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                entry_path.unlink()
+            except FileNotFoundError:
+                # removed by another run at the same time
+                pass
+            total_size -= size
+
+
+def get_day_runs(missing):
+    """
+    Combine consecutive days that miss the same tags, so they can be fetched with one query.
+
+    Args:
+        missing (dict): day -> list of missing tags
+
+    Returns:
+        runs (list): (first day, last day, tags) tuples
+    """
+    runs = []
+    for day in sorted(missing):
+        tags = missing[day]
+        if runs and runs[-1][1] == day - 1 and runs[-1][2] == tags:
+            runs[-1] = (runs[-1][0], day, tags)
+        else:
+            runs.append((day, day, tags))
+    return runs
@@ -0,0 +1,177 @@
+"""
+Convert the LOCALIZATIONS table of a WATLAS SQLite file to a Parquet dataset, once, so the data can be read with
+predicate and projection pushdown instead of going through the row oriented SQLite file every time.
+
+The dataset is hive partitioned on date (UTC) and tag: <dataset>/date=2023-09-01/TAG=31001001234/part-000000.parquet.
+A scan with a filter on TAG and TIME only opens the folders of those tags and dates, and only reads the columns that
+are used.
+
+The table is read in ranges of rowid (or of TIME), so only one batch of at most --batch-size rows is in memory at a
+time, however big the SQLite file is. Every batch writes its own part file in the folders it has data for. The dataset
+is written to <dataset>.tmp first and moved in place when it is complete.
+
+Example usage:
+    python3 sqlite_to_parquet.py data/watlas-2023.sqlite data/watlas-2023-parquet
+"""
+import argparse as ap
+import shutil
+import sys
+from pathlib import Path
+
+import polars as pl
+
+COLUMNS = ["TAG", "TIME", "X", "Y", "NBS", "VARX", "VARY", "COVXY"]
+# schema of the hive folders, date is only used to find the folders
+HIVE_SCHEMA = {"date": pl.Date, "TAG": pl.Int64}
+DEFAULT_BATCH_SIZE = 1_000_000
+HOUR_MS = 60 * 60 * 1000
+
+
+def argparser():
+    """
+    Argparse function for handling commandline arguments.
+    """
+    parser = ap.ArgumentParser(description="Convert the LOCALIZATIONS table of a WATLAS SQLite file to a Parquet "
+                                           "dataset partitioned on date and tag.")
+    parser.add_argument("sqlite_file", help="WATLAS SQLite file")
+    parser.add_argument("dataset", help="folder of the Parquet dataset to write")
+    parser.add_argument("--by", choices=["rowid", "time"], default="rowid",
+                        help="read the table in ranges of rowid or of TIME (default rowid)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, dest="batch_size",
+                        help=f"rows per batch when reading by rowid (default {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--batch-hours", type=float, default=1.0, dest="batch_hours",
+                        help="hours per batch when reading by TIME, use this when rowid does not work (default 1)")
+    parser.add_argument("--overwrite", action="store_true", help="replace the dataset if it exists")
+    return parser.parse_args()
+
+
+def get_batch_queries(db_uri, by="rowid", batch_size=DEFAULT_BATCH_SIZE, batch_hours=1.0):
+    """
+    Split the LOCALIZATIONS table in ranges of rowid or TIME, with one query per range.
+
+    Args:
+        db_uri (str): database URI
+        by (str): "rowid" or "time"
+        batch_size (int): rows per range, for rowid
+        batch_hours (float): hours per range, for time
+
+    Yields:
+        query (str): query of one range
+    """
+    column, step = ("rowid", batch_size) if by == "rowid" else ("TIME", int(batch_hours * HOUR_MS))
+    bounds = pl.read_database_uri(f"SELECT MIN({column}) AS first, MAX({column}) AS last FROM LOCALIZATIONS", db_uri)
+    first, last = bounds["first"][0], bounds["last"][0]
+    # empty table
+    if first is None:
+        return
+
+    for start in range(first, last + 1, max(step, 1)):
+        yield f"""
+        SELECT {', '.join(COLUMNS)}
+        FROM LOCALIZATIONS
+        WHERE {column} >= {start} AND {column} < {start + step};
+        """
+
+
+def write_batch(watlas_df, dataset_path, batch_nr):
+    """
+    Write one batch of localizations to the folders of its dates and tags.
+
+    Args:
+        watlas_df (pl.DataFrame): localizations
+        dataset_path (Path): folder of the dataset
+        batch_nr (int): number of the batch, used in the file names
+    """
+    watlas_df = watlas_df.with_columns(pl.from_epoch(pl.col("TIME"), time_unit="ms").dt.date().alias("date"))
+    for (date, tag), part_df in watlas_df.partition_by(["date", "TAG"], as_dict=True).items():
+        part_path = dataset_path / f"date={date}" / f"TAG={tag}"
+        part_path.mkdir(parents=True, exist_ok=True)
+        # the partition columns are in the folder names
+        part_df.drop("date", "TAG").sort(by="TIME").write_parquet(part_path / f"part-{batch_nr:06d}.parquet")
+
+
+def convert(sqlite_file_path, dataset_path, by="rowid", batch_size=DEFAULT_BATCH_SIZE, batch_hours=1.0,
+            overwrite=False):
+    """
+    Convert the LOCALIZATIONS table of a SQLite file to a hive partitioned Parquet dataset, one batch at a time.
+
+    Args:
+        sqlite_file_path (str): WATLAS SQLite file
+        dataset_path (str): folder of the Parquet dataset
+        by (str): read the table in ranges of "rowid" or "time" (default rowid)
+        batch_size (int): rows per batch when reading by rowid
+        batch_hours (float): hours per batch when reading by TIME
+        overwrite (bool): replace the dataset if it exists
+
+    Returns:
+        n_rows (int): number of localizations written
+    """
+    sqlite_file_path = Path(sqlite_file_path).absolute()
+    dataset_path = Path(dataset_path)
+    if not sqlite_file_path.exists():
+        sys.exit(f"SQLite file not found: {sqlite_file_path}")
+    if dataset_path.exists() and not overwrite:
+        sys.exit(f"{dataset_path} already exists, use --overwrite to replace it")
+
+    # a failed conversion never leaves a half dataset
+    tmp_path = dataset_path.with_name(f"{dataset_path.name}.tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    db_uri = f"sqlite:///{sqlite_file_path.as_posix()}"
+    n_rows = 0
+    for batch_nr, query in enumerate(get_batch_queries(db_uri, by, batch_size, batch_hours)):
+        watlas_df = pl.read_database_uri(query, db_uri)
+        if watlas_df.height > 0:
+            write_batch(watlas_df, tmp_path, batch_nr)
+            n_rows += watlas_df.height
+            print(f"batch {batch_nr}: {n_rows} localizations written")
+
+    if dataset_path.exists():
+        shutil.rmtree(dataset_path)
+    tmp_path.rename(dataset_path)
+    return n_rows
+
+
+def scan_localizations(dataset_path, server_tags=None, time_start=None, time_end=None):
+    """
+    Lazily scan a dataset written by convert. The filters on tag and time are pushed down, so only the folders of
+    those tags and dates are opened, and only the columns used later are read.
+
+    Args:
+        dataset_path (str): folder of the Parquet dataset
+        server_tags (list): 11 digit WATLAS tag IDs (default all tags)
+        time_start (int): UNIX time in milliseconds, not included (optional)
+        time_end (int): UNIX time in milliseconds, not included (optional)
+
+    Returns:
+        watlas_lf (pl.LazyFrame): the localizations with the columns of the LOCALIZATIONS table
+    """
+    watlas_lf = pl.scan_parquet(Path(dataset_path) / "**" / "*.parquet", hive_partitioning=True,
+                                hive_schema=HIVE_SCHEMA)
+
+    if server_tags is not None:
+        watlas_lf = watlas_lf.filter(pl.col("TAG").is_in(server_tags))
+    # a filter on date skips the folders of other days, the filter on TIME the rest
+    if time_start is not None:
+        watlas_lf = watlas_lf.filter((pl.col("date") >= pl.from_epoch(pl.lit(time_start), time_unit="ms").dt.date())
+                                     & (pl.col("TIME") > time_start))
+    if time_end is not None:
+        watlas_lf = watlas_lf.filter((pl.col("date") <= pl.from_epoch(pl.lit(time_end), time_unit="ms").dt.date())
+                                     & (pl.col("TIME") < time_end))
+
+    return watlas_lf.select(COLUMNS)
+
+
+def main():
+    """
+    Convert the SQLite file given on the commandline.
+    """
+    args = argparser()
+    n_rows = convert(args.sqlite_file, args.dataset, args.by, args.batch_size, args.batch_hours, args.overwrite)
+    print(f"{n_rows} localizations written to {args.dataset}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
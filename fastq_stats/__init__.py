@@ -0,0 +1,38 @@
+"""
+Shared code for the PHRED score assignments (Assignment1 to Assignment4).
+
+The assignment scripts add the root of the repository to sys.path and import from this package,
+so the scripts can still be started from their own folder.
+"""
+from fastq_stats.accumulator import PhredAccumulator, process_byte_range
+from fastq_stats.cache import ResultCache, get_fingerprint
+from fastq_stats.checkpoint import Checkpoint
+from fastq_stats.chunking import find_record_start, get_byte_ranges, read_byte_range
+from fastq_stats.composition import write_composition_csv, write_gc_csv
+from fastq_stats.engine import (add_kernel_argument, add_layout_arguments, add_profile_arguments,
+                                add_sample_arguments, add_statistics_arguments, check_arguments,
+                                get_cache, get_options, get_reports, make_jobs, process_jobs,
+                                run_job, use_cprofile, use_kernel, write_outfile, write_results)
+from fastq_stats.follow import FastqFollower, follow, replace_when_done
+from fastq_stats.kernels import KERNELS, get_kernel, set_kernel
+from fastq_stats.paired import (INTERLEAVED, LAYOUTS, PAIRED, SINGLE, get_output_names,
+                                make_layout_jobs, process_layout_job)
+from fastq_stats.partial import (combine_partials, get_array_task, read_partial,
+                                 select_task_jobs, write_partial)
+from fastq_stats.profiling import RunReport, profile_job, profile_stage
+from fastq_stats.sampling import DEFAULT_BLOCK_SIZE, make_sample_jobs
+from fastq_stats.threads import map_fastq_files, process_jobs_threaded
+from fastq_stats.tiles import get_tile_keys, write_tile_csv
+
+__all__ = ["PhredAccumulator", "process_byte_range", "Checkpoint", "find_record_start",
+           "get_byte_ranges", "read_byte_range", "combine_partials", "get_array_task",
+           "read_partial", "select_task_jobs", "write_partial", "get_tile_keys", "write_tile_csv",
+           "write_composition_csv", "write_gc_csv", "SINGLE", "PAIRED", "INTERLEAVED", "LAYOUTS",
+           "get_output_names", "make_layout_jobs", "process_layout_job", "DEFAULT_BLOCK_SIZE",
+           "make_sample_jobs", "FastqFollower", "follow", "replace_when_done",
+           "ResultCache", "get_fingerprint", "add_statistics_arguments", "add_layout_arguments",
+           "add_sample_arguments", "get_options", "check_arguments", "make_jobs", "get_cache",
+           "get_reports", "run_job", "process_jobs", "write_outfile", "write_results",
+           "add_kernel_argument", "use_kernel", "KERNELS", "get_kernel",
+           "set_kernel", "map_fastq_files", "process_jobs_threaded", "add_profile_arguments",
+           "use_cprofile", "RunReport", "profile_job", "profile_stage"]
@@ -0,0 +1,565 @@
+"""
+Per-position PHRED accumulator.
+
+Instead of keeping every decoded score and taking the mean at the end, every worker keeps a sum
+and a count per base position. Two accumulators can be merged by adding them, so results from
+processes, network clients or MPI ranks can be combined in any order.
+
+With histogram=True the accumulator also counts how often every PHRED value (0 to 93) is seen at
+every position. That is a fixed positions x 94 matrix no matter how many reads there are, and it
+is enough to get the exact median, quartiles and percentage of bases >= Q30 per position.
+
+With group_by_tile=True the accumulator also keeps one accumulator per flowcell:lane:tile, filled
+from the read names in the same pass.
+
+With composition=True the accumulator also counts the A, C, G, T and N bases per position and
+keeps a histogram of the GC percentage of the reads, decoded from the sequence lines in the same
+pass (see fastq_stats.composition).
+
+When numba is installed, accumulators that only keep the scores (and histogram) add them with the
+fused kernel of fastq_stats.kernels instead of the NumPy path below.
+
+With sampled=True every call to add_records is one sampled block (see fastq_stats.sampling). The
+accumulator then also keeps the sums of squares and products of the per block sums and counts,
+which is enough for the standard error of the mean per position, with the blocks as clusters.
+"""
+import json
+
+import numpy
+
+from fastq_stats.chunking import read_byte_range
+from fastq_stats.composition import (BASES, N_GC_BINS, decode_sequence_lines,
+                                     get_gc_histogram)
+from fastq_stats.kernels import (CARRIAGE_RETURN, N_PHRED_VALUES, NEWLINE, PHRED_OFFSET,
+                                 get_walk_function)
+from fastq_stats.tiles import get_tile_keys
+
+# two sided 95% confidence interval of the normal distribution
+Z_95 = 1.959963984540054
+
+
+def get_line_bounds(data):
+    """
+    Find the start and end of every line in a buffer.
+
+    Args:
+        data (numpy.ndarray): uint8 view of the raw fastq bytes
+
+    Returns:
+        starts, ends: arrays with the first byte and the end (exclusive, without newline)
+        of every line
+    """
+    ends = numpy.flatnonzero(data == NEWLINE)
+    # last line of a file does not always end with a newline
+    if data.size and data[-1] != NEWLINE:
+        ends = numpy.append(ends, data.size)
+    starts = numpy.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+
+    # strip \r from files with windows line endings
+    if ends.size:
+        has_cr = (ends > starts) & (data[numpy.maximum(ends - 1, 0)] == CARRIAGE_RETURN)
+        ends = ends - has_cr
+
+    return starts, ends
+
+
+def decode_quality_lines(data, starts, ends):
+    """
+    Decode quality lines into flat arrays of base positions and PHRED scores.
+
+    Args:
+        data (numpy.ndarray): uint8 view of the raw fastq bytes
+        starts (numpy.ndarray): start of every quality line
+        ends (numpy.ndarray): end of every quality line
+
+    Returns:
+        positions, scores: base position (0 based) and PHRED score of every base
+    """
+    lengths = ends - starts
+    total = int(lengths.sum())
+    # offset of the first base of every line in the flat output
+    line_offsets = numpy.cumsum(lengths) - lengths
+    positions = numpy.arange(total) - numpy.repeat(line_offsets, lengths)
+    scores = data[numpy.repeat(starts, lengths) + positions].astype(numpy.int64) - PHRED_OFFSET
+    return positions, scores
+
+
+class PhredAccumulator:
+    """
+    Running per-position sums and counts (and optionally a histogram) of PHRED scores for one
+    fastq file.
+    """
+
+    def __init__(self, sums=None, counts=None, n_reads=0, histogram=False, group_by_tile=False,
+                 composition=False, sampled=False):
+        """
+        Args:
+            sums (numpy.ndarray): sum of the PHRED scores per position
+            counts (numpy.ndarray): number of reads that reach each position
+            n_reads (int): number of reads seen
+            histogram (bool): also count every PHRED value per position
+            group_by_tile (bool): also keep an accumulator per flowcell:lane:tile
+            composition (bool): also count the bases per position and the GC content per read
+            sampled (bool): every add_records call is a sampled block, keep what is needed for
+                the standard error
+        """
+        self.sums = numpy.zeros(0, dtype=numpy.int64) if sums is None else numpy.asarray(
+            sums, dtype=numpy.int64)
+        self.counts = numpy.zeros(0, dtype=numpy.int64) if counts is None else numpy.asarray(
+            counts, dtype=numpy.int64)
+        self.n_reads = int(n_reads)
+        # positions x 94 matrix with the number of times every PHRED value is seen
+        self.histogram = None
+        if histogram:
+            self.histogram = numpy.zeros((self.sums.size, N_PHRED_VALUES), dtype=numpy.int64)
+        # flowcell:lane:tile -> PhredAccumulator
+        self.groups = {} if group_by_tile else None
+        # positions x 5 matrix with the number of A, C, G, T and N, and reads per GC percentage
+        self.bases = None
+        self.gc_histogram = None
+        if composition:
+            self.bases = numpy.zeros((self.sums.size, len(BASES)), dtype=numpy.int64)
+            self.gc_histogram = numpy.zeros(N_GC_BINS, dtype=numpy.int64)
+        # positions x 3 matrix with the sum of sum^2, sum * count and count^2 of the blocks
+        self.block_moments = None
+        self.n_blocks = 0
+        if sampled:
+            self.block_moments = numpy.zeros((self.sums.size, 3))
+
+    def _grow(self, length):
+        """
+        Make the arrays at least length positions long.
+        """
+        if length > self.sums.size:
+            self.sums = numpy.pad(self.sums, (0, length - self.sums.size))
+            self.counts = numpy.pad(self.counts, (0, length - self.counts.size))
+        if self.histogram is not None and length > self.histogram.shape[0]:
+            self.histogram = numpy.pad(self.histogram,
+                                       ((0, length - self.histogram.shape[0]), (0, 0)))
+        if self.bases is not None and length > self.bases.shape[0]:
+            self.bases = numpy.pad(self.bases, ((0, length - self.bases.shape[0]), (0, 0)))
+        if self.block_moments is not None and length > self.block_moments.shape[0]:
+            self.block_moments = numpy.pad(self.block_moments,
+                                           ((0, length - self.block_moments.shape[0]), (0, 0)))
+
+    def add_scores(self, positions, scores, n_reads):
+        """
+        Add decoded scores to the accumulator.
+
+        Args:
+            positions (numpy.ndarray): base position of every score
+            scores (numpy.ndarray): PHRED scores
+            n_reads (int): number of reads the scores came from
+        """
+        if positions.size and self.histogram is not None:
+            length = int(positions.max()) + 1
+            self._grow(length)
+            if scores.min() < 0 or scores.max() >= N_PHRED_VALUES:
+                raise ValueError("quality character outside of the PHRED+33 range")
+            # count every (position, score) combination, sums and counts follow from those
+            histogram = numpy.bincount(positions * N_PHRED_VALUES + scores,
+                                       minlength=length * N_PHRED_VALUES)
+            histogram = histogram.reshape(length, N_PHRED_VALUES)
+            self.histogram[:length] += histogram
+            self.sums[:length] += histogram @ numpy.arange(N_PHRED_VALUES)
+            self.counts[:length] += histogram.sum(axis=1)
+        elif positions.size:
+            length = int(positions.max()) + 1
+            self._grow(length)
+            self.sums[:length] += numpy.bincount(positions, weights=scores,
+                                                 minlength=length).astype(numpy.int64)
+            self.counts[:length] += numpy.bincount(positions, minlength=length)
+        self.n_reads += n_reads
+
+    def add_bases(self, positions, codes, lengths):
+        """
+        Add decoded bases to the base composition and GC histogram.
+
+        Args:
+            positions (numpy.ndarray): base position of every base
+            codes (numpy.ndarray): base code (index in BASES) of every base
+            lengths (numpy.ndarray): number of bases of every read
+        """
+        if positions.size:
+            length = int(positions.max()) + 1
+            self._grow(length)
+            bases = numpy.bincount(positions * len(BASES) + codes,
+                                   minlength=length * len(BASES))
+            self.bases[:length] += bases.reshape(length, len(BASES))
+        self.gc_histogram += get_gc_histogram(codes, lengths)
+
+    def add_block_moments(self, positions, scores):
+        """
+        Add the squares and products of the sums and counts of one sampled block.
+
+        Args:
+            positions (numpy.ndarray): base position of every score in the block
+            scores (numpy.ndarray): PHRED scores of the block
+        """
+        if positions.size:
+            length = int(positions.max()) + 1
+            self._grow(length)
+            block_sums = numpy.bincount(positions, weights=scores, minlength=length)
+            block_counts = numpy.bincount(positions, minlength=length).astype(float)
+            self.block_moments[:length] += numpy.stack(
+                [block_sums * block_sums, block_sums * block_counts, block_counts * block_counts],
+                axis=1)
+        self.n_blocks += 1
+
+    def add_quality_values(self, data, first_line, line_step, walk):
+        """
+        Add the quality lines of a buffer with the fused kernel (see fastq_stats.kernels).
+        Only for accumulators without tiles, composition or block moments.
+
+        Args:
+            data (numpy.ndarray): uint8 view of the raw bytes
+            first_line (int): line number of the first quality line (3 for fastq records)
+            line_step (int): number of lines from one quality line to the next
+            walk: the kernel function, kernels.walk_quality_lines (compiled or not)
+
+        Raises:
+            ValueError: if the number of lines is not a multiple of line_step, or a score is
+                outside of the PHRED+33 range when there is a histogram
+        """
+        no_histogram = numpy.zeros((0, N_PHRED_VALUES), dtype=numpy.int64)
+        # first walk only measures, so the arrays can be made long enough
+        n_lines, longest, _ = walk(data, first_line, line_step, self.sums, self.counts,
+                                   no_histogram, 0)
+        if n_lines % line_step != 0:
+            raise ValueError("line count can't be divided by 4, truncated record?")
+        self._grow(longest)
+        if self.histogram is None:
+            walk(data, first_line, line_step, self.sums, self.counts, no_histogram, 1)
+        else:
+            _, _, out_of_range = walk(data, first_line, line_step, self.sums, self.counts,
+                                      self.histogram, 2)
+            if out_of_range:
+                raise ValueError("quality character outside of the PHRED+33 range")
+        self.n_reads += n_lines // line_step
+
+    def uses_kernel(self, kernel=None):
+        """
+        Get the fused kernel if it can be used for this accumulator.
+
+        Args:
+            kernel (str): AUTO, NUMBA or NUMPY, default the one chosen with kernels.set_kernel
+
+        Returns:
+            the kernel function, or None for the NumPy path
+        """
+        if self.groups is not None or self.bases is not None or self.block_moments is not None:
+            return None
+        return get_walk_function(kernel)
+
+    def add_records(self, buffer, records=slice(None), kernel=None):
+        """
+        Decode a buffer of complete fastq records and add the quality scores.
+
+        Args:
+            buffer (bytes): raw fastq records, starting with a header line
+            records (slice): the records to add, for example slice(0, None, 2) for the read 1
+                records of an interleaved file (default all)
+            kernel (str): AUTO, NUMBA or NUMPY, default the one chosen with kernels.set_kernel
+        """
+        data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+        walk = self.uses_kernel(kernel)
+        if walk is not None and records == slice(None):
+            self.add_quality_values(data, 3, 4, walk)
+            return
+        starts, ends = get_line_bounds(data)
+        if starts.size % 4 != 0:
+            raise ValueError("line count can't be divided by 4, truncated record?")
+        if records != slice(None):
+            starts = starts.reshape(-1, 4)[records].ravel()
+            ends = ends.reshape(-1, 4)[records].ravel()
+
+        # every 4th line is a quality line
+        positions, scores = decode_quality_lines(data, starts[3::4], ends[3::4])
+        self.add_scores(positions, scores, starts.size // 4)
+        if self.block_moments is not None:
+            self.add_block_moments(positions, scores)
+
+        if self.bases is not None:
+            # every 4th line, starting at the 2nd, is a sequence line
+            base_positions, codes = decode_sequence_lines(data, starts[1::4], ends[1::4])
+            self.add_bases(base_positions, codes, ends[1::4] - starts[1::4])
+
+        if self.groups is not None:
+            keys, read_groups = get_tile_keys(data, starts[0::4], ends[0::4])
+            self.add_grouped_scores(keys, read_groups, ends[3::4] - starts[3::4], positions,
+                                    scores)
+
+    def add_grouped_scores(self, keys, read_groups, lengths, positions, scores):
+        """
+        Add decoded scores to the accumulator of the group of their read.
+
+        Args:
+            keys (list of str): group keys
+            read_groups (numpy.ndarray): index in keys of every read
+            lengths (numpy.ndarray): number of scores of every read
+            positions (numpy.ndarray): base position of every score
+            scores (numpy.ndarray): PHRED scores
+        """
+        # sort the scores on group once and hand every group its own slice
+        score_groups = numpy.repeat(read_groups, lengths)
+        order = numpy.argsort(score_groups, kind="stable")
+        score_bounds = numpy.searchsorted(score_groups[order], numpy.arange(len(keys) + 1))
+        n_reads = numpy.bincount(read_groups, minlength=len(keys))
+
+        for group_idx, key in enumerate(keys):
+            group_order = order[score_bounds[group_idx]:score_bounds[group_idx + 1]]
+            if key not in self.groups:
+                self.groups[key] = PhredAccumulator(histogram=self.histogram is not None)
+            self.groups[key].add_scores(positions[group_order], scores[group_order],
+                                        int(n_reads[group_idx]))
+
+    def add_quality_lines(self, buffer, kernel=None):
+        """
+        Decode a buffer in which every line is a quality line (like the output of
+        awk 'NR % 4 == 0') and add the scores.
+
+        Args:
+            buffer (bytes): quality lines, separated by newlines
+            kernel (str): AUTO, NUMBA or NUMPY, default the one chosen with kernels.set_kernel
+        """
+        data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+        walk = self.uses_kernel(kernel)
+        if walk is not None:
+            self.add_quality_values(data, 0, 1, walk)
+            return
+        starts, ends = get_line_bounds(data)
+        positions, scores = decode_quality_lines(data, starts, ends)
+        self.add_scores(positions, scores, starts.size)
+        if self.block_moments is not None:
+            self.add_block_moments(positions, scores)
+
+    def merge(self, other):
+        """
+        Add the counts of another accumulator to this one.
+
+        Args:
+            other (PhredAccumulator): accumulator to merge in
+
+        Returns:
+            self
+        """
+        if self.histogram is not None and other.histogram is None:
+            raise ValueError("can't merge an accumulator without histogram into one with")
+        self._grow(other.sums.size)
+        self.sums[:other.sums.size] += other.sums
+        self.counts[:other.counts.size] += other.counts
+        if self.histogram is not None:
+            self.histogram[:other.histogram.shape[0]] += other.histogram
+        if self.bases is not None:
+            if other.bases is None:
+                raise ValueError("can't merge an accumulator without base composition into one "
+                                 "with")
+            self.bases[:other.bases.shape[0]] += other.bases
+            self.gc_histogram += other.gc_histogram
+        if self.block_moments is not None:
+            if other.block_moments is None:
+                raise ValueError("can't merge an accumulator that is not sampled into a sampled "
+                                 "one")
+            self.block_moments[:other.block_moments.shape[0]] += other.block_moments
+            self.n_blocks += other.n_blocks
+        if self.groups is not None:
+            if other.groups is None:
+                raise ValueError("can't merge an accumulator without tile groups into one with")
+            for key, group in other.groups.items():
+                if key not in self.groups:
+                    self.groups[key] = group.empty_copy()
+                self.groups[key].merge(group)
+        self.n_reads += other.n_reads
+        return self
+
+    def mean(self):
+        """
+        Get the mean PHRED score for every position.
+
+        Returns:
+            list of float: mean score per position
+        """
+        return (self.sums / numpy.maximum(self.counts, 1)).tolist()
+
+    def quantile(self, fraction):
+        """
+        Get the exact quantile of the PHRED scores for every position from the histogram.
+        Uses the same (linear) interpolation as numpy.quantile.
+
+        Args:
+            fraction (float): quantile to get, 0.5 for the median
+
+        Returns:
+            numpy.ndarray: quantile per position
+        """
+        if self.histogram is None:
+            raise ValueError("quantiles need an accumulator with histogram=True")
+        cumulative = self.histogram.cumsum(axis=1)
+        # (0 based) rank of the scores on both sides of the quantile
+        rank = (self.counts - 1).clip(min=0) * fraction
+        low_rank = numpy.floor(rank)
+        high_rank = numpy.ceil(rank)
+        # the value at a rank is the first PHRED value where the cumulative count passes it
+        low = (cumulative <= low_rank[:, None]).sum(axis=1)
+        high = (cumulative <= high_rank[:, None]).sum(axis=1)
+        return low + (high - low) * (rank - low_rank)
+
+    def percent_at_least(self, threshold=30):
+        """
+        Get the percentage of bases with a PHRED score of at least threshold for every position.
+
+        Args:
+            threshold (int): PHRED score to compare with, default Q30
+
+        Returns:
+            numpy.ndarray: percentage per position
+        """
+        if self.histogram is None:
+            raise ValueError("percent_at_least needs an accumulator with histogram=True")
+        return 100 * self.histogram[:, threshold:].sum(axis=1) / numpy.maximum(self.counts, 1)
+
+    def standard_error(self):
+        """
+        Get the standard error of the mean PHRED score for every position of a sampled run.
+
+        Reads from the same block are not independent (same tile, same part of the run), so the
+        blocks are used as clusters: the mean is a ratio of the block sums and counts and its
+        variance follows from how much the blocks differ. No finite population correction is
+        used, so for large samples of the file the error is a bit too large.
+
+        Returns:
+            numpy.ndarray: standard error per position, nan with less than 2 blocks
+        """
+        if self.block_moments is None:
+            raise ValueError("standard errors need an accumulator with sampled=True")
+        if self.n_blocks < 2:
+            return numpy.full(self.sums.size, numpy.nan)
+        mean = self.sums / numpy.maximum(self.counts, 1)
+        square_sums, cross_products, square_counts = self.block_moments.T
+        # sum of the squared differences between every block sum and mean * block count
+        residuals = square_sums - 2 * mean * cross_products + mean ** 2 * square_counts
+        variance = (self.n_blocks / (self.n_blocks - 1) * residuals.clip(min=0)
+                    / numpy.maximum(self.counts, 1) ** 2)
+        return numpy.sqrt(variance)
+
+    def summary(self):
+        """
+        Get the output values for every position: the mean, with a histogram also the first
+        quartile, median, third quartile and percentage >= Q30, and for a sampled run also the
+        standard error and the lower and upper bound of the 95% confidence interval of the mean.
+
+        Returns:
+            list of tuples, one per position
+        """
+        columns = [self.mean()]
+        if self.histogram is not None:
+            columns += [self.quantile(0.25).tolist(), self.quantile(0.5).tolist(),
+                        self.quantile(0.75).tolist(), self.percent_at_least(30).tolist()]
+        if self.block_moments is not None:
+            standard_error = self.standard_error()
+            mean = numpy.array(columns[0])
+            columns += [standard_error.tolist(), (mean - Z_95 * standard_error).tolist(),
+                        (mean + Z_95 * standard_error).tolist()]
+        return list(zip(*columns))
+
+    def to_arrays(self, prefix=""):
+        """
+        Get the state as a dict of numpy arrays (for numpy.savez).
+
+        Args:
+            prefix (str): prefix for the array names, to store several accumulators in one file
+        """
+        arrays = {f"{prefix}sums": self.sums,
+                  f"{prefix}counts": self.counts,
+                  f"{prefix}n_reads": numpy.array(self.n_reads)}
+        if self.histogram is not None:
+            arrays[f"{prefix}histogram"] = self.histogram
+        if self.bases is not None:
+            arrays[f"{prefix}bases"] = self.bases
+            arrays[f"{prefix}gc_histogram"] = self.gc_histogram
+        if self.block_moments is not None:
+            arrays[f"{prefix}block_moments"] = self.block_moments
+            arrays[f"{prefix}n_blocks"] = numpy.array(self.n_blocks)
+        if self.groups is not None:
+            keys = sorted(self.groups)
+            arrays[f"{prefix}group_keys"] = numpy.array(json.dumps(keys))
+            for group_idx, key in enumerate(keys):
+                arrays.update(self.groups[key].to_arrays(prefix=f"{prefix}group{group_idx}_"))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=""):
+        """
+        Create an accumulator from arrays written with to_arrays.
+
+        Args:
+            arrays: dict like object with numpy arrays (like the result of numpy.load)
+            prefix (str): prefix used when saving
+        """
+        accumulator = cls(arrays[f"{prefix}sums"], arrays[f"{prefix}counts"],
+                          int(arrays[f"{prefix}n_reads"]))
+        if f"{prefix}histogram" in arrays:
+            accumulator.histogram = numpy.asarray(arrays[f"{prefix}histogram"],
+                                                  dtype=numpy.int64)
+        if f"{prefix}bases" in arrays:
+            accumulator.bases = numpy.asarray(arrays[f"{prefix}bases"], dtype=numpy.int64)
+            accumulator.gc_histogram = numpy.asarray(arrays[f"{prefix}gc_histogram"],
+                                                     dtype=numpy.int64)
+        if f"{prefix}block_moments" in arrays:
+            accumulator.block_moments = numpy.asarray(arrays[f"{prefix}block_moments"],
+                                                      dtype=float)
+            accumulator.n_blocks = int(arrays[f"{prefix}n_blocks"])
+        if f"{prefix}group_keys" in arrays:
+            keys = json.loads(str(arrays[f"{prefix}group_keys"]))
+            accumulator.groups = {key: cls.from_arrays(arrays, prefix=f"{prefix}group{group_idx}_")
+                                  for group_idx, key in enumerate(keys)}
+        return accumulator
+
+    @classmethod
+    def from_histogram(cls, histogram, n_reads=0):
+        """
+        Create an accumulator from a positions x 94 PHRED histogram.
+
+        Args:
+            histogram (numpy.ndarray): number of times every PHRED value is seen per position
+            n_reads (int): number of reads seen
+        """
+        histogram = numpy.asarray(histogram, dtype=numpy.int64)
+        accumulator = cls(histogram @ numpy.arange(N_PHRED_VALUES), histogram.sum(axis=1),
+                          n_reads)
+        accumulator.histogram = histogram.copy()
+        return accumulator
+
+    def empty_copy(self):
+        """
+        Get an empty accumulator with the same options as this one.
+        """
+        return PhredAccumulator(**self.options())
+
+    def options(self):
+        """
+        Get the options this accumulator was made with, as keyword arguments for the constructor.
+        """
+        return {"histogram": self.histogram is not None, "group_by_tile": self.groups is not None,
+                "composition": self.bases is not None, "sampled": self.block_moments is not None}
+
+
+def process_byte_range(fastq_path, start, end, **options):
+    """
+    Read a byte range of a fastq file and accumulate its quality scores.
+
+    Args:
+        fastq_path (str): path to the fastq file
+        start (int): first byte of the range (start of a record)
+        end (int): end of the range (exclusive, start of a record or end of file)
+        **options: options for PhredAccumulator (histogram, group_by_tile, composition,
+            sampled)
+
+    Returns:
+        PhredAccumulator: sums and counts of the range
+    """
+    accumulator = PhredAccumulator(**options)
+    accumulator.add_records(read_byte_range(fastq_path, start, end))
+    return accumulator
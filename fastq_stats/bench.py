@@ -0,0 +1,335 @@
+"""
+Benchmark runner for the PHRED engines.
+
+Runs every engine on every fastq file for every number of workers and number of chunks, records
+the wall time, reads per second and peak RSS (of the engine and all its child processes), and
+checks the mean per position against a plain Python reference. The results are written to
+<output>.csv and <output>.json.
+
+The engines and what workers and chunks mean for them:
+
+- serial: Assignment1 with -n 1, the chunks are done one after the other (only run once,
+  whatever --workers is)
+- pool: Assignment1 with a process pool of workers processes
+- threads: Assignment1 --threads with workers threads
+- server: Assignment2 server with one client of workers processes on this host (port 5381)
+- pipeline: Assignment3 behind awk and GNU parallel with workers long-lived workers, a block is
+  the file size / chunks
+- mpi: Assignment4 with mpirun -n workers
+
+Engines that can not run here (no mpirun, no GNU parallel) are skipped. Gzip compressed files
+only run in the pipeline, the other engines read byte ranges.
+
+Example usage:
+    python3 -m fastq_stats.synthetic -o reads.fastq -n 1000000 --min-length 50
+    python3 -m fastq_stats.bench reads.fastq -o results --engines pool threads mpi \\
+        --workers 1 2 4 --chunks 4 16
+"""
+import argparse as ap
+import csv
+import gzip
+import json
+import math
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fastq_stats.kernels import CARRIAGE_RETURN, KERNELS, NEWLINE, PHRED_OFFSET
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+ASSIGNMENT1 = REPO_DIR / "Assignment1" / "assignment1.py"
+ASSIGNMENT2 = REPO_DIR / "Assignment2" / "assignment2.py"
+ASSIGNMENT3 = REPO_DIR / "Assignment3" / "assignment3.py"
+ASSIGNMENT4 = REPO_DIR / "Assignment4" / "assignment4.py"
+ENGINES = ("serial", "pool", "threads", "server", "pipeline", "mpi")
+# seconds the server gets to start before the client connects
+SERVER_START_TIME = 2.0
+# means that differ less than this from the reference are the same
+TOLERANCE = 1e-9
+RESULT_FIELDS = ["engine", "workers", "chunks", "fastq", "repeat", "reads", "wall_time",
+                 "reads_per_s", "peak_rss_mb", "correct", "returncode"]
+
+
+def argparser():
+    """
+    Argparse function for handling commandline arguments.
+    """
+    parser = ap.ArgumentParser(description="Benchmark the PHRED engines.")
+    parser.add_argument("-o", action="store", dest="output", default="benchmark",
+                        help="Prefix of the output files, <output>.csv and <output>.json "
+                             "(default benchmark)")
+    parser.add_argument("--engines", action="store", nargs="+", choices=ENGINES,
+                        default=list(ENGINES), help="Engines to run (default all)")
+    parser.add_argument("--workers", action="store", nargs="+", type=int, default=[1, 2, 4],
+                        help="Numbers of workers to try (default 1 2 4)")
+    parser.add_argument("--chunks", action="store", nargs="+", type=int, default=[16],
+                        help="Numbers of chunks per file to try (default 16)")
+    parser.add_argument("-r", action="store", dest="repeats", type=int, default=1,
+                        help="Number of runs of every combination (default 1)")
+    parser.add_argument("--kernel", action="store", choices=KERNELS,
+                        help="Decode kernel for the engines (default their own default)")
+    parser.add_argument("--mpirun-args", action="store", dest="mpirun_args", default="",
+                        help="Extra arguments for mpirun, like \"--oversubscribe\"")
+    parser.add_argument("--no-check", action="store_false", dest="check",
+                        help="Do not compare the output with the reference")
+    parser.add_argument("fastq_files", action="store", nargs="+",
+                        help="Fastq files to run the engines on (see fastq_stats.synthetic)")
+    return parser.parse_args()
+
+
+def open_fastq(fastq_path):
+    """
+    Open a fastq file for reading bytes, gzip compressed if it ends with .gz.
+    """
+    if fastq_path.endswith(".gz"):
+        return gzip.open(fastq_path, "rb")
+    return open(fastq_path, "rb")
+
+
+def reference_means(fastq_path):
+    """
+    Calculate the mean PHRED score per position line by line in plain Python, without any of the
+    shared code the engines use.
+
+    Args:
+        fastq_path (str): path to the fastq file
+
+    Returns:
+        (number of reads, list of means) tuple
+    """
+    sums = []
+    counts = []
+    n_reads = 0
+    with open_fastq(fastq_path) as file:
+        for line_nr, line in enumerate(file):
+            if line_nr % 4 != 3:
+                continue
+            n_reads += 1
+            line = line.rstrip(bytes([NEWLINE, CARRIAGE_RETURN]))
+            if len(line) > len(sums):
+                sums.extend([0] * (len(line) - len(sums)))
+                counts.extend([0] * (len(line) - len(counts)))
+            for position, char in enumerate(line):
+                sums[position] += char - PHRED_OFFSET
+                counts[position] += 1
+    return n_reads, [total / count for total, count in zip(sums, counts)]
+
+
+def count_reads(fastq_path):
+    """
+    Count the reads of a fastq file.
+    """
+    with open_fastq(fastq_path) as file:
+        return sum(1 for _ in file) // 4
+
+
+def read_output(output_path, engine):
+    """
+    Read the means per position from the output of an engine.
+
+    Args:
+        output_path (str): the output file
+        engine (str): name of the engine, the pipeline prints "position mean" lines
+
+    Returns:
+        list of float: mean per position
+    """
+    with open(output_path, encoding="utf-8") as file:
+        if engine == "pipeline":
+            return [float(line.split()[1]) for line in file if line.strip()]
+        return [float(row[1]) for row in csv.reader(file) if row]
+
+
+def is_same(means, expected):
+    """
+    Compare the means of an engine with the reference.
+    """
+    return len(means) == len(expected) and all(
+        math.isclose(mean, expected_mean, rel_tol=TOLERANCE, abs_tol=TOLERANCE)
+        for mean, expected_mean in zip(means, expected))
+
+
+def can_run(engine, fastq_path, workers):
+    """
+    Check if an engine can run here on a file.
+
+    Returns:
+        str: why the engine can not run, None if it can
+    """
+    if fastq_path.endswith(".gz") and engine != "pipeline":
+        return "only the pipeline reads gzip files"
+    if engine == "mpi" and shutil.which("mpirun") is None:
+        return "mpirun not found"
+    if engine == "pipeline" and workers > 1 and shutil.which("parallel") is None:
+        return "GNU parallel not found"
+    return None
+
+
+def get_commands(engine, fastq_path, workers, chunks, output_path, args):
+    """
+    Get the commands that run an engine.
+
+    Args:
+        engine (str): one of ENGINES
+        fastq_path (str): the fastq file
+        workers (int): number of workers
+        chunks (int): number of chunks per file
+        output_path (str): file for the output
+        args: parsed arguments
+
+    Returns:
+        list of commands, started in this order (the server before its client). A command is a
+        list of arguments, or a string for a shell pipeline
+    """
+    python = sys.executable
+    kernel = ["--kernel", args.kernel] if args.kernel else []
+    if engine in ("serial", "pool", "threads"):
+        n_processes = 1 if engine == "serial" else workers
+        threads = ["--threads"] if engine == "threads" else []
+        return [[python, str(ASSIGNMENT1), "-n", str(n_processes), "--chunks", str(chunks),
+                 "--no-cache", "-o", output_path, *threads, *kernel, fastq_path]]
+    if engine == "server":
+        return [[python, str(ASSIGNMENT2), "-s", "--chunks", str(chunks), "--no-cache",
+                 "-o", output_path, fastq_path],
+                [python, str(ASSIGNMENT2), "-c", "--host", "localhost", "-n", str(workers),
+                 *kernel]]
+    if engine == "mpi":
+        return [["mpirun", *shlex.split(args.mpirun_args), "-n", str(workers), python,
+                 str(ASSIGNMENT4), "--chunks", str(chunks), "--no-cache", "-o", output_path,
+                 *kernel, fastq_path]]
+
+    # pipeline, every worker gets blocks of about file size / chunks
+    read = f"zcat {shlex.quote(fastq_path)}" if fastq_path.endswith(".gz") else (
+        f"cat {shlex.quote(fastq_path)}")
+    worker = shlex.join([python, str(ASSIGNMENT3), "-w", *kernel])
+    if workers > 1:
+        block_size = max(1024 * 1024, os.path.getsize(fastq_path) // chunks)
+        worker = (f"parallel --pipe --round-robin --block {block_size} -j {workers} "
+                  f"{shlex.quote(worker)}")
+    return [f"{read} | awk 'NR % 4 == 0' | {worker} | "
+            f"{shlex.join([python, str(ASSIGNMENT3), '-m'])} > {shlex.quote(output_path)}"]
+
+
+def run_commands(commands):
+    """
+    Run the commands of one engine and wait for all of them.
+
+    Args:
+        commands (list): see get_commands
+
+    Returns:
+        (wall time in seconds, peak RSS in MB of the largest process, highest return code) tuple
+    """
+    start = time.perf_counter()
+    processes = []
+    for command_idx, command in enumerate(commands):
+        if command_idx:
+            # give the server time to start listening
+            time.sleep(SERVER_START_TIME)
+        processes.append(subprocess.Popen(  # pylint: disable=consider-using-with
+            command, shell=isinstance(command, str), stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL))
+
+    peak_rss = 0
+    returncode = 0
+    for process in processes:
+        # wait4 gives the resource use of the process and the children it waited for
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in kilobytes on Linux
+        peak_rss = max(peak_rss, usage.ru_maxrss / 1024)
+        returncode = max(returncode, process.returncode)
+    return time.perf_counter() - start, peak_rss, returncode
+
+
+def write_results(output, results):
+    """
+    Write the results to <output>.csv and <output>.json.
+    """
+    with open(f"{output}.csv", "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+    with open(f"{output}.json", "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+
+
+def run_benchmark(engine, fastq_path, workers, chunks, output_path, args, n_reads, expected):
+    """
+    Run an engine once and check its output.
+
+    Args:
+        engine (str): one of ENGINES
+        fastq_path (str): the fastq file
+        workers (int): number of workers
+        chunks (int): number of chunks per file
+        output_path (str): file for the output of the engine
+        args: parsed arguments
+        n_reads (int): number of reads in the fastq file
+        expected (list of float): reference means, None to not check the output
+
+    Returns:
+        dict: one row of the results (without the repeat)
+    """
+    # an old output must not pass the check when the engine writes nothing
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    commands = get_commands(engine, os.path.abspath(fastq_path), workers, chunks, output_path,
+                            args)
+    wall_time, peak_rss, returncode = run_commands(commands)
+    correct = None
+    if expected is not None:
+        correct = (returncode == 0 and os.path.exists(output_path)
+                   and is_same(read_output(output_path, engine), expected))
+    print(f"{engine} workers={workers} chunks={chunks}: {wall_time:.2f} s, "
+          f"{n_reads / wall_time:.0f} reads/s, {peak_rss:.0f} MB, correct={correct}")
+    return {"engine": engine, "workers": workers, "chunks": chunks, "fastq": fastq_path,
+            "reads": n_reads, "wall_time": round(wall_time, 4),
+            "reads_per_s": round(n_reads / wall_time, 1), "peak_rss_mb": round(peak_rss, 1),
+            "correct": correct, "returncode": returncode}
+
+
+def main():
+    """
+    Run the benchmark given on the commandline.
+    """
+    args = argparser()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, "output.csv")
+        for fastq_path in args.fastq_files:
+            if args.check:
+                print(f"reference for {fastq_path}...")
+                n_reads, expected = reference_means(fastq_path)
+            else:
+                n_reads, expected = count_reads(fastq_path), None
+
+            for engine in args.engines:
+                # the serial engine does not use workers, run it once
+                for workers in [1] if engine == "serial" else args.workers:
+                    reason = can_run(engine, fastq_path, workers)
+                    if reason is not None:
+                        print(f"skip {engine} with {workers} workers: {reason}")
+                        continue
+                    for chunks in args.chunks:
+                        for repeat in range(args.repeats):
+                            result = run_benchmark(engine, fastq_path, workers, chunks,
+                                                   output_path, args, n_reads, expected)
+                            results.append({**result, "repeat": repeat})
+                            # write after every run, so a long sweep can be followed
+                            write_results(args.output, results)
+
+    write_results(args.output, results)
+    if any(result["correct"] is False for result in results):
+        print("some engines gave a wrong output")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+On-disk cache of finished accumulators, so a rerun over an unchanged fastq file does not decode
+it again.
+
+An entry is found by the fingerprint of the file: the absolute path, size and modification time
+and a sha256 of a few blocks spread over the file (the file is not read completely). The options
+of the accumulator (histogram, tiles, ...) are part of the key as well. Every entry is one .npz
+file; a hit touches the file, so the modification times of the entries give the least recently
+used order. When the cache grows past its maximum size the least recently used entries are
+removed.
+
+The cache lives in $FASTQ_STATS_CACHE_DIR (default ~/.cache/fastq_stats) and holds at most
+$FASTQ_STATS_CACHE_SIZE bytes (default 1 GiB).
+"""
+import hashlib
+import json
+import os
+
+import numpy
+
+from fastq_stats.accumulator import PhredAccumulator
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "fastq_stats")
+DEFAULT_MAX_BYTES = 1024 ** 3
+# number and size of the blocks that are hashed
+N_HASH_BLOCKS = 16
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+def get_fingerprint(fastq_path):
+    """
+    Get the fingerprint of a fastq file.
+
+    Args:
+        fastq_path (str): path to the fastq file
+
+    Returns:
+        dict: absolute path, size, modification time (ns) and sampled sha256 of the file
+    """
+    stat = os.stat(fastq_path)
+    sha256 = hashlib.sha256()
+    with open(fastq_path, "rb") as file:
+        # blocks from the start to the end of the file, the last one ends at the end of the file
+        last_offset = max(0, stat.st_size - HASH_BLOCK_SIZE)
+        for block_idx in range(N_HASH_BLOCKS):
+            file.seek(last_offset * block_idx // (N_HASH_BLOCKS - 1))
+            sha256.update(file.read(HASH_BLOCK_SIZE))
+    return {"path": os.path.abspath(fastq_path), "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns, "sha256": sha256.hexdigest()}
+
+
+class ResultCache:
+    """
+    Least recently used cache of accumulators, one .npz file per fastq file and options.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        """
+        Args:
+            cache_dir (str): folder of the cache, default $FASTQ_STATS_CACHE_DIR or
+                ~/.cache/fastq_stats
+            max_bytes (int): maximum total size of the entries, default $FASTQ_STATS_CACHE_SIZE
+                or 1 GiB
+        """
+        if cache_dir is None:
+            cache_dir = os.environ.get("FASTQ_STATS_CACHE_DIR", DEFAULT_CACHE_DIR)
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("FASTQ_STATS_CACHE_SIZE", DEFAULT_MAX_BYTES))
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        # state of the last lookup, used by store
+        self.fingerprints = []
+        self.options = {}
+        self.hits = {}
+
+    def lookup(self, fastq_paths, options):
+        """
+        Look up all fastq files of a run. The fingerprints are kept for store, so a file that
+        changes during the run is stored under its old fingerprint and never matches again.
+
+        Args:
+            fastq_paths (list of str): the fastq files
+            options (dict): options of the accumulators
+
+        Returns:
+            dict: file_idx -> cached PhredAccumulator, for the files that are in the cache
+        """
+        self.fingerprints = [get_fingerprint(fastq_path) for fastq_path in fastq_paths]
+        self.options = dict(options)
+        self.hits = {}
+        for file_idx, fingerprint in enumerate(self.fingerprints):
+            accumulator = self.get(fingerprint, self.options)
+            if accumulator is not None:
+                self.hits[file_idx] = accumulator
+        return dict(self.hits)
+
+    def store(self, accumulators):
+        """
+        Store the results of the files that were not found by the last lookup.
+
+        Args:
+            accumulators (list of PhredAccumulator): result of every fastq file of the lookup
+        """
+        for file_idx, (fingerprint, accumulator) in enumerate(zip(self.fingerprints,
+                                                                  accumulators)):
+            if file_idx not in self.hits:
+                self.put(fingerprint, self.options, accumulator)
+
+    def get_entry_path(self, fingerprint, options):
+        """
+        Get the file of the entry for a fingerprint and accumulator options.
+        """
+        key = json.dumps({"version": CACHE_VERSION, "file": fingerprint, "options": options},
+                         sort_keys=True)
+        return os.path.join(self.cache_dir, f"{hashlib.sha256(key.encode()).hexdigest()}.npz")
+
+    def get(self, fingerprint, options):
+        """
+        Get the cached accumulator of a file.
+
+        Args:
+            fingerprint (dict): fingerprint of the fastq file (see get_fingerprint)
+            options (dict): options of the accumulator
+
+        Returns:
+            PhredAccumulator or None if the file is not in the cache
+        """
+        entry_path = self.get_entry_path(fingerprint, options)
+        try:
+            with numpy.load(entry_path) as arrays:
+                accumulator = PhredAccumulator.from_arrays(arrays)
+        except (OSError, ValueError, KeyError):
+            # no entry, or a broken one that will be written again
+            return None
+        # mark the entry as recently used
+        os.utime(entry_path)
+        print(f"cached result found for {fingerprint['path']}")
+        return accumulator
+
+    def put(self, fingerprint, options, accumulator):
+        """
+        Store the accumulator of a file and remove old entries if the cache is too big.
+
+        Args:
+            fingerprint (dict): fingerprint of the fastq file (see get_fingerprint)
+            options (dict): options of the accumulator
+            accumulator (PhredAccumulator): the result for the whole file
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry_path = self.get_entry_path(fingerprint, options)
+        tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as file:
+            numpy.savez(file, **accumulator.to_arrays())
+        os.replace(tmp_path, entry_path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npz"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                # removed by another run at the same time
+                pass
+            total_size -= size
@@ -0,0 +1,161 @@
+"""
+Checkpoint and resume for long running PHRED jobs.
+
+The controller keeps the merged accumulator of every fastq file and the byte ranges that are
+already done. Every `interval` seconds both are written to disk, so a job that hits the SLURM time
+limit can be started again with --resume and skips the ranges that were already processed.
+"""
+import json
+import os
+import time
+
+import numpy
+
+from fastq_stats.accumulator import PhredAccumulator
+from fastq_stats.paired import SINGLE, get_output_names
+
+
+def get_file_signature(fastq_path):
+    """
+    Get the values used to check that a checkpoint belongs to the same input file.
+
+    Args:
+        fastq_path (str): path to the fastq file
+
+    Returns:
+        dict: absolute path and size of the file
+    """
+    return {"path": os.path.abspath(fastq_path), "size": os.path.getsize(fastq_path)}
+
+
+class Checkpoint:
+    """
+    Periodically save merged accumulators and completed byte ranges to a file.
+    """
+
+    def __init__(self, checkpoint_path, fastq_paths, interval=60.0, options=None, layout=SINGLE):
+        """
+        Args:
+            checkpoint_path (str): file to write the checkpoint to, None to only keep the
+                results in memory
+            fastq_paths (list of str): the fastq files of this run
+            interval (float): minimum number of seconds between two saves
+            options (dict): options for the accumulators (see PhredAccumulator)
+            layout (str): SINGLE, PAIRED or INTERLEAVED, paired data keeps one accumulator per
+                mate (see fastq_stats.paired)
+        """
+        self.checkpoint_path = checkpoint_path
+        self.files = [get_file_signature(path) for path in fastq_paths]
+        self.interval = interval
+        self.options = dict(options or {})
+        self.layout = layout
+        self.accumulators = [PhredAccumulator(**self.options)
+                             for _ in get_output_names(fastq_paths, layout)]
+        self.jobs = []
+        self.done = set()
+        self.last_save = time.monotonic()
+
+    def set_jobs(self, jobs):
+        """
+        Set the planned jobs. The plan is saved with the checkpoint, so a resumed run uses the
+        same byte ranges even if the number of chunks changed.
+
+        Args:
+            jobs (list of tuple): (file_idx, start, end) of every job, or any other tuple of ints
+                that starts with the index of its (first) accumulator
+        """
+        self.jobs = [tuple(job) for job in jobs]
+
+    def todo(self):
+        """
+        Get the jobs that are not done yet.
+
+        Returns:
+            list of (file_idx, start, end) tuples
+        """
+        return [job for job in self.jobs if job not in self.done]
+
+    def add_result(self, job, accumulator):
+        """
+        Merge the result of a finished job and save if the interval has passed.
+
+        Args:
+            job (tuple): (file_idx, start, end) of the finished job
+            accumulator (PhredAccumulator): result of the job, or a list of results that are
+                merged into the accumulators from job[0] on
+        """
+        job = tuple(job)
+        if job in self.done:
+            return
+        results = accumulator if isinstance(accumulator, list) else [accumulator]
+        for result_idx, result in enumerate(results):
+            self.accumulators[job[0] + result_idx].merge(result)
+        self.done.add(job)
+        self.maybe_save()
+
+    def maybe_save(self):
+        """
+        Save the checkpoint if the last save was more than interval seconds ago.
+        """
+        if self.checkpoint_path is not None and time.monotonic() - self.last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        """
+        Write the checkpoint. The file is written next to the target and then renamed, so a job
+        that gets killed while saving never leaves a broken checkpoint behind.
+        """
+        if self.checkpoint_path is None:
+            return
+        metadata = {"files": self.files, "options": self.options, "layout": self.layout}
+        job_width = len(self.jobs[0]) if self.jobs else 3
+        arrays = {"metadata": numpy.array(json.dumps(metadata)),
+                  "jobs": numpy.array(self.jobs, dtype=numpy.int64).reshape(-1, job_width),
+                  "done": numpy.array(sorted(self.done), dtype=numpy.int64).reshape(-1, job_width)}
+        for file_idx, accumulator in enumerate(self.accumulators):
+            arrays.update(accumulator.to_arrays(prefix=f"file{file_idx}_"))
+
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "wb") as file:
+            numpy.savez(file, **arrays)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        self.last_save = time.monotonic()
+
+    def load(self):
+        """
+        Load a saved checkpoint into this object.
+
+        Returns:
+            bool: True if a checkpoint was loaded, False if there is no checkpoint file yet
+
+        Raises:
+            ValueError: if the checkpoint was made for other input files, options or layout
+        """
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return False
+        with numpy.load(self.checkpoint_path) as arrays:
+            metadata = json.loads(str(arrays["metadata"]))
+            if metadata["files"] != self.files:
+                raise ValueError(f"checkpoint {self.checkpoint_path} was made for other input "
+                                 f"files: {metadata['files']}")
+            if metadata["options"] != self.options:
+                raise ValueError(f"checkpoint {self.checkpoint_path} was made with other "
+                                 f"options: {metadata['options']}")
+            if metadata.get("layout", SINGLE) != self.layout:
+                raise ValueError(f"checkpoint {self.checkpoint_path} was made for "
+                                 f"{metadata.get('layout', SINGLE)} reads")
+            self.jobs = [tuple(job) for job in arrays["jobs"].tolist()]
+            self.done = {tuple(job) for job in arrays["done"].tolist()}
+            self.accumulators = [PhredAccumulator.from_arrays(arrays, prefix=f"file{file_idx}_")
+                                 for file_idx in range(len(self.accumulators))]
+        print(f"resuming from checkpoint, {len(self.done)}/{len(self.jobs)} ranges done")
+        return True
+
+    def remove(self):
+        """
+        Remove the checkpoint file after a successful run.
+        """
+        if self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
@@ -0,0 +1,85 @@
+"""
+Split FastQ files into byte ranges that start and end on record boundaries.
+
+Workers get a (start, end) pair instead of a list of lines, so they can read their own part of
+the file. The controller only has to look at a few lines around every split point.
+"""
+import os
+
+
+def find_record_start(fastq_path, offset):
+    """
+    Find the byte offset of the first FastQ record that starts at or after offset.
+
+    A line starting with "@" is not enough to find a header, because a quality line can also start
+    with "@". A header is the only line where the line two further starts with "+".
+
+    Args:
+        fastq_path (str): path to the fastq file
+        offset (int): byte offset to start looking from
+
+    Returns:
+        int: byte offset of the next record start, or the file size if there is none
+    """
+    if offset <= 0:
+        return 0
+
+    with open(fastq_path, "rb") as file:
+        # start one byte back, so an offset that is already at the start of a line is kept
+        file.seek(offset - 1)
+        file.readline()
+
+        line_starts = []
+        lines = []
+        # a header is always found within 2 records (8 lines)
+        for _ in range(8):
+            line_starts.append(file.tell())
+            line = file.readline()
+            if not line:
+                break
+            lines.append(line)
+
+    for idx in range(len(lines) - 2):
+        if lines[idx].startswith(b"@") and lines[idx + 2].startswith(b"+"):
+            return line_starts[idx]
+
+    return os.path.getsize(fastq_path)
+
+
+def get_byte_ranges(fastq_path, n_chunks):
+    """
+    Divide a fastq file into (about) equal byte ranges that each hold whole records.
+
+    Args:
+        fastq_path (str): path to the fastq file
+        n_chunks (int): number of chunks wanted
+
+    Returns:
+        list of (start, end) tuples, end is exclusive
+    """
+    file_size = os.path.getsize(fastq_path)
+    n_chunks = max(1, n_chunks)
+
+    boundaries = {find_record_start(fastq_path, (file_size * idx) // n_chunks)
+                  for idx in range(n_chunks)}
+    boundaries.add(file_size)
+    boundaries = sorted(boundaries)
+
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def read_byte_range(fastq_path, start, end):
+    """
+    Read the bytes from start up to end from a fastq file.
+
+    Args:
+        fastq_path (str): path to the fastq file
+        start (int): first byte to read
+        end (int): byte to stop at (exclusive)
+
+    Returns:
+        bytes: the raw records in the range
+    """
+    with open(fastq_path, "rb") as file:
+        file.seek(start)
+        return file.read(end - start)
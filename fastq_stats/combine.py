@@ -0,0 +1,52 @@
+"""
+Combine partial files of a SLURM job array into the final CSV.
+
+Example usage:
+    python3 -m fastq_stats.combine -o output.csv partial_*.npz
+"""
+import argparse as ap
+import sys
+
+from fastq_stats.engine import get_reports, write_results
+from fastq_stats.partial import combine_partials
+
+
+def argparser():
+    """
+    Argparse function for handling commandline arguments.
+    """
+    parser = ap.ArgumentParser(description="Merge partial PHRED results into a CSV file.")
+    parser.add_argument("-o", action="store", dest="csvfile",
+                        type=ap.FileType('w', encoding='UTF-8'), required=False,
+                        help="CSV file to write the output to. Default is output to STDOUT")
+    parser.add_argument("--by-tile", action="store", dest="by_tile", required=False,
+                        help="CSV file for the statistics per flowcell, lane and tile, needs "
+                             "partials made with --by-tile")
+    parser.add_argument("--composition", action="store", required=False,
+                        help="CSV file for the A, C, G, T and N counts per position, needs "
+                             "partials made with --composition or --gc-histogram")
+    parser.add_argument("--gc-histogram", action="store", dest="gc_histogram", required=False,
+                        help="CSV file for the number of reads per GC percentage, needs "
+                             "partials made with --composition or --gc-histogram")
+    parser.add_argument("partial_files", action="store", nargs='+',
+                        help="Partial files written with the --partial option of an engine")
+    return parser.parse_args()
+
+
+def main():
+    """
+    Merge the partial files given on the commandline.
+    """
+    args = argparser()
+    try:
+        merged = combine_partials(args.partial_files)
+    except ValueError as error:
+        sys.exit(str(error))
+    # partials made with a histogram (--quantiles) also get the Q1, median, Q3 and % >= Q30
+    # columns, like the output of the engines
+    write_results(args.csvfile, list(merged), list(merged.values()), get_reports(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Per-position base composition and per-read GC content.
+
+The sequence line (line 2 of every record) is decoded in the same pass as the quality line. A
+256 entry lookup table turns every byte into a base code (A, C, G, T or N, anything else counts
+as N), so the counts per position are one bincount over the whole buffer, just like the scores.
+"""
+import csv
+
+import numpy
+
+BASES = "ACGTN"
+N_BASE_CODE = BASES.index("N")
+# byte value -> base code, lower case (soft masked) bases count as the upper case base
+BASE_LOOKUP = numpy.full(256, N_BASE_CODE, dtype=numpy.int64)
+for _code, _base in enumerate(BASES):
+    BASE_LOOKUP[ord(_base)] = _code
+    BASE_LOOKUP[ord(_base.lower())] = _code
+# GC percentage of a read, rounded to whole percents
+N_GC_BINS = 101
+
+
+def decode_sequence_lines(data, starts, ends):
+    """
+    Decode sequence lines into flat arrays of base positions and base codes.
+
+    Args:
+        data (numpy.ndarray): uint8 view of the raw fastq bytes
+        starts (numpy.ndarray): start of every sequence line
+        ends (numpy.ndarray): end of every sequence line
+
+    Returns:
+        positions, codes: base position (0 based) and base code (index in BASES) of every base
+    """
+    lengths = ends - starts
+    total = int(lengths.sum())
+    line_offsets = numpy.cumsum(lengths) - lengths
+    positions = numpy.arange(total) - numpy.repeat(line_offsets, lengths)
+    codes = BASE_LOOKUP[data[numpy.repeat(starts, lengths) + positions]]
+    return positions, codes
+
+
+def get_gc_histogram(codes, lengths):
+    """
+    Count the reads per GC percentage.
+
+    The GC percentage of a read is G + C divided by the number of A, C, G and T bases, so N's
+    do not lower it. Reads with only N's are not counted.
+
+    Args:
+        codes (numpy.ndarray): base code of every base
+        lengths (numpy.ndarray): number of bases of every read
+
+    Returns:
+        numpy.ndarray: number of reads for every GC percentage (0 to 100)
+    """
+    read_idx = numpy.repeat(numpy.arange(lengths.size), lengths)
+    is_gc = (codes == BASES.index("C")) | (codes == BASES.index("G"))
+    gc_bases = numpy.bincount(read_idx, weights=is_gc, minlength=lengths.size)
+    called_bases = numpy.bincount(read_idx, weights=codes != N_BASE_CODE, minlength=lengths.size)
+    called = called_bases > 0
+    percent = numpy.rint(100 * gc_bases[called] / called_bases[called]).astype(numpy.int64)
+    return numpy.bincount(percent, minlength=N_GC_BINS)
+
+
+def write_composition_csv(csv_path, fastq_names, accumulators):
+    """
+    Write the base counts per position of every fastq file to a CSV file.
+
+    Columns: fastq file, base number, number of A, C, G, T and N and the percentage of N.
+
+    Args:
+        csv_path (str): file to write
+        fastq_names (list of str): name of every fastq file
+        accumulators (list of PhredAccumulator): accumulators made with composition=True
+    """
+    print("write composition outfile...")
+    with open(csv_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["file", "base", *BASES.lower(), "percent_n"])
+        for fastq_name, accumulator in zip(fastq_names, accumulators):
+            bases = accumulator.bases
+            percent_n = 100 * bases[:, N_BASE_CODE] / numpy.maximum(bases.sum(axis=1), 1)
+            for base_nr, (counts, n_rate) in enumerate(zip(bases.tolist(), percent_n.tolist()),
+                                                       start=1):
+                writer.writerow([fastq_name, base_nr, *counts, n_rate])
+
+
+def write_gc_csv(csv_path, fastq_names, accumulators):
+    """
+    Write the per-read GC histogram of every fastq file to a CSV file.
+
+    Columns: fastq file, GC percentage, number of reads.
+
+    Args:
+        csv_path (str): file to write
+        fastq_names (list of str): name of every fastq file
+        accumulators (list of PhredAccumulator): accumulators made with composition=True
+    """
+    print("write GC outfile...")
+    with open(csv_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["file", "percent_gc", "reads"])
+        for fastq_name, accumulator in zip(fastq_names, accumulators):
+            writer.writerows([fastq_name, percent, reads]
+                             for percent, reads in enumerate(accumulator.gc_histogram.tolist()))
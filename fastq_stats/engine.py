@@ -0,0 +1,329 @@
+"""
+The PHRED statistics engine shared by all assignment scripts.
+
+Reading, decoding, merging and writing the output happens here (and in the modules it uses), so
+every script gives the same output and every speed up lands in all of them at once. The scripts
+only decide how the jobs are spread over the workers, the backend:
+
+- serial (Assignment1/script.py, or Assignment1 with -n 1): process_jobs with the builtin map
+- process pool (Assignment1): process_jobs with multiprocessing.Pool.imap_unordered
+- threads (Assignment1 --threads): threads.process_jobs_threaded, one shared mmap per file
+- network manager (Assignment2): a job queue on a BaseManager, clients read their own ranges
+- MPI (Assignment4): scatter and gather rounds over the MPI ranks
+
+Every backend adds the job profiles (see fastq_stats.profiling) to a RunReport, which the scripts
+write with --profile.
+
+Assignment3 reads quality lines from stdin instead of byte ranges, but uses the same accumulator.
+"""
+import csv
+import os
+import sys
+
+from fastq_stats.accumulator import PhredAccumulator
+from fastq_stats.cache import ResultCache
+from fastq_stats.composition import write_composition_csv, write_gc_csv
+from fastq_stats.kernels import AUTO, KERNELS, set_kernel
+from fastq_stats.paired import (INTERLEAVED, PAIRED, SINGLE, get_output_names, make_layout_jobs,
+                                process_layout_job)
+from fastq_stats.profiling import CPROFILE_DIR_VARIABLE, RunReport, profile_job
+from fastq_stats.sampling import DEFAULT_BLOCK_SIZE, make_sample_jobs
+from fastq_stats.tiles import write_tile_csv
+
+
+def add_statistics_arguments(parser):
+    """
+    Add the options for the statistics and the extra outputs to an argument parser.
+
+    Args:
+        parser: argparse parser or argument group
+    """
+    parser.add_argument("--quantiles", action="store_true",
+                        help="Houd een PHRED histogram per positie bij en voeg de kolommen "
+                             "Q1, mediaan, Q3 en percentage >= Q30 toe aan de output")
+    parser.add_argument("--by-tile", action="store", dest="by_tile", required=False,
+                        help="CSV file om de statistieken per flowcell, lane en tile (uit de "
+                             "Illumina read names) in op te slaan")
+    parser.add_argument("--composition", action="store", required=False,
+                        help="CSV file om het aantal A, C, G, T en N per positie (uit de "
+                             "sequence regels) in op te slaan")
+    parser.add_argument("--gc-histogram", action="store", dest="gc_histogram", required=False,
+                        help="CSV file om het aantal reads per GC percentage in op te slaan")
+    parser.add_argument("--no-cache", action="store_true", dest="no_cache",
+                        help="Gebruik de cache met resultaten van eerdere runs niet (niet "
+                             "lezen en niet schrijven)")
+
+
+def add_layout_arguments(parser):
+    """
+    Add the paired-end options to an argument parser.
+
+    Args:
+        parser: argparse parser or argument group
+    """
+    layout = parser.add_mutually_exclusive_group()
+    layout.add_argument("--paired", action="store_const", const=PAIRED, dest="layout",
+                        default=SINGLE,
+                        help="De fastq files zijn R1/R2 paren (R1 R2 [R1 R2 ...]), read 1 en "
+                             "read 2 krijgen elk hun eigen output")
+    layout.add_argument("--interleaved", action="store_const", const=INTERLEAVED, dest="layout",
+                        help="Elke fastq file bevat beide mates om en om (R1, R2, R1, R2, ...), "
+                             "read 1 en read 2 krijgen elk hun eigen output")
+
+
+def add_sample_arguments(parser):
+    """
+    Add the options for the sampled (approximate) mode to an argument parser.
+
+    Args:
+        parser: argparse parser or argument group
+    """
+    parser.add_argument("--sample", action="store", type=float, required=False,
+                        help="Lees alleen deze fractie (0 tot 1) van elke file, in random "
+                             "blokken verspreid over de file. Voegt de standaardfout en het "
+                             "95%% betrouwbaarheidsinterval van het gemiddelde toe")
+    parser.add_argument("--sample-block-size", action="store", type=int,
+                        default=DEFAULT_BLOCK_SIZE, dest="sample_block_size",
+                        help="Grootte van een blok in bytes voor --sample (default 1 MiB)")
+    parser.add_argument("--seed", action="store", type=int, required=False,
+                        help="Seed voor --sample, zodat elke run dezelfde blokken leest")
+
+
+def add_kernel_argument(parser):
+    """
+    Add the option to choose the decode kernel to an argument parser.
+
+    Args:
+        parser: argparse parser or argument group
+    """
+    parser.add_argument("--kernel", action="store", choices=KERNELS, default=None,
+                        help="Decode met de numba kernel of met NumPy (zie fastq_stats.kernels). "
+                             f"Default is $FASTQ_STATS_KERNEL of {AUTO}: numba als het "
+                             "geinstalleerd is")
+
+
+def use_kernel(args):
+    """
+    Use the decode kernel of the --kernel option in this process (and the processes it forks).
+
+    Args:
+        args: parsed arguments
+
+    Raises:
+        ValueError: if the kernel can not be used, see kernels.set_kernel
+    """
+    if getattr(args, "kernel", None) is not None:
+        set_kernel(args.kernel)
+
+
+def add_profile_arguments(parser):
+    """
+    Add the profiling options to an argument parser.
+
+    Args:
+        parser: argparse parser or argument group
+    """
+    parser.add_argument("--profile", action="store", required=False,
+                        help="JSON file om de tijd, CPU tijd, bytes, records en het geheugen "
+                             "per stap (read, decode, transfer, reduce, write) en per worker in "
+                             "op te slaan")
+    parser.add_argument("--cprofile", action="store", required=False,
+                        help="Map om per worker proces een cProfile dump (.prof) in op te slaan")
+
+
+def use_cprofile(args):
+    """
+    Turn on the cProfile dumps of --cprofile for the workers started from this process.
+
+    Args:
+        args: parsed arguments
+    """
+    if getattr(args, "cprofile", None):
+        # the workers inherit the environment, also when they are not forked
+        os.environ[CPROFILE_DIR_VARIABLE] = os.path.abspath(args.cprofile)
+
+
+def get_options(args):
+    """
+    Get the accumulator options from the parsed arguments.
+
+    Args:
+        args: parsed arguments, options a script does not have count as off
+
+    Returns:
+        dict: keyword arguments for PhredAccumulator
+    """
+    return {"histogram": getattr(args, "quantiles", False),
+            "group_by_tile": getattr(args, "by_tile", None) is not None,
+            "composition": bool(getattr(args, "composition", None)
+                                or getattr(args, "gc_histogram", None)),
+            "sampled": getattr(args, "sample", None) is not None}
+
+
+def check_arguments(args, fastq_paths):
+    """
+    Check the options that depend on each other and get the names of the outputs.
+
+    Args:
+        args: parsed arguments
+        fastq_paths (list of str): the fastq files
+
+    Returns:
+        list of str: name of every output (one per mate for paired data)
+
+    Raises:
+        ValueError: if the options can not be combined
+    """
+    layout = getattr(args, "layout", SINGLE)
+    output_names = get_output_names(fastq_paths, layout)
+    sample = getattr(args, "sample", None)
+    if sample is not None and not (0 < sample <= 1 and layout == SINGLE):
+        raise ValueError("--sample needs a fraction between 0 and 1 and single (not paired) "
+                         "fastq files")
+    return output_names
+
+
+def make_jobs(args, fastq_paths, n_chunks):
+    """
+    Plan the jobs of a run: random blocks with --sample, byte ranges otherwise.
+
+    Args:
+        args: parsed arguments
+        fastq_paths (list of str): the fastq files
+        n_chunks (int): number of byte ranges per file
+
+    Returns:
+        list of job tuples, the first value is the index of the (first) output of the job
+    """
+    if getattr(args, "sample", None) is not None:
+        # only a random part of the blocks of every file
+        return make_sample_jobs(fastq_paths, args.sample, args.sample_block_size, args.seed)
+    return make_layout_jobs(fastq_paths, n_chunks, getattr(args, "layout", SINGLE))
+
+
+def get_cache(args):
+    """
+    Get the result cache of a run.
+
+    Args:
+        args: parsed arguments
+
+    Returns:
+        ResultCache, or None if the results of this run can not be cached (a part of the files
+        or a sample) or --no-cache is given
+    """
+    if (getattr(args, "no_cache", False) or getattr(args, "partial", None)
+            or getattr(args, "sample", None) is not None
+            or getattr(args, "layout", SINGLE) != SINGLE):
+        return None
+    return ResultCache()
+
+
+def get_reports(args):
+    """
+    Get the extra CSV outputs that were asked for.
+
+    Args:
+        args: parsed arguments
+
+    Returns:
+        list of (write function, CSV file) tuples
+    """
+    return [(write_report, csv_path) for write_report, csv_path in
+            [(write_tile_csv, getattr(args, "by_tile", None)),
+             (write_composition_csv, getattr(args, "composition", None)),
+             (write_gc_csv, getattr(args, "gc_histogram", None))] if csv_path]
+
+
+def run_job(engine_job):
+    """
+    Decode one job. Used as the function of the map in process_jobs, so it can run in a pool
+    worker.
+
+    Args:
+        engine_job: (job, fastq_paths, layout, options) tuple
+
+    Returns:
+        (output_idx, list of PhredAccumulator, job profile) tuple, one accumulator per mate, the
+        job profile holds the read and decode times of the job (see profiling.profile_job)
+    """
+    job, fastq_paths, layout, options = engine_job
+    with profile_job() as job_profile:
+        results = process_layout_job(job, fastq_paths, layout, **options)
+    return job[0], results, job_profile
+
+
+def process_jobs(jobs, fastq_paths, options=None, layout=SINGLE, map_func=map, report=None):
+    """
+    Run jobs with a map function and merge the results.
+
+    Args:
+        jobs (list): jobs made by make_jobs
+        fastq_paths (list of str): the fastq files
+        options (dict): options for the accumulators
+        layout (str): SINGLE, PAIRED or INTERLEAVED
+        map_func: map to run the jobs with, for example Pool.imap_unordered (default the builtin
+            map, which runs them one after the other in this process)
+        report (RunReport): report to add the stages to (optional)
+
+    Returns:
+        list of PhredAccumulator, one for every output
+    """
+    options = options or {}
+    report = report or RunReport("process_jobs")
+    accumulators = [PhredAccumulator(**options) for _ in get_output_names(fastq_paths, layout)]
+    engine_jobs = [(job, fastq_paths, layout, options) for job in jobs]
+    job_results = map_func(run_job, engine_jobs)
+    while True:
+        # waiting for the next result is the transfer stage of the main process
+        with report.stage("transfer"):
+            job_result = next(job_results, None)
+        if job_result is None:
+            break
+        output_idx, results, job_profile = job_result
+        report.add_job(job_profile)
+        # merge the results in whatever order they come back
+        with report.stage("reduce"):
+            for mate, accumulator in enumerate(results):
+                accumulators[output_idx + mate].merge(accumulator)
+    return accumulators
+
+
+def write_outfile(csvfile, score_rows, output_name, multi_file):
+    """
+    Write the statistics of one output to a csv file or to the terminal if no file is given.
+
+    Args:
+        csvfile: open file to write to, None for STDOUT
+        score_rows: list of tuples, the mean quality score (and with --quantiles Q1, median, Q3
+            and % >= Q30) for each position
+        output_name: name of the fastq file (and mate) the scores belong to
+        multi_file: write the name above the scores, when there is more than one output
+    """
+    if csvfile is not None:
+        # keep the progress message out of csv output on STDOUT
+        print("write outfile...")
+    # add base number by value
+    final_list = [(base_num, *values) for base_num, values in enumerate(score_rows, start=1)]
+    writer = csv.writer(csvfile or sys.stdout)
+    if multi_file:
+        writer.writerow([output_name])
+    writer.writerows(final_list)
+    # the output can be read while the run goes on (--follow)
+    (csvfile or sys.stdout).flush()
+
+
+def write_results(csvfile, output_names, accumulators, reports=()):
+    """
+    Write the statistics of every output and the extra CSV outputs.
+
+    Args:
+        csvfile: open file to write to, None for STDOUT
+        output_names (list of str): name of every output
+        accumulators (list of PhredAccumulator): result of every output
+        reports: (write function, CSV file) tuples, see get_reports
+    """
+    for output_name, accumulator in zip(output_names, accumulators):
+        write_outfile(csvfile, accumulator.summary(), output_name, len(output_names) != 1)
+    for write_report, csv_path in reports:
+        write_report(csv_path, output_names, accumulators)
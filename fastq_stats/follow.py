@@ -0,0 +1,152 @@
+"""
+Follow fastq files that are still being written (like tail -f).
+
+A FastqFollower remembers up to which byte a file has been read. Every poll only reads what was
+appended since then and adds the complete records to the accumulator, which stays in memory for
+the whole run. A record that is only partly written stays in the file until the next poll, so the
+work per poll depends on the new data and not on the size of the file.
+"""
+import contextlib
+import os
+import time
+
+import numpy
+
+from fastq_stats.accumulator import NEWLINE
+
+# seconds to wait before looking at the files again when nothing was added
+POLL_INTERVAL = 1.0
+# largest part of a file that is read at once, a large backlog is read in several steps
+MAX_READ_SIZE = 64 * 1024 * 1024
+
+
+def get_complete_records_end(buffer):
+    """
+    Get the end of the last complete record in a buffer that starts on a record.
+
+    Args:
+        buffer (bytes): raw fastq data starting with a header line
+
+    Returns:
+        int: number of bytes that hold complete records (0 if there is none)
+    """
+    newlines = numpy.flatnonzero(numpy.frombuffer(buffer, dtype=numpy.uint8) == NEWLINE)
+    n_records = newlines.size // 4
+    if n_records == 0:
+        return 0
+    return int(newlines[4 * n_records - 1]) + 1
+
+
+@contextlib.contextmanager
+def replace_when_done(output_path):
+    """
+    Write an output file next to the target and move it in place when the block is done, so a
+    reader never sees a half written file.
+
+    Args:
+        output_path (str): file to replace
+
+    Yields:
+        str: path to write to
+    """
+    tmp_path = f"{output_path}.tmp"
+    yield tmp_path
+    os.replace(tmp_path, output_path)
+
+
+class FastqFollower:
+    """
+    Add the records that are appended to a fastq file to an accumulator.
+    """
+
+    def __init__(self, fastq_path, accumulator):
+        """
+        Args:
+            fastq_path (str): fastq file to follow
+            accumulator (PhredAccumulator): accumulator to add the records to
+        """
+        self.fastq_path = fastq_path
+        self.accumulator = accumulator
+        # start of the first record that is not added yet
+        self.offset = 0
+
+    def poll(self):
+        """
+        Add the complete records that were appended since the last poll.
+
+        Returns:
+            int: number of bytes added
+
+        Raises:
+            ValueError: if the file got smaller than what was already read
+        """
+        if os.path.getsize(self.fastq_path) < self.offset:
+            raise ValueError(f"{self.fastq_path} got smaller, was it written again?")
+
+        added = 0
+        with open(self.fastq_path, "rb") as file:
+            while True:
+                file.seek(self.offset)
+                buffer = file.read(MAX_READ_SIZE)
+                complete_end = get_complete_records_end(buffer)
+                if complete_end == 0:
+                    break
+                self.accumulator.add_records(buffer[:complete_end])
+                self.offset += complete_end
+                added += complete_end
+        return added
+
+    def finish(self):
+        """
+        Add the last record when the file does not end with a newline.
+        """
+        with open(self.fastq_path, "rb") as file:
+            file.seek(self.offset)
+            rest = file.read()
+        if not rest.strip():
+            return
+        try:
+            self.accumulator.add_records(rest)
+            self.offset += len(rest)
+        except ValueError:
+            print(f"ignoring the incomplete record at the end of {self.fastq_path}")
+
+
+def follow(followers, write_output, interval=30.0, idle_timeout=None):
+    """
+    Keep adding new records until the files stop growing (or Ctrl-C) and write the output
+    once in a while.
+
+    Args:
+        followers (list of FastqFollower): the files to follow
+        write_output: function without arguments that writes the results so far
+        interval (float): minimum number of seconds between two writes
+        idle_timeout (float): stop when no data was added for this many seconds, None to
+            follow until Ctrl-C
+    """
+    last_write = None
+    last_data = time.monotonic()
+    changed = False
+    try:
+        while True:
+            added = sum(follower.poll() for follower in followers)
+            now = time.monotonic()
+            if added:
+                last_data = now
+                changed = True
+            # only rewrite the output when there is something new
+            if changed and (last_write is None or now - last_write >= interval):
+                write_output()
+                last_write = now
+                changed = False
+            if idle_timeout is not None and now - last_data >= idle_timeout:
+                print(f"no new data for {idle_timeout} seconds, stop following")
+                break
+            if not added:
+                time.sleep(POLL_INTERVAL)
+    except KeyboardInterrupt:
+        print("stop following")
+
+    for follower in followers:
+        follower.finish()
+    write_output()
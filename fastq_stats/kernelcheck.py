@@ -0,0 +1,107 @@
+"""
+Check that the fused kernel (see fastq_stats.kernels) gives the same sums, counts, number of reads
+and histograms as the NumPy path, on random records and on the given fastq files. The compiled
+kernel is checked when numba is installed, the plain Python version otherwise.
+
+Example usage:
+    python3 -m fastq_stats.kernelcheck [file.fastq ...]
+"""
+import sys
+
+import numpy
+
+from fastq_stats.accumulator import PhredAccumulator
+from fastq_stats.kernels import (NUMPY, PHRED_OFFSET, compiled_walk_quality_lines,
+                                 walk_quality_lines)
+
+
+def is_same(expected, result):
+    """
+    Compare two accumulators.
+
+    Returns:
+        bool: True if the sums, counts, number of reads and histograms are the same
+    """
+    same = (numpy.array_equal(expected.sums, result.sums)
+            and numpy.array_equal(expected.counts, result.counts)
+            and expected.n_reads == result.n_reads)
+    if expected.histogram is not None:
+        same = same and numpy.array_equal(expected.histogram, result.histogram)
+    return same
+
+
+def check_kernel(buffer, histogram=False):
+    """
+    Decode a buffer of fastq records with the NumPy path and with the kernel and compare them,
+    both as fastq records and as quality lines only (the Assignment3 input).
+
+    Args:
+        buffer (bytes): raw fastq records
+        histogram (bool): also compare the histograms
+
+    Returns:
+        bool: True if both paths give the same result
+    """
+    walk = compiled_walk_quality_lines or walk_quality_lines
+    data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+
+    expected = PhredAccumulator(histogram=histogram)
+    expected.add_records(buffer, kernel=NUMPY)
+    result = PhredAccumulator(histogram=histogram)
+    result.add_quality_values(data, 3, 4, walk)
+    same = is_same(expected, result)
+
+    quality_lines = b"\n".join(buffer.split(b"\n")[3::4])
+    expected = PhredAccumulator(histogram=histogram)
+    expected.add_quality_lines(quality_lines, kernel=NUMPY)
+    result = PhredAccumulator(histogram=histogram)
+    result.add_quality_values(numpy.frombuffer(quality_lines, dtype=numpy.uint8), 0, 1, walk)
+    return same and is_same(expected, result)
+
+
+def make_test_records(n_reads=500, seed=0):
+    """
+    Make random fastq records with ragged read lengths (also empty reads), windows line endings
+    in some reads and no newline at the end.
+
+    Args:
+        n_reads (int): number of records
+        seed (int): seed for the random generator
+
+    Returns:
+        bytes: the records
+    """
+    rng = numpy.random.default_rng(seed)
+    records = []
+    for read_idx in range(n_reads):
+        length = int(rng.integers(0, 160))
+        quality = rng.integers(PHRED_OFFSET, PHRED_OFFSET + 42, length).astype(numpy.uint8)
+        end = b"\r\n" if read_idx % 7 == 0 else b"\n"
+        records.append(b"@read%d%s%s%s+%s%s%s" % (read_idx, end, b"N" * length, end, end,
+                                                  quality.tobytes(), end))
+    return b"".join(records).rstrip(b"\n")
+
+
+def main():
+    """
+    Compare the kernel with the NumPy path.
+    """
+    buffers = [("random records", make_test_records())]
+    for fastq_path in sys.argv[1:]:
+        with open(fastq_path, "rb") as file:
+            buffers.append((fastq_path, file.read()))
+
+    print("kernel: " + ("numba" if compiled_walk_quality_lines is not None
+                        else "plain Python (numba is not installed)"))
+    all_same = True
+    for name, buffer in buffers:
+        for histogram in (False, True):
+            same = check_kernel(buffer, histogram)
+            all_same = all_same and same
+            print(f"{name}{' with histogram' if histogram else ''}: "
+                  f"{'same' if same else 'DIFFERENT'}")
+    return 0 if all_same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Fused decode-and-add kernel for the quality scores.
+
+The NumPy path in fastq_stats.accumulator first builds arrays with the start and end of every
+line and the position and score of every base, and then adds those up with bincount. That needs
+several temporary arrays as big as the buffer. The fused kernel walks the raw bytes once, keeps
+track of the line number and adds every quality character straight into the sums, counts (and
+histogram) per position, without any temporary arrays.
+
+The kernel is compiled with numba when it is installed. Without numba the NumPy path is used;
+the plain Python version of the kernel is only used by the self check, it is far too slow for
+real data.
+
+Which path is used is set per process with set_kernel (the --kernel option of the engines) or
+$FASTQ_STATS_KERNEL:
+
+- auto (default): the kernel when numba is installed, NumPy otherwise
+- numba: always the kernel, an error if numba is not installed
+- numpy: always the NumPy path
+
+The kernel only does the scores. Accumulators that also need the tiles, the base composition or
+the sampled block moments, and the mates of an interleaved file, always use the NumPy path.
+
+Check that both paths give the same result with python3 -m fastq_stats.kernelcheck.
+"""
+import os
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+PHRED_OFFSET = 33
+# PHRED+33 uses the printable characters "!" (0) to "~" (93)
+N_PHRED_VALUES = 94
+NEWLINE = ord("\n")
+CARRIAGE_RETURN = ord("\r")
+
+AUTO = "auto"
+NUMBA = "numba"
+NUMPY = "numpy"
+KERNELS = (AUTO, NUMBA, NUMPY)
+
+
+def walk_quality_lines(data, first_line, line_step, sums, counts, histogram, add):
+    """
+    Walk over the lines of a buffer and add the scores of the quality lines.
+
+    With add=0 only the lines are counted and the longest quality line is measured, so the
+    arrays can be made long enough before the second walk adds the scores.
+
+    Args:
+        data (numpy.ndarray): uint8 view of the raw bytes
+        first_line (int): line number of the first quality line (3 for fastq records)
+        line_step (int): number of lines from one quality line to the next (4 for fastq records)
+        sums (numpy.ndarray): int64 sums per position, at least as long as the longest line
+        counts (numpy.ndarray): int64 counts per position
+        histogram (numpy.ndarray): int64 positions x 94 histogram, only used if add is 2
+        add (int): 0 to only measure, 1 to add the scores, 2 to add the scores and the histogram
+
+    Returns:
+        (number of lines, length of the longest quality line, 1 if a score is outside of the
+        PHRED+33 range (only checked for the histogram) else 0) tuple
+    """
+    n_lines = 0
+    longest = 0
+    out_of_range = 0
+    line_start = 0
+    size = data.shape[0]
+    for idx in range(size + 1):
+        # the last line of a file does not always end with a newline
+        if idx < size and data[idx] != NEWLINE:
+            continue
+        if idx == size and (size == 0 or data[size - 1] == NEWLINE):
+            break
+        if n_lines % line_step == first_line:
+            line_end = idx
+            # strip \r from files with windows line endings
+            if line_end > line_start and data[line_end - 1] == CARRIAGE_RETURN:
+                line_end -= 1
+            longest = max(longest, line_end - line_start)
+            if add:
+                for position in range(line_end - line_start):
+                    score = int(data[line_start + position]) - PHRED_OFFSET
+                    sums[position] += score
+                    counts[position] += 1
+                    if add == 2:
+                        if score < 0 or score >= N_PHRED_VALUES:
+                            out_of_range = 1
+                        else:
+                            histogram[position, score] += 1
+        n_lines += 1
+        line_start = idx + 1
+    return n_lines, longest, out_of_range
+
+
+if numba is not None:
+    # nogil, so threads can run the kernel at the same time
+    compiled_walk_quality_lines = numba.njit(cache=True, nogil=True)(walk_quality_lines)
+else:
+    compiled_walk_quality_lines = None
+
+_kernel = os.environ.get("FASTQ_STATS_KERNEL", AUTO)
+
+
+def set_kernel(kernel):
+    """
+    Choose the decode path for this process.
+
+    Args:
+        kernel (str): AUTO, NUMBA or NUMPY
+
+    Raises:
+        ValueError: for an unknown kernel, or NUMBA when numba is not installed
+    """
+    global _kernel  # pylint: disable=global-statement
+    if kernel not in KERNELS:
+        raise ValueError(f"unknown kernel {kernel}, choose from {', '.join(KERNELS)}")
+    if kernel == NUMBA and numba is None:
+        raise ValueError("the numba kernel needs numba, install it or use --kernel numpy")
+    _kernel = kernel
+
+
+def get_kernel():
+    """
+    Get the decode path chosen for this process.
+
+    Returns:
+        str: AUTO, NUMBA or NUMPY
+    """
+    return _kernel
+
+
+def get_walk_function(kernel=None):
+    """
+    Get the kernel to use in this process.
+
+    Args:
+        kernel (str): AUTO, NUMBA or NUMPY, default the one chosen with set_kernel
+
+    Returns:
+        the compiled walk_quality_lines, or None to use the NumPy path
+    """
+    if (kernel or _kernel) == NUMPY:
+        return None
+    return compiled_walk_quality_lines
@@ -0,0 +1,232 @@
+"""
+Paired-end FastQ files: R1/R2 file pairs or one interleaved file.
+
+Read 1 and read 2 get their own accumulator, so the statistics of both mates are reported
+separately. The byte ranges of R1 and R2 are lined up on record number: range i of R2 holds the
+mates of the reads in range i of R1, so one job reads both mates of the same reads in lockstep.
+In an interleaved file (R1, R2, R1, R2, ...) every range starts on a read 1 record.
+
+Jobs are (output_idx, start, end) for single and interleaved files and
+(output_idx, r1_start, r1_end, r2_start, r2_end) for R1/R2 pairs. The results of a job are merged
+into the accumulators from output_idx on (see get_output_names).
+"""
+import os
+
+import numpy
+
+from fastq_stats.accumulator import NEWLINE, PhredAccumulator
+from fastq_stats.chunking import find_record_start, get_byte_ranges, read_byte_range
+from fastq_stats.profiling import profile_stage
+
+SINGLE = "single"
+PAIRED = "paired"
+INTERLEAVED = "interleaved"
+LAYOUTS = (SINGLE, PAIRED, INTERLEAVED)
+# bytes to read at once when counting lines
+BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def get_output_names(fastq_paths, layout):
+    """
+    Get the name of every output (accumulator) of a run.
+
+    Args:
+        fastq_paths (list of str): the fastq files, for PAIRED R1 and R2 after each other
+        layout (str): SINGLE, PAIRED or INTERLEAVED
+
+    Returns:
+        list of str: one name per fastq file, for INTERLEAVED one per mate
+
+    Raises:
+        ValueError: if PAIRED gets an odd number of files
+    """
+    if layout == PAIRED and len(fastq_paths) % 2:
+        raise ValueError("paired mode needs an R1 and an R2 file for every sample")
+    if layout == INTERLEAVED:
+        return [f"{fastq_path} (R{mate})" for fastq_path in fastq_paths for mate in (1, 2)]
+    return list(fastq_paths)
+
+
+def count_records_before(fastq_path, offsets):
+    """
+    Count the records in front of every offset.
+
+    Args:
+        fastq_path (str): path to the fastq file
+        offsets (list of int): sorted record start offsets
+
+    Returns:
+        list of int: number of the record that starts at every offset
+    """
+    record_idxs = []
+    n_lines = 0
+    position = 0
+    with open(fastq_path, "rb") as file:
+        for offset in offsets:
+            while position < offset:
+                block = file.read(min(BLOCK_SIZE, offset - position))
+                if not block:
+                    break
+                n_lines += block.count(b"\n")
+                position += len(block)
+            record_idxs.append(n_lines // 4)
+    return record_idxs
+
+
+def find_record_offsets(fastq_path, record_idxs):
+    """
+    Find the byte offset of records by their number.
+
+    Args:
+        fastq_path (str): path to the fastq file
+        record_idxs (list of int): sorted record numbers (0 based)
+
+    Returns:
+        list of int: offset of every record, the file size for records past the end
+    """
+    # record i starts after newline 4 * i
+    line_targets = [4 * record_idx for record_idx in record_idxs]
+    offsets = [0 for target in line_targets if target == 0]
+    n_lines = 0
+    position = 0
+    with open(fastq_path, "rb") as file:
+        while len(offsets) < len(line_targets):
+            block = file.read(BLOCK_SIZE)
+            if not block:
+                break
+            newlines = numpy.flatnonzero(numpy.frombuffer(block, dtype=numpy.uint8) == NEWLINE)
+            while (len(offsets) < len(line_targets)
+                   and line_targets[len(offsets)] <= n_lines + newlines.size):
+                newline = newlines[line_targets[len(offsets)] - n_lines - 1]
+                offsets.append(position + int(newline) + 1)
+            n_lines += newlines.size
+            position += len(block)
+
+    file_size = os.path.getsize(fastq_path)
+    return offsets + [file_size] * (len(line_targets) - len(offsets))
+
+
+def get_paired_byte_ranges(r1_path, r2_path, n_chunks):
+    """
+    Divide an R1 and R2 file into byte ranges that hold the same reads.
+
+    R1 is split on bytes like a single file; the R2 boundaries are the records with the same
+    number. Finding those needs one pass that only counts newlines in both files.
+
+    Args:
+        r1_path (str): path to the read 1 file
+        r2_path (str): path to the read 2 file
+        n_chunks (int): number of chunks wanted
+
+    Returns:
+        list of (r1_start, r1_end, r2_start, r2_end) tuples
+    """
+    r1_ranges = get_byte_ranges(r1_path, n_chunks)
+    r1_starts = [start for start, _ in r1_ranges]
+    r2_starts = find_record_offsets(r2_path, count_records_before(r1_path, r1_starts))
+    r2_ends = r2_starts[1:] + [os.path.getsize(r2_path)]
+    return [(r1_start, r1_end, r2_start, r2_end) for (r1_start, r1_end), r2_start, r2_end
+            in zip(r1_ranges, r2_starts, r2_ends)]
+
+
+def get_interleaved_byte_ranges(fastq_path, n_chunks):
+    """
+    Divide an interleaved file into byte ranges that start on a read 1 record.
+
+    Args:
+        fastq_path (str): path to the interleaved fastq file
+        n_chunks (int): number of chunks wanted
+
+    Returns:
+        list of (start, end) tuples
+    """
+    starts = [start for start, _ in get_byte_ranges(fastq_path, n_chunks)]
+    # a range that starts on a read 2 record starts one record later
+    boundaries = {find_record_start(fastq_path, start + 1) if record_idx % 2 else start
+                  for start, record_idx in zip(starts, count_records_before(fastq_path, starts))}
+    boundaries.add(os.path.getsize(fastq_path))
+    boundaries = sorted(boundaries)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def make_layout_jobs(fastq_paths, n_chunks, layout):
+    """
+    Split the fastq files into jobs.
+
+    Args:
+        fastq_paths (list of str): the fastq files
+        n_chunks (int): number of byte ranges per file (per pair for PAIRED)
+        layout (str): SINGLE, PAIRED or INTERLEAVED
+
+    Returns:
+        list of job tuples, see the module docstring
+    """
+    jobs = []
+    if layout == PAIRED:
+        for r1_idx in range(0, len(fastq_paths), 2):
+            for byte_ranges in get_paired_byte_ranges(fastq_paths[r1_idx],
+                                                      fastq_paths[r1_idx + 1], n_chunks):
+                jobs.append((r1_idx, *byte_ranges))
+    elif layout == INTERLEAVED:
+        for file_idx, fastq_path in enumerate(fastq_paths):
+            for start, end in get_interleaved_byte_ranges(fastq_path, n_chunks):
+                jobs.append((2 * file_idx, start, end))
+    else:
+        for file_idx, fastq_path in enumerate(fastq_paths):
+            for start, end in get_byte_ranges(fastq_path, n_chunks):
+                jobs.append((file_idx, start, end))
+    return jobs
+
+
+def process_layout_job(job, fastq_paths, layout, read_range=read_byte_range, **options):
+    """
+    Decode the quality scores of one job. The read and decode stages are timed for --profile
+    (see fastq_stats.profiling).
+
+    Args:
+        job (tuple): job made by make_layout_jobs
+        fastq_paths (list of str): the fastq files
+        layout (str): SINGLE, PAIRED or INTERLEAVED
+        read_range: function (fastq_path, start, end) -> buffer that gets the bytes of a range,
+            default read_byte_range (the thread engine reads from a shared mmap instead)
+        **options: options for PhredAccumulator
+
+    Returns:
+        list of PhredAccumulator: one for a single file, read 1 and read 2 for paired data
+
+    Raises:
+        ValueError: if read 1 and read 2 do not have the same number of reads
+    """
+    def read(fastq_path, start, end):
+        with profile_stage("read") as counts:
+            buffer = read_range(fastq_path, start, end)
+            counts["bytes"] += len(buffer)
+        return buffer
+
+    def decode(accumulator, buffer, records=slice(None)):
+        with profile_stage("decode") as counts:
+            accumulator.add_records(buffer, records=records)
+            counts["records"] += accumulator.n_reads
+
+    read1 = PhredAccumulator(**options)
+    if layout == SINGLE:
+        file_idx, start, end = job
+        decode(read1, read(fastq_paths[file_idx], start, end))
+        return [read1]
+
+    read2 = PhredAccumulator(**options)
+    if layout == PAIRED:
+        r1_idx, r1_start, r1_end, r2_start, r2_end = job
+        decode(read1, read(fastq_paths[r1_idx], r1_start, r1_end))
+        decode(read2, read(fastq_paths[r1_idx + 1], r2_start, r2_end))
+    else:
+        output_idx, start, end = job
+        buffer = read(fastq_paths[output_idx // 2], start, end)
+        # records alternate between read 1 and read 2
+        decode(read1, buffer, slice(0, None, 2))
+        decode(read2, buffer, slice(1, None, 2))
+
+    if read1.n_reads != read2.n_reads:
+        raise ValueError(f"read 1 and read 2 are out of sync in job {job}: "
+                         f"{read1.n_reads} and {read2.n_reads} reads")
+    return [read1, read2]
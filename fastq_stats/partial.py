@@ -0,0 +1,146 @@
+"""
+Mergeable partial results for SLURM job arrays.
+
+A CSV with means can not be merged, because the number of reads behind every mean is lost. A
+partial file keeps the per-position sums and counts of every fastq file (as a numpy .npz, with the
+PHRED histogram, tile groups and base counts if the engine made them), so any number of partial
+files can be added up and turned into the final CSV afterwards with
+`python3 -m fastq_stats.combine`.
+"""
+import json
+import os
+
+import numpy
+
+from fastq_stats.accumulator import PhredAccumulator
+
+PARTIAL_FORMAT = "fastq_stats-partial"
+PARTIAL_VERSION = 1
+
+
+def get_array_task():
+    """
+    Get the index of this task and the number of tasks from the SLURM job array variables.
+
+    The variables can also be set by hand to test a job array locally, for example:
+    SLURM_ARRAY_TASK_ID=1 SLURM_ARRAY_TASK_COUNT=4 python3 assignment1.py ...
+
+    Returns:
+        (task_idx, n_tasks) tuple, (0, 1) when not running in a job array
+    """
+    if "SLURM_ARRAY_TASK_ID" not in os.environ:
+        return 0, 1
+
+    task_id = int(os.environ["SLURM_ARRAY_TASK_ID"])
+    task_min = int(os.environ.get("SLURM_ARRAY_TASK_MIN", 0))
+    if "SLURM_ARRAY_TASK_COUNT" in os.environ:
+        n_tasks = int(os.environ["SLURM_ARRAY_TASK_COUNT"])
+    else:
+        n_tasks = int(os.environ.get("SLURM_ARRAY_TASK_MAX", task_id)) - task_min + 1
+
+    task_idx = task_id - task_min
+    if not 0 <= task_idx < n_tasks:
+        raise ValueError(f"array task {task_id} is outside of the array "
+                         f"({task_min} - {task_min + n_tasks - 1})")
+    return task_idx, n_tasks
+
+
+def select_task_jobs(jobs, task_idx, n_tasks):
+    """
+    Get the part of the jobs that belongs to one array task.
+
+    Every task gets a block of neighbouring byte ranges, so each task reads a continuous part of
+    the files.
+
+    Args:
+        jobs (list): (file_idx, start, end) of all jobs, in the same order for every task
+        task_idx (int): index of this task
+        n_tasks (int): number of tasks in the array
+
+    Returns:
+        list: the jobs of this task
+    """
+    first = (len(jobs) * task_idx) // n_tasks
+    last = (len(jobs) * (task_idx + 1)) // n_tasks
+    return jobs[first:last]
+
+
+def write_partial(partial_path, fastq_names, accumulators, task=(0, 1)):
+    """
+    Write the sums and counts of every fastq file to a partial file.
+
+    The file is written next to the target and then renamed, so the combine step never sees a
+    half written file.
+
+    Args:
+        partial_path (str): file to write
+        fastq_names (list of str): name of every fastq file, used to merge partials
+        accumulators (list of PhredAccumulator): result for every fastq file
+        task (tuple): (task_idx, n_tasks) of the array task that made the partial
+    """
+    metadata = {"format": PARTIAL_FORMAT, "version": PARTIAL_VERSION,
+                "files": list(fastq_names), "task": list(task)}
+    arrays = {"metadata": numpy.array(json.dumps(metadata))}
+    for file_idx, accumulator in enumerate(accumulators):
+        arrays.update(accumulator.to_arrays(prefix=f"file{file_idx}_"))
+
+    tmp_path = f"{partial_path}.tmp"
+    with open(tmp_path, "wb") as file:
+        numpy.savez(file, **arrays)
+    os.replace(tmp_path, partial_path)
+    print(f"partial results written to {partial_path}")
+
+
+def read_partial(partial_path):
+    """
+    Read a partial file.
+
+    Args:
+        partial_path (str): file written by write_partial
+
+    Returns:
+        (metadata, accumulators) tuple, metadata is a dict with the file names and the task
+
+    Raises:
+        ValueError: if the file is not a partial file
+    """
+    with numpy.load(partial_path) as arrays:
+        if "metadata" not in arrays:
+            raise ValueError(f"{partial_path} is not a partial file")
+        metadata = json.loads(str(arrays["metadata"]))
+        if metadata.get("format") != PARTIAL_FORMAT:
+            raise ValueError(f"{partial_path} is not a partial file")
+        accumulators = [PhredAccumulator.from_arrays(arrays, prefix=f"file{file_idx}_")
+                        for file_idx in range(len(metadata["files"]))]
+    return metadata, accumulators
+
+
+def combine_partials(partial_paths):
+    """
+    Merge any number of partial files.
+
+    Args:
+        partial_paths (list of str): partial files to merge
+
+    Returns:
+        dict: fastq file name -> merged PhredAccumulator, in the order the names were first seen
+
+    Raises:
+        ValueError: if the same array task is found twice
+    """
+    merged = {}
+    seen_tasks = {}
+    for partial_path in partial_paths:
+        metadata, accumulators = read_partial(partial_path)
+
+        # the same task twice (for example a resubmitted task) would count its reads double
+        task = tuple(metadata["task"])
+        if task[1] > 1 and task in seen_tasks:
+            raise ValueError(f"{partial_path} and {seen_tasks[task]} are both from array task "
+                             f"{task[0]} of {task[1]}")
+        seen_tasks[task] = partial_path
+
+        for fastq_name, accumulator in zip(metadata["files"], accumulators):
+            merged.setdefault(fastq_name, accumulator.empty_copy()).merge(accumulator)
+
+    return merged
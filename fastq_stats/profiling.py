@@ -0,0 +1,245 @@
+"""
+Time per stage and per worker, for the --profile report of the engines.
+
+The stages are:
+
+- read: getting the bytes of a job from the file
+- decode: adding the records to the accumulators
+- transfer: sending jobs and results between the workers and the main process (measured where the
+  results come in, so it includes waiting for the workers)
+- reduce: merging the results of the jobs
+- write: writing the outputs
+
+Every job records its read and decode stages in a JobProfile (wall time, CPU time of the thread,
+bytes, records), which goes back to the main process together with the result, so it works the
+same for the pool, threads, network clients and MPI ranks. Measuring costs a few clock reads per
+job, so it is always on; the report is only written with --profile.
+
+With --cprofile DIR (or $FASTQ_STATS_CPROFILE_DIR) every worker process (and thread) also runs
+its jobs under cProfile and writes DIR/<host>-<pid>[-<thread>].prof after every job. Those files
+open with pstats or snakeviz. For a sampling profile use py-spy on the worker pids in the report,
+for example py-spy record --subprocesses -o profile.svg -- python3 assignment1.py ...
+"""
+import contextlib
+import cProfile
+import json
+import os
+import resource
+import socket
+import threading
+import time
+
+STAGES = ("read", "decode", "transfer", "reduce", "write")
+CPROFILE_DIR_VARIABLE = "FASTQ_STATS_CPROFILE_DIR"
+
+# the job profile of the job that runs in this thread, and its cProfile
+_local = threading.local()
+
+
+def get_worker_id():
+    """
+    Get the name of this worker: host and pid, and the thread name for extra threads.
+
+    Returns:
+        str: host:pid or host:pid:thread
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    if threading.current_thread() is not threading.main_thread():
+        worker_id += f":{threading.current_thread().name}"
+    return worker_id
+
+
+def get_peak_rss_mb():
+    """
+    Get the peak resident memory of this process.
+
+    Returns:
+        float: peak RSS in MB (ru_maxrss is in kilobytes on Linux)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageTimes:
+    """
+    Wall time, CPU time, bytes, records and number of calls per stage.
+    """
+
+    def __init__(self, stages=None):
+        """
+        Args:
+            stages (dict): stage -> dict with the totals, to continue from
+        """
+        self.stages = {name: dict(values) for name, values in (stages or {}).items()}
+
+    def add(self, name, wall_time=0.0, cpu_time=0.0, n_bytes=0, records=0, calls=1):
+        """
+        Add the time and counts of one (or more) calls to a stage.
+        """
+        values = self.stages.setdefault(name, {"wall_time": 0.0, "cpu_time": 0.0, "bytes": 0,
+                                               "records": 0, "calls": 0})
+        values["wall_time"] += wall_time
+        values["cpu_time"] += cpu_time
+        values["bytes"] += n_bytes
+        values["records"] += records
+        values["calls"] += calls
+
+    def merge(self, stages):
+        """
+        Add the totals of other stage times.
+
+        Args:
+            stages (dict): stage -> dict with the totals (StageTimes.stages)
+        """
+        for name, values in stages.items():
+            self.add(name, values["wall_time"], values["cpu_time"], values["bytes"],
+                     values["records"], values["calls"])
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time a block as one call to a stage.
+
+        Args:
+            name (str): one of STAGES
+
+        Yields:
+            dict: add the "bytes" and "records" of the block to it
+        """
+        counts = {"bytes": 0, "records": 0}
+        wall_start = time.perf_counter()
+        # the CPU time of this thread, so threads do not count each other
+        cpu_start = time.thread_time()
+        try:
+            yield counts
+        finally:
+            self.add(name, time.perf_counter() - wall_start, time.thread_time() - cpu_start,
+                     counts["bytes"], counts["records"])
+
+
+@contextlib.contextmanager
+def profile_stage(name):
+    """
+    Time a block as a stage of the job that runs in this thread. Does nothing outside of
+    profile_job, so the shared code can always call it.
+
+    Args:
+        name (str): one of STAGES
+
+    Yields:
+        dict: add the "bytes" and "records" of the block to it
+    """
+    job_times = getattr(_local, "job_times", None)
+    if job_times is None:
+        yield {"bytes": 0, "records": 0}
+        return
+    with job_times.stage(name) as counts:
+        yield counts
+
+
+def get_cprofile():
+    """
+    Get the cProfile of this thread when --cprofile is used.
+
+    Returns:
+        (cProfile.Profile, path of the dump) tuple, or (None, None)
+    """
+    cprofile_dir = os.environ.get(CPROFILE_DIR_VARIABLE)
+    if not cprofile_dir:
+        return None, None
+    if getattr(_local, "cprofile", None) is None:
+        os.makedirs(cprofile_dir, exist_ok=True)
+        name = get_worker_id().replace(":", "-")
+        _local.cprofile = cProfile.Profile()
+        _local.cprofile_path = os.path.join(cprofile_dir, f"{name}.prof")
+    return _local.cprofile, _local.cprofile_path
+
+
+@contextlib.contextmanager
+def profile_job():
+    """
+    Collect the stages of one job that runs in this thread.
+
+    Yields:
+        dict: filled in when the block ends, with the worker id, the peak RSS of the worker and
+        the stage times of the job (see RunReport.add_job)
+    """
+    job_profile = {}
+    _local.job_times = StageTimes()
+    cprofile, cprofile_path = get_cprofile()
+    if cprofile is not None:
+        cprofile.enable()
+    try:
+        yield job_profile
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+            # written after every job, a worker can be stopped at any time
+            cprofile.dump_stats(cprofile_path)
+        job_profile.update({"worker": get_worker_id(), "pid": os.getpid(),
+                            "peak_rss_mb": get_peak_rss_mb(), "stages": _local.job_times.stages})
+        _local.job_times = None
+
+
+class RunReport:
+    """
+    The profile of a whole run: the stages of the main process and of every worker.
+    """
+
+    def __init__(self, engine):
+        """
+        Args:
+            engine (str): name of the engine, stored in the report
+        """
+        self.engine = engine
+        self.start = time.perf_counter()
+        self.main = StageTimes()
+        # worker id -> {"pid", "jobs", "peak_rss_mb", "stages"}
+        self.workers = {}
+
+    def stage(self, name):
+        """
+        Time a block of the main process as a stage, see StageTimes.stage.
+        """
+        return self.main.stage(name)
+
+    def add_job(self, job_profile):
+        """
+        Add the profile of a job (from profile_job) to its worker.
+
+        Args:
+            job_profile (dict): profile of a job, None is ignored
+        """
+        if not job_profile:
+            return
+        worker = self.workers.setdefault(job_profile["worker"], {
+            "pid": job_profile["pid"], "jobs": 0, "peak_rss_mb": 0.0, "stages": StageTimes()})
+        worker["jobs"] += 1
+        worker["peak_rss_mb"] = max(worker["peak_rss_mb"], job_profile["peak_rss_mb"])
+        worker["stages"].merge(job_profile["stages"])
+
+    def to_dict(self):
+        """
+        Get the report as a dict that can be written as JSON.
+        """
+        totals = StageTimes(self.main.stages)
+        for worker in self.workers.values():
+            totals.merge(worker["stages"].stages)
+        return {"engine": self.engine,
+                "wall_time": time.perf_counter() - self.start,
+                "peak_rss_mb": get_peak_rss_mb(),
+                "stages": {name: totals.stages[name] for name in STAGES
+                           if name in totals.stages},
+                "main": {"worker": get_worker_id(), "stages": self.main.stages},
+                "workers": {worker_id: {**worker, "stages": worker["stages"].stages}
+                            for worker_id, worker in self.workers.items()}}
+
+    def write(self, report_path):
+        """
+        Write the report as JSON.
+
+        Args:
+            report_path (str): file to write
+        """
+        with open(report_path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=2)
+        print(f"profile written to {report_path}")
@@ -0,0 +1,76 @@
+"""
+Approximate statistics from a random sample of blocks.
+
+Instead of reading the whole file, the file is cut into blocks of block_size bytes and only a
+fraction of the blocks is read. The blocks are spread over the file: the file is divided into as
+many equal parts as there are blocks to read, and one random block is picked in every part. Every
+block becomes a normal (file_idx, start, end) job on record boundaries, so the engines run the
+sample like any other list of byte ranges, with accumulators made with sampled=True.
+"""
+import math
+import os
+
+import numpy
+
+from fastq_stats.chunking import find_record_start
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+
+def get_sample_byte_ranges(fastq_path, fraction, block_size=DEFAULT_BLOCK_SIZE, seed=None):
+    """
+    Pick random blocks of a fastq file.
+
+    Args:
+        fastq_path (str): path to the fastq file
+        fraction (float): part of the file to read (0 to 1), at least 2 blocks are read so the
+            standard error can be computed
+        block_size (int): size of a block in bytes
+        seed (int): seed for the random generator, None for a different sample every run
+
+    Returns:
+        list of (start, end) tuples, sorted on start
+    """
+    file_size = os.path.getsize(fastq_path)
+    n_blocks = max(1, file_size // block_size)
+    n_sampled = min(n_blocks, max(2, math.ceil(fraction * n_blocks)))
+
+    # one random block in each of n_sampled equal parts of the file
+    rng = numpy.random.default_rng(seed)
+    part_edges = numpy.linspace(0, n_blocks, n_sampled + 1)
+    block_idxs = numpy.unique(
+        numpy.floor(part_edges[:-1] + rng.random(n_sampled) * numpy.diff(part_edges)))
+
+    byte_ranges = []
+    for block_idx in block_idxs.astype(int).tolist():
+        start = find_record_start(fastq_path, block_idx * block_size)
+        # the last block also gets the bytes that are left at the end of the file
+        end = file_size
+        if block_idx < n_blocks - 1:
+            end = find_record_start(fastq_path, (block_idx + 1) * block_size)
+        if start < end:
+            byte_ranges.append((start, end))
+    return byte_ranges
+
+
+def make_sample_jobs(fastq_paths, fraction, block_size=DEFAULT_BLOCK_SIZE, seed=None):
+    """
+    Pick random blocks of every fastq file.
+
+    Args:
+        fastq_paths (list of str): the fastq files
+        fraction (float): part of every file to read
+        block_size (int): size of a block in bytes
+        seed (int): seed for the random generator
+
+    Returns:
+        list of (file_idx, start, end) tuples, one per block
+    """
+    rng = numpy.random.default_rng(seed)
+    jobs = []
+    for file_idx, fastq_path in enumerate(fastq_paths):
+        # every file gets its own seed from the main seed, so the files are not sampled alike
+        file_seed = int(rng.integers(2 ** 32))
+        for start, end in get_sample_byte_ranges(fastq_path, fraction, block_size, file_seed):
+            jobs.append((file_idx, start, end))
+    return jobs
@@ -0,0 +1,142 @@
+"""
+Seeded synthetic fastq files for benchmarks and checks.
+
+The reads get Illumina style names (so --by-tile works), random bases with a few N's and PHRED
+scores drawn around a quality profile: the mean score goes linearly from quality_start at the
+first base to quality_end at the last base of the longest read, with a normal spread of
+quality_sd, clipped to 2 to 41. The same seed always gives the same file.
+
+Example usage:
+    python3 -m fastq_stats.synthetic -o reads.fastq -n 1000000 --length 150 --min-length 50
+"""
+import argparse as ap
+import gzip
+import sys
+
+import numpy
+
+from fastq_stats.kernels import PHRED_OFFSET
+
+BASE_CHARS = numpy.frombuffer(b"ACGT", dtype=numpy.uint8)
+N_CHAR = ord("N")
+MIN_QUALITY = 2
+MAX_QUALITY = 41
+# reads generated at once
+BATCH_SIZE = 10000
+N_TILES = 4
+
+
+def argparser():
+    """
+    Argparse function for handling commandline arguments.
+    """
+    parser = ap.ArgumentParser(description="Write a seeded synthetic fastq file.")
+    parser.add_argument("-o", action="store", dest="output", required=True,
+                        help="Fastq file to write, gzip compressed if it ends with .gz")
+    parser.add_argument("-n", action="store", dest="n_reads", type=int, default=100000,
+                        help="Number of reads (default 100000)")
+    parser.add_argument("--length", action="store", type=int, default=150,
+                        help="Read length, the longest length for ragged reads (default 150)")
+    parser.add_argument("--min-length", action="store", type=int, dest="min_length",
+                        help="Shortest read length, reads get a random length between this and "
+                             "--length (default: all reads have the same length)")
+    parser.add_argument("--quality-start", action="store", type=float, default=36.0,
+                        dest="quality_start",
+                        help="Mean PHRED score of the first base (default 36)")
+    parser.add_argument("--quality-end", action="store", type=float, default=28.0,
+                        dest="quality_end",
+                        help="Mean PHRED score of the last base (default 28)")
+    parser.add_argument("--quality-sd", action="store", type=float, default=4.0,
+                        dest="quality_sd",
+                        help="Standard deviation of the PHRED scores around the mean "
+                             "(default 4)")
+    parser.add_argument("--n-rate", action="store", type=float, default=0.001, dest="n_rate",
+                        help="Fraction of the bases that is an N (default 0.001)")
+    parser.add_argument("--gzip", action="store_true",
+                        help="Compress the output with gzip, also without .gz at the end")
+    parser.add_argument("--seed", action="store", type=int, default=0,
+                        help="Seed for the random generator (default 0)")
+    return parser.parse_args()
+
+
+def generate_records(n_reads, length=150, min_length=None, quality_start=36.0,
+                     quality_end=28.0, quality_sd=4.0, n_rate=0.001, seed=0):
+    """
+    Generate synthetic fastq records.
+
+    Args:
+        n_reads (int): number of reads
+        length (int): read length, the longest length for ragged reads
+        min_length (int): shortest read length, None for reads of the same length
+        quality_start (float): mean PHRED score of the first base
+        quality_end (float): mean PHRED score of the last possible base
+        quality_sd (float): standard deviation of the scores around the mean
+        n_rate (float): fraction of the bases that is an N
+        seed (int): seed for the random generator
+
+    Yields:
+        bytes: a batch of complete records
+    """
+    rng = numpy.random.default_rng(seed)
+    profile = numpy.linspace(quality_start, quality_end, length)
+    for batch_start in range(0, n_reads, BATCH_SIZE):
+        batch_size = min(BATCH_SIZE, n_reads - batch_start)
+        if min_length is None:
+            lengths = numpy.full(batch_size, length)
+        else:
+            lengths = rng.integers(min_length, length + 1, batch_size)
+
+        scores = numpy.rint(rng.normal(profile, quality_sd, (batch_size, length)))
+        qualities = (numpy.clip(scores, MIN_QUALITY, MAX_QUALITY) + PHRED_OFFSET).astype(
+            numpy.uint8)
+        bases = BASE_CHARS[rng.integers(0, len(BASE_CHARS), (batch_size, length))]
+        bases[rng.random((batch_size, length)) < n_rate] = N_CHAR
+        x_coords = rng.integers(1000, 30000, batch_size)
+        y_coords = rng.integers(1000, 30000, batch_size)
+
+        records = []
+        for read_idx in range(batch_size):
+            read_length = lengths[read_idx]
+            read_nr = batch_start + read_idx
+            records.append(b"@SIM:1:FCSYNTH:1:%d:%d:%d %d:N:0:1\n%s\n+\n%s\n" % (
+                1101 + read_nr % N_TILES, x_coords[read_idx], y_coords[read_idx], read_nr + 1,
+                bases[read_idx, :read_length].tobytes(),
+                qualities[read_idx, :read_length].tobytes()))
+        yield b"".join(records)
+
+
+def write_fastq(output_path, n_reads, compress=None, **profile):
+    """
+    Write a synthetic fastq file.
+
+    Args:
+        output_path (str): file to write
+        n_reads (int): number of reads
+        compress (bool): gzip the file, default when output_path ends with .gz
+        **profile: length, min_length, quality_start, quality_end, quality_sd, n_rate and seed,
+            see generate_records
+    """
+    if compress is None:
+        compress = output_path.endswith(".gz")
+    opener = gzip.open if compress else open
+    with opener(output_path, "wb") as file:
+        for batch in generate_records(n_reads, **profile):
+            file.write(batch)
+
+
+def main():
+    """
+    Write the fastq file given on the commandline.
+    """
+    args = argparser()
+    if args.min_length is not None and not 0 <= args.min_length <= args.length:
+        sys.exit("--min-length has to be between 0 and --length")
+    write_fastq(args.output, args.n_reads, args.gzip or None, length=args.length,
+                min_length=args.min_length, quality_start=args.quality_start,
+                quality_end=args.quality_end, quality_sd=args.quality_sd, n_rate=args.n_rate,
+                seed=args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
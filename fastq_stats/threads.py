@@ -0,0 +1,98 @@
+"""
+Thread engine: run the jobs on threads in one process.
+
+Every fastq file is mapped into memory once (mmap) and all threads read their byte ranges from
+that map without copying. Every thread keeps its own accumulators and only the main thread merges
+them at the end, so the threads share nothing that is written to and nothing is pickled or sent
+between processes. This only helps when the decoding releases the GIL: the numba kernel does
+(see fastq_stats.kernels), most of the NumPy path does for big buffers.
+"""
+import contextlib
+import mmap
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from fastq_stats.accumulator import PhredAccumulator
+from fastq_stats.paired import SINGLE, get_output_names, process_layout_job
+from fastq_stats.profiling import RunReport, profile_job, profile_stage
+
+
+@contextlib.contextmanager
+def map_fastq_files(fastq_paths):
+    """
+    Map the fastq files into memory.
+
+    Args:
+        fastq_paths (list of str): the fastq files
+
+    Yields:
+        dict: fastq path -> mmap (read only), empty files are not mapped
+    """
+    with contextlib.ExitStack() as stack:
+        maps = {}
+        for fastq_path in fastq_paths:
+            file = stack.enter_context(open(fastq_path, "rb"))
+            # an empty file can not be mapped, but it has no jobs either
+            if fastq_path not in maps and file.seek(0, 2) > 0:
+                maps[fastq_path] = stack.enter_context(
+                    mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        yield maps
+
+
+def process_jobs_threaded(jobs, fastq_paths, n_threads, options=None, layout=SINGLE,
+                          report=None):
+    """
+    Run jobs on a pool of threads that read from one shared mmap per file.
+
+    Args:
+        jobs (list): jobs made by engine.make_jobs
+        fastq_paths (list of str): the fastq files
+        n_threads (int): number of threads
+        options (dict): options for the accumulators
+        layout (str): SINGLE, PAIRED or INTERLEAVED
+        report (RunReport): report to add the stages to (optional)
+
+    Returns:
+        list of PhredAccumulator, one for every output
+    """
+    options = options or {}
+    report = report or RunReport("threads")
+    output_names = get_output_names(fastq_paths, layout)
+    job_q = queue.SimpleQueue()
+    for job in jobs:
+        job_q.put(job)
+
+    with map_fastq_files(fastq_paths) as maps:
+        def read_range(fastq_path, start, end):
+            # a view on the map, the bytes are not copied
+            return memoryview(maps[fastq_path])[start:end]
+
+        def run_thread():
+            # accumulators of this thread only, so no locks are needed
+            accumulators = [PhredAccumulator(**options) for _ in output_names]
+            job_profiles = []
+            while True:
+                try:
+                    job = job_q.get_nowait()
+                except queue.Empty:
+                    return accumulators, job_profiles
+                with profile_job() as job_profile:
+                    results = process_layout_job(job, fastq_paths, layout, read_range,
+                                                 **options)
+                    with profile_stage("reduce"):
+                        for mate, accumulator in enumerate(results):
+                            accumulators[job[0] + mate].merge(accumulator)
+                job_profiles.append(job_profile)
+
+        with ThreadPoolExecutor(n_threads) as executor:
+            futures = [executor.submit(run_thread) for _ in range(n_threads)]
+            thread_results = [future.result() for future in futures]
+
+    accumulators = [PhredAccumulator(**options) for _ in output_names]
+    for thread_accumulators, job_profiles in thread_results:
+        for job_profile in job_profiles:
+            report.add_job(job_profile)
+        with report.stage("reduce"):
+            for accumulator, thread_accumulator in zip(accumulators, thread_accumulators):
+                accumulator.merge(thread_accumulator)
+    return accumulators
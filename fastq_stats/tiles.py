@@ -0,0 +1,83 @@
+"""
+Per flowcell, lane and tile breakdown of the PHRED scores.
+
+Illumina read names look like @DE18PCC762:31:D19K3ACXX:3:1101:2806:1965, that is
+@instrument:run:flowcell:lane:tile:x:y. The flowcell:lane:tile part of every header is cut out
+with numpy (no python loop over the reads), so a bad tile can be found in the same pass that
+decodes the quality scores.
+"""
+import csv
+
+import numpy
+
+COLON = ord(":")
+# the group key runs from the 2nd to the 5th colon of the read name
+KEY_FIRST_COLON = 2
+KEY_LAST_COLON = 5
+
+
+def get_tile_keys(data, starts, ends):
+    """
+    Get the flowcell:lane:tile key of every header line.
+
+    Args:
+        data (numpy.ndarray): uint8 view of the raw fastq bytes
+        starts (numpy.ndarray): start of every header line
+        ends (numpy.ndarray): end of every header line
+
+    Returns:
+        (keys, inverse) tuple: list with the unique keys (str) and the index in keys of every read
+
+    Raises:
+        ValueError: if a header is not an Illumina read name
+    """
+    if starts.size == 0:
+        return [], numpy.zeros(0, dtype=numpy.int64)
+
+    colons = numpy.flatnonzero(data == COLON)
+    # index of the first colon after the start of every header
+    first_colon = numpy.searchsorted(colons, starts)
+    last_idx = first_colon + KEY_LAST_COLON - 1
+    if last_idx.max() >= colons.size or (colons[last_idx] >= ends).any():
+        raise ValueError("read name is not in the Illumina "
+                         "@instrument:run:flowcell:lane:tile:x:y format")
+
+    key_starts = colons[first_colon + KEY_FIRST_COLON - 1] + 1
+    key_lengths = colons[last_idx] - key_starts
+
+    # copy the keys into a fixed width byte matrix and let numpy find the unique ones
+    width = int(key_lengths.max())
+    offsets = numpy.arange(width)
+    in_key = offsets < key_lengths[:, None]
+    key_bytes = numpy.where(in_key, data[numpy.where(in_key, key_starts[:, None] + offsets, 0)], 0)
+    key_strings = numpy.ascontiguousarray(key_bytes.astype(numpy.uint8)).view(f"S{width}").ravel()
+    keys, inverse = numpy.unique(key_strings, return_inverse=True)
+
+    return [key.decode() for key in keys], inverse.ravel()
+
+
+def write_tile_csv(csv_path, fastq_names, accumulators):
+    """
+    Write the per tile statistics of every fastq file to a CSV file.
+
+    Columns: fastq file, flowcell, lane, tile, base number, mean (and Q1, median, Q3 and
+    % >= Q30 when the accumulators have a histogram).
+
+    Args:
+        csv_path (str): file to write
+        fastq_names (list of str): name of every fastq file
+        accumulators (list of PhredAccumulator): accumulators made with group_by_tile=True
+    """
+    print("write tile outfile...")
+    with open(csv_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        header = ["file", "flowcell", "lane", "tile", "base", "mean"]
+        if accumulators and accumulators[0].histogram is not None:
+            header += ["q1", "median", "q3", "percent_q30"]
+        writer.writerow(header)
+
+        for fastq_name, accumulator in zip(fastq_names, accumulators):
+            for key in sorted(accumulator.groups):
+                flowcell, lane, tile = key.split(":")
+                for base_nr, values in enumerate(accumulator.groups[key].summary(), start=1):
+                    writer.writerow([fastq_name, flowcell, lane, tile, base_nr, *values])